@@ -1,5 +1,7 @@
-from bisect import bisect
+from bisect import bisect, bisect_left, insort
+from itertools import groupby
 import random
+import Snapshot
 
 class Node:
     def __init__(self, tree):
@@ -7,75 +9,131 @@ class Node:
         self.children = []
         self.parent = None
         self.tree = tree
+        # occurrence count of each value, only kept in multiset mode
+        self.counts = [] if tree.multiset else None
+        # number of values in the subtree, counting every occurrence
+        self.size = 0
 
     def degree(self):
         return len(self.vals) + 1
 
+    def weight(self, i):
+        """occurrence count of the i-th value"""
+        return 1 if self.counts is None else self.counts[i]
+
+    def own_size(self):
+        """number of values in this node, counting every occurrence"""
+        return len(self.vals) if self.counts is None else sum(self.counts)
+
     def split(self):
+        # the node keeps the left half and a new node takes the right half
+        stats = self.tree.stats
+        if stats is not None:
+            stats.op['splits'] += 1
         mid = len(self.vals) // 2
-        left = Node(self.tree)
-        left.vals = self.vals[:mid]
-        left.set_children(self.children[:mid + 1])
-        right = Node(self.tree)
+        mid_val = self.vals[mid]
+        mid_count = self.weight(mid)
+        right = type(self)(self.tree)
         right.vals = self.vals[mid + 1:]
-        right.set_children(self.children[mid + 1:])
-        return self.vals[mid], left, right
+        del self.vals[mid:]
+        if self.counts is not None:
+            right.counts = self.counts[mid + 1:]
+            del self.counts[mid:]
+        if self.children:
+            right.set_children(self.children[mid + 1:])
+            del self.children[mid + 1:]
+        right.size = right.own_size() + sum(child.size for child in right.children)
+        self.size -= right.size + mid_count
+        return mid_val, mid_count, self, right
 
-    def absorb(self, mid, left, right):
+    def absorb(self, mid, mid_count, left, right):
         # absorb a split child node
-        for i, val in enumerate(self.vals):
-            if mid < val:
-                self.vals = self.vals[:i] + [mid] + self.vals[i:]
-                self.set_children(self.children[:i] + [left, right] + self.children[i + 1:])
-                break
-        else:
-            self.vals = self.vals + [mid]
-            self.set_children(self.children[:-1] + [left, right])
+        i = bisect(self.vals, mid)
+        self.vals.insert(i, mid)
+        if self.counts is not None:
+            self.counts.insert(i, mid_count)
+        self.children[i] = left
+        self.children.insert(i + 1, right)
+        left.parent = self
+        right.parent = self
 
     def insert(self, insert_val):
-        # must insert to a leaf node
-        for i, val in enumerate(self.vals):
-            if insert_val < val:
-                self.vals = self.vals[:i] + [insert_val] + self.vals[i:]
-                return
-        self.vals.append(insert_val)
+        # must insert to a leaf node, the caller updates the size of ancestors
+        i = bisect(self.vals, insert_val)
+        self.vals.insert(i, insert_val)
+        if self.counts is not None:
+            self.counts.insert(i, 1)
+        self.size += 1
 
     def borrow(self, to, fr):
+        stats = self.tree.stats
+        if stats is not None:
+            # the sibling lent from is visited too
+            stats.op['borrows'] += 1
+            stats.op['visits'] += 1
         to_node = self.children[to]
         fr_node = self.children[fr]
+        # the value from self goes to to_node, and a value of fr_node goes up to self
         if to < fr:
+            moved_in = self.weight(to)
             to_node.vals.append(self.vals[to])
-            self.vals[to] = fr_node.vals[0]
-            fr_node.vals = fr_node.vals[1:]
+            self.vals[to] = fr_node.vals.pop(0)
+            if self.counts is not None:
+                to_node.counts.append(self.counts[to])
+                self.counts[to] = fr_node.counts.pop(0)
+            moved_out = self.weight(to)
             # if they have children to deal with
             if to_node.children:
-                to_node.children.append(fr_node.children[0])
-                fr_node.children = fr_node.children[1:]
-                to_node.children[-1].parent = to_node
+                child = fr_node.children.pop(0)
+                to_node.children.append(child)
+                child.parent = to_node
+                moved_in += child.size
+                moved_out += child.size
         else:
-            to_node.vals = [self.vals[fr]] + to_node.vals
-            self.vals[fr] = fr_node.vals[-1]
-            fr_node.vals = fr_node.vals[:-1]
+            moved_in = self.weight(fr)
+            to_node.vals.insert(0, self.vals[fr])
+            self.vals[fr] = fr_node.vals.pop()
+            if self.counts is not None:
+                to_node.counts.insert(0, self.counts[fr])
+                self.counts[fr] = fr_node.counts.pop()
+            moved_out = self.weight(fr)
             # if they have children to deal with
             if to_node.children:
-                to_node.children = [fr_node.children[-1]] + to_node.children
-                fr_node.children = fr_node.children[:-1]
-                to_node.children[0].parent = to_node
+                child = fr_node.children.pop()
+                to_node.children.insert(0, child)
+                child.parent = to_node
+                moved_in += child.size
+                moved_out += child.size
+        to_node.size += moved_in
+        fr_node.size -= moved_out
 
     def fuse(self, a, b):
+        # node a absorbs node b and the value between them
+        stats = self.tree.stats
+        if stats is not None:
+            # so is the sibling fused with
+            stats.op['fuses'] += 1
+            stats.op['visits'] += 1
         a, b = min(a, b), max(a, b)
         node_a, node_b = self.children[a], self.children[b]
-        new_node = Node(self.tree)
-        new_node.vals = node_a.vals + [self.vals[a]] + node_b.vals
-        new_node.set_children(node_a.children + node_b.children)
-        new_node.parent = self
+        node_a.vals.append(self.vals[a])
+        node_a.vals += node_b.vals
+        if self.counts is not None:
+            node_a.counts.append(self.counts[a])
+            node_a.counts += node_b.counts
+        for child in node_b.children:
+            child.parent = node_a
+        node_a.children += node_b.children
+        node_a.size += node_b.size + self.weight(a)
         del self.vals[a]
+        if self.counts is not None:
+            del self.counts[a]
+        del self.children[b]
         # the chidren of root node is fused and become new root
-        self.children[a:b + 1] = [new_node]
         if not self.vals and self is self.tree.root:
-            self.tree.root = self.children[0]
-            self.tree.root.parent = None
-        return new_node
+            self.tree.root = node_a
+            node_a.parent = None
+        return node_a
 
     def set_children(self, children):
         self.children = children
@@ -89,163 +147,634 @@ class Node:
         return not self.children or len(self.vals) == len(self.children) - 1
 
 class BTree:
-    def __init__(self, d):
+    # set by enable_stats in Stats.py
+    stats = None
+
+    def __init__(self, d, multiset=False):
+        """
+        in multiset mode a value can be inserted many times
+        each value is kept once with its occurrence count
+        """
+        self.multiset = multiset
         self.root = Node(self)
         self.d = d
+        # (min, max), or None until the next peek, see _get_ends
+        self._ends = None
+
+    @classmethod
+    def from_sorted(cls, iterable, d, fill=1.0, multiset=False):
+        """
+        build a tree from strictly increasing values in O(n), or non-decreasing values in multiset mode
+        leaves are packed to `fill` of their capacity, then internal levels are built bottom-up
+        """
+        tree = cls(d, multiset)
+        vals = list(iterable)
+        if multiset:
+            if not all(v1 <= v2 for v1, v2 in zip(vals, vals[1:])):
+                raise ValueError('values must be sorted')
+            runs = [(val, len(list(group))) for val, group in groupby(vals)]
+            vals = [val for val, _ in runs]
+            counts = [count for _, count in runs]
+        elif not all(v1 < v2 for v1, v2 in zip(vals, vals[1:])):
+            raise ValueError('values must be strictly increasing')
+        if not vals:
+            return tree
+        # leaf level: a leaf holds between d - 1 and 2d - 1 values
+        n = len(vals)
+        capacity = max(d - 1, min(2 * d - 1, round(fill * (2 * d - 1))))
+        count = min(-(-(n + 1) // (capacity + 1)), max(1, (n + 1) // d))
+        size, extra = divmod(n - count + 1, count)
+        nodes, separators, separator_counts = [], [], []
+        pos = 0
+        for i in range(count):
+            node = Node(tree)
+            end = pos + size + (i < extra)
+            node.vals = vals[pos:end]
+            if multiset:
+                node.counts = counts[pos:end]
+            node.size = node.own_size()
+            pos = end
+            nodes.append(node)
+            # the value between two leaves goes up to the parent level
+            if i < count - 1:
+                separators.append(vals[pos])
+                if multiset:
+                    separator_counts.append(counts[pos])
+                pos += 1
+        # internal levels: a node has between d and 2d children
+        capacity = max(d, min(2 * d, round(fill * 2 * d)))
+        while len(nodes) > 1:
+            m = len(nodes)
+            count = min(-(-m // capacity), max(1, m // d))
+            size, extra = divmod(m, count)
+            parents, parent_separators, parent_separator_counts = [], [], []
+            pos = 0
+            for i in range(count):
+                end = pos + size + (i < extra)
+                node = Node(tree)
+                node.vals = separators[pos:end - 1]
+                if multiset:
+                    node.counts = separator_counts[pos:end - 1]
+                node.set_children(nodes[pos:end])
+                node.size = node.own_size() + sum(child.size for child in node.children)
+                parents.append(node)
+                if i < count - 1:
+                    parent_separators.append(separators[end - 1])
+                    if multiset:
+                        parent_separator_counts.append(separator_counts[end - 1])
+                pos = end
+            nodes, separators, separator_counts = parents, parent_separators, parent_separator_counts
+        tree.root = nodes[0]
+        return tree
+
+    @classmethod
+    def bulk_load(cls, iterable, d, fill=1.0, multiset=False):
+        """build a tree from values in any order, duplicates are dropped unless in multiset mode"""
+        return cls.from_sorted(sorted(iterable if multiset else set(iterable)), d, fill, multiset)
 
-    def _search_insert_node(self, val, root):
-        if not root.children:
-            return root
-        return self._search_insert_node(val, root.children[bisect(root.vals, val)])
+    def dump(self, path):
+        """write the values to a snapshot file, every occurrence in multiset mode, see Snapshot.py"""
+        Snapshot.dump(path, 'btree', {'d': self.d, 'multiset': self.multiset}, self)
+
+    def freeze(self):
+        """a read-only copy in numpy arrays for vectorized batch queries, see Frozen.py, later updates of the tree do not reach it"""
+        # imported here so that importing B does not load numpy
+        from Frozen import FrozenBTree
+        return FrozenBTree(self)
+
+    @classmethod
+    def load(cls, path, fill=1.0):
+        """rebuild a tree from a snapshot file with from_sorted in O(n)"""
+        settings, vals = Snapshot.load(path, 'btree')
+        return cls.from_sorted(vals, settings['d'], fill, settings['multiset'])
 
     def search_val_node(self, val, root=None):
-        if root is None:
-            root = self.root
-        if val in root.vals:
-            return root
-        if not root.children:
-            return None
-        return self.search_val_node(val, root.children[bisect(root.vals, val)])
+        stats = self.stats
+        node = self.root if root is None else root
+        while True:
+            if stats is not None:
+                stats.op['visits'] += 1
+            i = bisect_left(node.vals, val)
+            if i < len(node.vals) and node.vals[i] == val:
+                return node
+            if not node.children:
+                return None
+            node = node.children[i]
 
     def has_val(self, val):
         return self.search_val_node(val) is not None
 
+    def count(self, val):
+        """occurrence count of a value"""
+        node = self.search_val_node(val)
+        if node is None:
+            return 0
+        return node.weight(bisect_left(node.vals, val))
+
+    def _path_child(self, path, node, i):
+        # record the i-th child of node, the last node on the path, with the bounds of its subtree
+        _, lo, hi = path[-1]
+        path.append((node.children[i], node.vals[i - 1] if i > 0 else lo, node.vals[i] if i < len(node.vals) else hi))
+
     def insert(self, val):
-        # bottom-up insertion
-        if self.has_val(val):
-            return
-        node = self._search_insert_node(val, self.root)
-        node.insert(val)
-        while node is not None: 
-            # node needs to be split
-            if node.degree() > 2 * self.d:
-                mid, left, right = node.split()
-                # push value and new nodes to parent node
-                if node.parent is not None:
-                    node.parent.absorb(mid, left, right)
-                else:
-                    # root was split
-                    new_root = Node(self)
-                    new_root.vals = [mid]
-                    new_root.set_children([left, right])
-                    left.parent = new_root
-                    right.parent = new_root
-                    self.root = new_root
-                    return
-                node = node.parent
-            else:
+        """insert a value with a single descent, return whether the tree changed"""
+        if not self._insert(self.root, val, None):
+            return False
+        self._extend_ends(val, val)
+        return True
+
+    def _insert(self, node, val, path):
+        """
+        insert a value into the subtree of node
+        path, if given, ends with node and records the descent down to the leaf as (node, lo, hi)
+        nodes split by the insertion are dropped from it
+        """
+        stats = self.stats
+        while True:
+            if stats is not None:
+                stats.op['visits'] += 1
+            i = bisect_left(node.vals, val)
+            if i < len(node.vals) and node.vals[i] == val:
+                if not self.multiset:
+                    return False
+                node.counts[i] += 1
+                self._add_size(node, 1)
+                return True
+            if not node.children:
                 break
-    
-    def delete(self, target, node=None):
-        # top-down delete
-        if node is None:
-            # case 0: value not in tree
-            if not self.has_val(target):
-                return
-            node = self.root
-        # case 1: value in children
-        if target not in node.vals:
-            for i, val in enumerate(node.vals):
-                if target < val:
-                    target_node = node.children[i]
-                    break
-            else:
-                i = len(node.vals)
-                target_node = node.children[-1]
-            # if target node doesn't have enough degree to delete, we need to either borrow or fuse
-            if target_node.degree() == self.d:
-                if i > 0 and node.children[i - 1].degree() > self.d:
-                    # can borrow from left sibling
-                    sibling = i - 1
-                elif i + 1 < len(node.children) and node.children[i + 1].degree() > self.d:
-                    # can borrow from right sibling
-                    sibling = i + 1
-                else:
-                    # cannot borrow
-                    sibling = None
-                if sibling is not None:
-                    # can borrow
-                    node.borrow(i, sibling)
-                else:
-                    # cannot borrow, we need to fuse two nodes
-                    sibling = i - 1 if i > 0 else i + 1
-                    target_node = node.fuse(i, sibling)
-            # now the target node must have enough degree to delete
-            self.delete(target, target_node)
-        # case 2: target value is in current node. 
+            if path is not None:
+                self._path_child(path, node, i)
+            node = node.children[i]
+        node.vals.insert(i, val)
+        if self.multiset:
+            node.counts.insert(i, 1)
+        self._add_size(node, 1)
+        # bottom-up split
+        while node.degree() > 2 * self.d:
+            if path is not None:
+                path.pop()
+            mid, mid_count, left, right = node.split()
+            # push value and new nodes to parent node
+            if node.parent is None:
+                # root was split
+                new_root = type(node)(self)
+                new_root.vals = [mid]
+                if self.multiset:
+                    new_root.counts = [mid_count]
+                new_root.set_children([left, right])
+                new_root.size = left.size + right.size + mid_count
+                self.root = new_root
+                break
+            node.parent.absorb(mid, mid_count, left, right)
+            node = node.parent
+        return True
+
+    def _add_size(self, node, delta, stop=None):
+        # update the subtree sizes from a node up to the root, or up to stop (excluded)
+        while node is not stop:
+            node.size += delta
+            node = node.parent
+
+    def _fix_child(self, node, i):
+        """
+        make sure the i-th child has more than d degree before going down to it
+        return the child to go down to
+        """
+        child = node.children[i]
+        if child.degree() > self.d:
+            return child
+        if i > 0 and node.children[i - 1].degree() > self.d:
+            # can borrow from left sibling
+            node.borrow(i, i - 1)
+        elif i + 1 < len(node.children) and node.children[i + 1].degree() > self.d:
+            # can borrow from right sibling
+            node.borrow(i, i + 1)
         else:
-            index = node.vals.index(target)
-            # if in leaf node, just delete 
-            # it must be the root
-            # or its degree must be larger than d (otherwise the caller will help borrow or fuse)
+            # cannot borrow, we need to fuse two nodes
+            child = node.fuse(i, i - 1 if i > 0 else i + 1)
+        return child
+
+    def delete(self, target, count=1):
+        """
+        top-down delete with a single descent, return whether the tree changed
+        in multiset mode, only count occurrences are removed
+        """
+        if count < 1:
+            raise ValueError('count must be positive')
+        if not self._delete(self.root, target, count, None):
+            return False
+        self._shrink_ends(target)
+        return True
+
+    def _delete(self, node, target, count, path):
+        """
+        delete a value from the subtree of node, which must be the root or have more than d degree
+        path, if given, ends with node and records the descent as (node, lo, hi)
+        """
+        stats = self.stats
+        while True:
+            if stats is not None:
+                stats.op['visits'] += 1
+            i = bisect_left(node.vals, target)
+            if i < len(node.vals) and node.vals[i] == target:
+                break
+            # value not in tree
             if not node.children:
-                del node.vals[index]
-            else:
-                left, right = node.children[index], node.children[index + 1]
-                # delete a value from left or right child node may reduce the degree of the node
-                # so before recursively delete, we must make sure its degree larger than d
-                if left.degree() == right.degree() == self.d:
-                    # cannot delete in either left or right node, must fuse first
-                    new_child = node.fuse(index, index + 1)
-                    # after fusng, the target value is in the child node
-                    self.delete(target, new_child)
-                elif left.degree() > self.d:
-                    left_max = self.get_max(left)
-                    self.delete(left_max, left)
-                    node.vals[index] = left_max
-                else:
-                    right_min = self.get_min(right)
-                    self.delete(right_min, right)
-                    node.vals[index] = right_min
+                return False
+            # now the child must have enough degree to delete from
+            child = self._fix_child(node, i)
+            if path is not None:
+                self._path_child(path, node, bisect_left(node.vals, target))
+            node = child
+        # target value is in current node
+        removed = node.weight(i)
+        if removed > count:
+            # some occurrences are left
+            node.counts[i] -= count
+            self._add_size(node, -count)
+            return True
+        while node.children:
+            left, right = node.children[i], node.children[i + 1]
+            if left.degree() > self.d or right.degree() > self.d:
+                # replace by the predecessor or successor
+                # continue down the rightmost path of left subtree or the leftmost path of right subtree
+                from_left = left.degree() > self.d
+                leaf = left if from_left else right
+                if stats is not None:
+                    stats.op['visits'] += 1
+                while leaf.children:
+                    leaf = self._fix_child(leaf, len(leaf.children) - 1 if from_left else 0)
+                    if stats is not None:
+                        stats.op['visits'] += 1
+                j = len(leaf.vals) - 1 if from_left else 0
+                moved = leaf.weight(j)
+                node.vals[i] = leaf.vals.pop(j)
+                if self.multiset:
+                    node.counts[i] = leaf.counts.pop(j)
+                # the replacement moved up from the leaf to the node
+                self._add_size(leaf, -moved, node)
+                self._add_size(node, -removed)
+                return True
+            # cannot delete in either left or right node, must fuse first
+            # after fusng, the target value is in the child node
+            child = node.fuse(i, i + 1)
+            if path is not None:
+                self._path_child(path, node, i)
+            node = child
+            if stats is not None:
+                stats.op['visits'] += 1
+            i = bisect_left(node.vals, target)
+        # in leaf node, just delete
+        # it is either the root or its degree is larger than d
+        del node.vals[i]
+        if self.multiset:
+            del node.counts[i]
+        self._add_size(node, -removed)
+        return True
+
+    def _covers(self, entry, val):
+        # whether the subtree of a path entry holds val
+        _, lo, hi = entry
+        return (lo is None or lo < val) and (hi is None or val < hi)
+
+    def insert_many(self, iterable):
+        """
+        insert a batch of values, return how many changed the tree
+        the batch is sorted, and each insertion resumes from the deepest node of the previous descent covering the value
+        """
+        changed = 0
+        path = []
+        for val in sorted(iterable):
+            while path and not self._covers(path[-1], val):
+                path.pop()
+            if not path:
+                path.append((self.root, None, None))
+            changed += self._insert(path[-1][0], val, path)
+            # every value of the batch is in the tree now, inserted or not
+            self._extend_ends(val, val)
+        return changed
+
+    def delete_many(self, iterable):
+        """
+        delete a batch of values, one occurrence each, return how many changed the tree
+        the batch is sorted, and each deletion resumes from the deepest node of the previous descent
+        which covers the value and can still lose a value
+        """
+        changed = 0
+        path = []
+        for val in sorted(iterable):
+            # the old root is gone if the root was fused away
+            if path and path[0][0] is not self.root:
+                del path[0]
+            while path and not (self._covers(path[-1], val) and (len(path) == 1 or path[-1][0].degree() > self.d)):
+                path.pop()
+            if not path:
+                path.append((self.root, None, None))
+            if self._delete(path[-1][0], val, 1, path):
+                changed += 1
+                self._shrink_ends(val)
+        return changed
+
+    def __len__(self):
+        return self.root.size
+
+    def _count_below(self, val, inclusive):
+        """number of values less than val, or not greater than val if inclusive"""
+        count = 0
+        node = self.root
+        while True:
+            i = (bisect if inclusive else bisect_left)(node.vals, val)
+            count += i if node.counts is None else sum(node.counts[:i])
+            if not node.children:
+                return count
+            for child in node.children[:i]:
+                count += child.size
+            node = node.children[i]
+
+    def rank(self, val):
+        """number of values less than val"""
+        return self._count_below(val, False)
+
+    def select(self, k):
+        """the k-th smallest value counted from 0, negative k counts from the largest"""
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError('tree index out of range')
+        node = self.root
+        while node.children:
+            for i, child in enumerate(node.children):
+                if k < child.size:
+                    node = child
+                    break
+                k -= child.size
+                if k < node.weight(i):
+                    return node.vals[i]
+                k -= node.weight(i)
+        if node.counts is None:
+            return node.vals[k]
+        for i, count in enumerate(node.counts):
+            if k < count:
+                return node.vals[i]
+            k -= count
+
+    def count_range(self, lo=None, hi=None, inclusive=(True, False)):
+        """number of values between lo and hi, with the same bounds as irange"""
+        count = len(self) if hi is None else self._count_below(hi, inclusive[1])
+        if lo is not None:
+            count -= self._count_below(lo, not inclusive[0])
+        return max(count, 0)
 
     def get_max(self, node):
-        if not node.children:
-            return node.vals[-1]
-        return self.get_max(node.children[-1])
+        while node.children:
+            node = node.children[-1]
+        return node.vals[-1]
 
     def get_min(self, node):
-        if not node.children:
-            return node.vals[0]
-        return self.get_min(node.children[0])
+        while node.children:
+            node = node.children[0]
+        return node.vals[0]
+
+    def _get_ends(self):
+        """
+        the min and max values, None for an empty tree
+        they are cached, inserts widen them and a delete of either end drops them until the next peek,
+        so peeks are O(1) but the first one after such a delete
+        """
+        if self._ends is None and self.root.vals:
+            self._ends = (self.get_min(self.root), self.get_max(self.root))
+        return self._ends
+
+    def _extend_ends(self, lo, hi):
+        if self._ends is not None:
+            self._ends = (min(lo, self._ends[0]), max(hi, self._ends[1]))
+
+    def _shrink_ends(self, val):
+        if self._ends is not None and val in self._ends:
+            self._ends = None
+
+    def min(self):
+        """the smallest value, in O(1)"""
+        ends = self._get_ends()
+        if ends is None:
+            raise ValueError('min() of an empty tree')
+        return ends[0]
+
+    def max(self):
+        """the largest value, in O(1)"""
+        ends = self._get_ends()
+        if ends is None:
+            raise ValueError('max() of an empty tree')
+        return ends[1]
+
+    def _pop_end(self, last):
+        """
+        remove and return one occurrence of the min, or of the max if last, in a single descent down the spine
+        the leaf it is taken from holds the next one, which replaces it in the cached ends
+        """
+        node = self.root
+        while node.children:
+            node = self._fix_child(node, len(node.children) - 1 if last else 0)
+        j = len(node.vals) - 1 if last else 0
+        val = node.vals[j]
+        if node.weight(j) > 1:
+            node.counts[j] -= 1
+        else:
+            del node.vals[j]
+            if self.multiset:
+                del node.counts[j]
+        self._add_size(node, -1)
+        if not node.vals:
+            # the root was the last leaf
+            self._ends = None
+        elif self._ends is not None:
+            self._ends = (self._ends[0], node.vals[-1]) if last else (node.vals[0], self._ends[1])
+        return val
+
+    def pop_min(self):
+        """remove and return the smallest value, one occurrence of it in multiset mode"""
+        if not self.root.vals:
+            raise ValueError('pop_min() of an empty tree')
+        return self._pop_end(False)
+
+    def pop_max(self):
+        """remove and return the largest value, one occurrence of it in multiset mode"""
+        if not self.root.vals:
+            raise ValueError('pop_max() of an empty tree')
+        return self._pop_end(True)
+
+    def _closest(self, val, above, inclusive):
+        """
+        the closest value to val above or below it, val itself if inclusive, None if there is none
+        a single descent: the separators of a node bound its children, so each candidate found deeper is closer
+        """
+        closest = None
+        node = self.root
+        while True:
+            if above:
+                i = (bisect_left if inclusive else bisect)(node.vals, val)
+                if i < len(node.vals):
+                    closest = node.vals[i]
+            else:
+                i = (bisect if inclusive else bisect_left)(node.vals, val)
+                if i > 0:
+                    closest = node.vals[i - 1]
+            if not node.children:
+                return closest
+            node = node.children[i]
+
+    def floor(self, val):
+        """the largest value not greater than val, or None"""
+        return self._closest(val, False, True)
+
+    def lower(self, val):
+        """the largest value less than val, or None"""
+        return self._closest(val, False, False)
+
+    def ceiling(self, val):
+        """the smallest value not less than val, or None"""
+        return self._closest(val, True, True)
+
+    def higher(self, val):
+        """the smallest value greater than val, or None"""
+        return self._closest(val, True, False)
+
+    def _iter_up(self, lo, inclusive):
+        """yield values from lo upwards with an explicit stack of (node, index)"""
+        nodes, indexes = [], []
+        node = self.root
+        while node is not None:
+            if lo is None:
+                i = 0
+            elif inclusive:
+                i = bisect_left(node.vals, lo)
+            else:
+                i = bisect(node.vals, lo)
+            nodes.append(node)
+            indexes.append(i)
+            node = node.children[i] if node.children else None
+        while nodes:
+            node, i = nodes[-1], indexes[-1]
+            if i == len(node.vals):
+                nodes.pop()
+                indexes.pop()
+                continue
+            if node.counts is None:
+                yield node.vals[i]
+            else:
+                for _ in range(node.counts[i]):
+                    yield node.vals[i]
+            indexes[-1] = i + 1
+            # go down to the leftmost leaf of the next subtree
+            node = node.children[i + 1] if node.children else None
+            while node is not None:
+                nodes.append(node)
+                indexes.append(0)
+                node = node.children[0] if node.children else None
+
+    def _iter_down(self, hi, inclusive):
+        """yield values from hi downwards with an explicit stack of (node, index)"""
+        nodes, indexes = [], []
+        node = self.root
+        while node is not None:
+            if hi is None:
+                i = len(node.vals)
+            elif inclusive:
+                i = bisect(node.vals, hi)
+            else:
+                i = bisect_left(node.vals, hi)
+            nodes.append(node)
+            indexes.append(i)
+            node = node.children[i] if node.children else None
+        while nodes:
+            node, i = nodes[-1], indexes[-1]
+            if i == 0:
+                nodes.pop()
+                indexes.pop()
+                continue
+            if node.counts is None:
+                yield node.vals[i - 1]
+            else:
+                for _ in range(node.counts[i - 1]):
+                    yield node.vals[i - 1]
+            indexes[-1] = i - 1
+            # go down to the rightmost leaf of the previous subtree
+            node = node.children[i - 1] if node.children else None
+            while node is not None:
+                nodes.append(node)
+                indexes.append(len(node.vals))
+                node = node.children[-1] if node.children else None
+
+    def irange(self, lo=None, hi=None, inclusive=(True, False), reverse=False):
+        """
+        lazily yield the values between lo and hi, a None bound is unbounded
+        seeking to the first value costs one descent, each following step is O(1) amortized
+        """
+        if reverse:
+            for val in self._iter_down(hi, inclusive[1]):
+                if lo is not None and (val < lo or not inclusive[0] and val == lo):
+                    return
+                yield val
+        else:
+            for val in self._iter_up(lo, inclusive[0]):
+                if hi is not None and (val > hi or not inclusive[1] and val == hi):
+                    return
+                yield val
+
+    def __iter__(self):
+        return self._iter_up(None, True)
+
+    def __reversed__(self):
+        return self._iter_down(None, True)
 
     def _get_nodes_depth(self, depth, node, depths):
-        if not node.children:
-            depths.append(depth)
-        for child in node.children:
-            self._get_nodes_depth(depth + 1, child, depths)
+        # the walks below keep stacks of their own instead of recursing
+        stack = [(node, depth)]
+        while stack:
+            node, depth = stack.pop()
+            if not node.children:
+                depths.append(depth)
+            stack += ((child, depth + 1) for child in reversed(node.children))
 
     def _get_nodes_degree(self, node, degrees):
-        degrees.append(node.degree())
-        for child in node.children:
-            self._get_nodes_degree(child, degrees)
+        # in preorder, so the first degree is the one of node
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            degrees.append(node.degree())
+            stack += reversed(node.children)
 
     def _collect_vals(self, arr, node):
-        if not node.children:
-            arr += node.vals
-        else:
-            for i, val in enumerate(node.vals):
-                self._collect_vals(arr, node.children[i])
-                arr.append(val)
-            self._collect_vals(arr, node.children[-1])
+        # (node, i): the value before the i-th child of node is next, then the subtree of the child
+        stack = [(node, 0)]
+        while stack:
+            node, i = stack.pop()
+            if not node.children:
+                arr += node.vals
+                continue
+            if i > 0:
+                arr.append(node.vals[i - 1])
+            if i < len(node.vals):
+                stack.append((node, i + 1))
+            stack.append((node.children[i], 0))
 
     def _validate_val_children_count(self, node):
-        if not node.children:
-            return True
-        if len(node.vals) != len(node.children) - 1:
-            return False
-        ans = True
-        for child in node.children:
-            return ans or self._validate_val_children_count(child)
-        return ans
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node.children and len(node.vals) != len(node.children) - 1:
+                return False
+            stack += node.children
+        return True
 
     def get_vals(self):
-        arr = []
-        self._collect_vals(arr, self.root)
-        return arr
+        # every occurrence is listed in multiset mode
+        return list(self)
 
     def validate(self):
         # check if all elements are in order
-        vals = self.get_vals()
+        vals = []
+        self._collect_vals(vals, self.root)
         if not all(v1 < v2 for v1, v2 in zip(vals, vals[1:])):
             print('values not in order:', vals)
             return False
@@ -253,6 +782,17 @@ class BTree:
         if not self._validate_val_children_count(self.root):
             print('value count and children count mismatch!')
             return False
+        # the size of every node must count the values in its subtree
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.counts is not None and (len(node.counts) != len(node.vals) or not all(count > 0 for count in node.counts)):
+                print('wrong occurrence counts:', node.counts)
+                return False
+            if node.size != node.own_size() + sum(child.size for child in node.children):
+                print('wrong subtree size:', node.size)
+                return False
+            stack += node.children
         # all leaf nodes must have the same depth
         depths = []
         self._get_nodes_depth(0, self.root, depths)
@@ -275,6 +815,296 @@ class BTree:
             return False
         return True
 
+class BPlusNode:
+    def __init__(self, tree):
+        # separators for internal nodes, values for leaf nodes
+        self.vals = []
+        self.children = []
+        # payloads of the values, only used by leaf nodes
+        self.payloads = []
+        self.parent = None
+        # neighbour leaves in the leaf chain
+        self.prev = None
+        self.next = None
+        self.tree = tree
+
+    def degree(self):
+        return len(self.vals) + 1
+
+    def split(self):
+        # the node keeps the left half and a new node takes the right half
+        right = BPlusNode(self.tree)
+        mid = len(self.vals) // 2
+        if not self.children:
+            # a leaf copies its first right value up and joins the chain
+            right.vals = self.vals[mid:]
+            right.payloads = self.payloads[mid:]
+            del self.vals[mid:]
+            del self.payloads[mid:]
+            right.prev = self
+            right.next = self.next
+            if self.next is not None:
+                self.next.prev = right
+            else:
+                self.tree.tail = right
+            self.next = right
+            return right.vals[0], right
+        # an internal node moves its middle separator up
+        mid_val = self.vals[mid]
+        right.vals = self.vals[mid + 1:]
+        right.set_children(self.children[mid + 1:])
+        del self.vals[mid:]
+        del self.children[mid + 1:]
+        return mid_val, right
+
+    def absorb(self, mid, right):
+        # absorb the right half of a split child node
+        i = bisect(self.vals, mid)
+        self.vals.insert(i, mid)
+        self.children.insert(i + 1, right)
+        right.parent = self
+
+    def borrow(self, to, fr):
+        to_node = self.children[to]
+        fr_node = self.children[fr]
+        if not to_node.children:
+            # leaves move a value directly and refresh the separator
+            if to < fr:
+                to_node.vals.append(fr_node.vals.pop(0))
+                to_node.payloads.append(fr_node.payloads.pop(0))
+                self.vals[to] = fr_node.vals[0]
+            else:
+                to_node.vals.insert(0, fr_node.vals.pop())
+                to_node.payloads.insert(0, fr_node.payloads.pop())
+                self.vals[fr] = to_node.vals[0]
+        elif to < fr:
+            # internal nodes rotate a separator through the parent
+            to_node.vals.append(self.vals[to])
+            self.vals[to] = fr_node.vals.pop(0)
+            child = fr_node.children.pop(0)
+            to_node.children.append(child)
+            child.parent = to_node
+        else:
+            to_node.vals.insert(0, self.vals[fr])
+            self.vals[fr] = fr_node.vals.pop()
+            child = fr_node.children.pop()
+            to_node.children.insert(0, child)
+            child.parent = to_node
+
+    def fuse(self, a, b):
+        # node a absorbs node b, the separator between them is dropped for leaves
+        a, b = min(a, b), max(a, b)
+        node_a, node_b = self.children[a], self.children[b]
+        if not node_a.children:
+            node_a.vals += node_b.vals
+            node_a.payloads += node_b.payloads
+            node_a.next = node_b.next
+            if node_b.next is not None:
+                node_b.next.prev = node_a
+            else:
+                self.tree.tail = node_a
+        else:
+            node_a.vals.append(self.vals[a])
+            node_a.vals += node_b.vals
+            for child in node_b.children:
+                child.parent = node_a
+            node_a.children += node_b.children
+        del self.vals[a]
+        del self.children[b]
+        return node_a
+
+    def set_children(self, children):
+        self.children = children
+        for child in children:
+            child.parent = self
+
+class BPlusTree:
+    """
+    B+ tree: values and payloads live in leaves chained by prev/next pointers
+    internal nodes only hold separators, a value equal to a separator is in the right subtree
+    """
+    def __init__(self, d):
+        self.root = BPlusNode(self)
+        self.d = d
+        # both ends of the leaf chain
+        self.head = self.tail = self.root
+
+    def _search_leaf(self, val):
+        node = self.root
+        while node.children:
+            node = node.children[bisect(node.vals, val)]
+        return node
+
+    def has_val(self, val):
+        leaf = self._search_leaf(val)
+        i = bisect_left(leaf.vals, val)
+        return i < len(leaf.vals) and leaf.vals[i] == val
+
+    def get(self, val, default=None):
+        """get the payload of a value"""
+        leaf = self._search_leaf(val)
+        i = bisect_left(leaf.vals, val)
+        if i < len(leaf.vals) and leaf.vals[i] == val:
+            return leaf.payloads[i]
+        return default
+
+    def insert(self, val, payload=None):
+        """insert a value, or replace its payload if present, return whether a value was added"""
+        node = self._search_leaf(val)
+        i = bisect_left(node.vals, val)
+        if i < len(node.vals) and node.vals[i] == val:
+            node.payloads[i] = payload
+            return False
+        node.vals.insert(i, val)
+        node.payloads.insert(i, payload)
+        # bottom-up split
+        while node.degree() > 2 * self.d:
+            mid, right = node.split()
+            if node.parent is None:
+                # root was split
+                new_root = BPlusNode(self)
+                new_root.vals = [mid]
+                new_root.set_children([node, right])
+                self.root = new_root
+                break
+            node.parent.absorb(mid, right)
+            node = node.parent
+        return True
+
+    def delete(self, val):
+        """delete a value, return whether the tree changed"""
+        node = self._search_leaf(val)
+        i = bisect_left(node.vals, val)
+        if i == len(node.vals) or node.vals[i] != val:
+            return False
+        del node.vals[i]
+        del node.payloads[i]
+        # bottom-up borrow or fuse
+        while node.parent is not None and node.degree() < self.d:
+            parent = node.parent
+            i = parent.children.index(node)
+            if i > 0 and parent.children[i - 1].degree() > self.d:
+                # can borrow from left sibling
+                parent.borrow(i, i - 1)
+                break
+            if i + 1 < len(parent.children) and parent.children[i + 1].degree() > self.d:
+                # can borrow from right sibling
+                parent.borrow(i, i + 1)
+                break
+            parent.fuse(i, i - 1 if i > 0 else i + 1)
+            node = parent
+        # the chidren of root node is fused and become new root
+        if not self.root.vals and self.root.children:
+            self.root = self.root.children[0]
+            self.root.parent = None
+        return True
+
+    def irange(self, lo=None, hi=None, inclusive=(True, False), reverse=False):
+        """
+        lazily yield the values between lo and hi, a None bound is unbounded
+        seeking costs one descent, then the scan follows the leaf chain
+        """
+        for val, _ in self.irange_items(lo, hi, inclusive, reverse):
+            yield val
+
+    def irange_items(self, lo=None, hi=None, inclusive=(True, False), reverse=False):
+        """same as irange, but yield (value, payload) pairs"""
+        if reverse:
+            if hi is None:
+                leaf, i = self.tail, len(self.tail.vals)
+            else:
+                leaf = self._search_leaf(hi)
+                i = (bisect if inclusive[1] else bisect_left)(leaf.vals, hi)
+            while leaf is not None:
+                vals, payloads = leaf.vals, leaf.payloads
+                while i > 0:
+                    i -= 1
+                    if lo is not None and (vals[i] < lo or not inclusive[0] and vals[i] == lo):
+                        return
+                    yield vals[i], payloads[i]
+                leaf = leaf.prev
+                if leaf is not None:
+                    i = len(leaf.vals)
+        else:
+            if lo is None:
+                leaf, i = self.head, 0
+            else:
+                leaf = self._search_leaf(lo)
+                i = (bisect_left if inclusive[0] else bisect)(leaf.vals, lo)
+            while leaf is not None:
+                vals, payloads = leaf.vals, leaf.payloads
+                while i < len(vals):
+                    if hi is not None and (vals[i] > hi or not inclusive[1] and vals[i] == hi):
+                        return
+                    yield vals[i], payloads[i]
+                    i += 1
+                leaf, i = leaf.next, 0
+
+    def items(self):
+        return self.irange_items()
+
+    def __iter__(self):
+        return self.irange()
+
+    def __reversed__(self):
+        return self.irange(reverse=True)
+
+    def get_vals(self):
+        arr = []
+        leaf = self.head
+        while leaf is not None:
+            arr += leaf.vals
+            leaf = leaf.next
+        return arr
+
+    def validate(self):
+        # walk level by level, every internal node must bound the values of its children
+        level = [(self.root, None, None)]
+        leaves = []
+        while level:
+            next_level = []
+            for node, lo, hi in level:
+                if node is not self.root and not self.d <= node.degree() <= 2 * self.d:
+                    print('degrees illegal with d =', self.d, ':', node.degree())
+                    return False
+                if any(v1 >= v2 for v1, v2 in zip(node.vals, node.vals[1:])):
+                    print('values not in order:', node.vals)
+                    return False
+                if node.vals and (lo is not None and node.vals[0] < lo or hi is not None and node.vals[-1] >= hi):
+                    print('values out of separator bounds:', node.vals, lo, hi)
+                    return False
+                if node.children:
+                    if len(node.vals) != len(node.children) - 1:
+                        print('value count and children count mismatch!')
+                        return False
+                    bounds = [lo] + node.vals + [hi]
+                    next_level += [(child, bounds[i], bounds[i + 1]) for i, child in enumerate(node.children)]
+                    if any(child.parent is not node for child in node.children):
+                        print('wrong parent pointer!')
+                        return False
+                else:
+                    if len(node.vals) != len(node.payloads):
+                        print('value count and payload count mismatch!')
+                        return False
+                    leaves.append(node)
+            # all leaf nodes must have the same depth
+            if leaves and next_level:
+                print('depths not all the same!')
+                return False
+            level = next_level
+        if self.root.children and len(self.root.children) < 2:
+            print('degrees illegal!')
+            return False
+        # the leaf chain must follow the in-order leaves
+        if self.head is not leaves[0] or self.tail is not leaves[-1]:
+            print('leaf chain ends are wrong!')
+            return False
+        for i, leaf in enumerate(leaves):
+            if leaf.prev is not (leaves[i - 1] if i > 0 else None) or leaf.next is not (leaves[i + 1] if i + 1 < len(leaves) else None):
+                print('leaf chain is broken!')
+                return False
+        return True
+
 if __name__ == '__main__':
     for _ in range(10):
         arr = [i for i in range(-1000, 1000)]
@@ -293,4 +1123,81 @@ if __name__ == '__main__':
                 tree.delete(deleted)
                 expected.remove(deleted)
                 assert(tree.validate())
-                assert(tree.get_vals() == sorted(list(expected)))
\ No newline at end of file
+                assert(tree.get_vals() == sorted(list(expected)))
+    # bulk loading must give the same values as inserting one by one
+    for _ in range(10):
+        arr = [random.randint(-1000, 1000) for _ in range(random.randint(0, 2000))]
+        tree = BTree.bulk_load(arr, random.randint(2, 10), fill=random.random())
+        assert(tree.validate())
+        assert(tree.get_vals() == sorted(set(arr)))
+    for _ in range(10):
+        arr = [i for i in range(-1000, 1000)]
+        random.shuffle(arr)
+        delete = arr[:200]
+        random.shuffle(arr)
+        tree = BPlusTree(random.randint(2, 10))
+        expected = set()
+        for i, a in enumerate(arr):
+            tree.insert(a)
+            expected.add(a)
+            assert(tree.validate())
+            assert(tree.get_vals() == sorted(list(expected)))
+            while delete and tree.has_val(delete[-1]):
+                deleted = delete.pop()
+                tree.delete(deleted)
+                expected.remove(deleted)
+                assert(tree.validate())
+                assert(list(tree) == sorted(list(expected)))
+    # multiset mode keeps one slot per value with its occurrence count
+    for _ in range(10):
+        tree = BTree(random.randint(2, 10), multiset=True)
+        expected = []
+        for _ in range(2000):
+            a = random.randint(-50, 50)
+            if random.random() < 0.7:
+                tree.insert(a)
+                expected.append(a)
+            elif a in expected:
+                tree.delete(a)
+                expected.remove(a)
+            assert(tree.validate())
+        assert(tree.get_vals() == sorted(expected))
+        assert(all(tree.count(a) == expected.count(a) for a in range(-50, 51)))
+    # neighbour queries and the cached ends against a sorted list
+    for multiset in [False, True]:
+        tree = BTree(random.randint(2, 5), multiset)
+        expected = []
+        for _ in range(5000):
+            a = random.randint(-500, 500)
+            op = random.random()
+            if op < 0.5:
+                if tree.insert(a):
+                    insort(expected, a)
+            elif op < 0.7:
+                if tree.delete(a):
+                    expected.remove(a)
+            elif op < 0.8:
+                tree.insert_many([a, a + 3, a - 700])
+                for b in [a, a + 3, a - 700]:
+                    if multiset or b not in expected:
+                        insort(expected, b)
+            elif expected:
+                assert(tree.pop_min() == expected.pop(0) if op < 0.9 else tree.pop_max() == expected.pop())
+                # a pop keeps the ends cached, the peeks below filled them
+                assert(tree._ends is not None or not expected)
+            if expected:
+                assert((tree.min(), tree.max()) == (expected[0], expected[-1]))
+            i, j = bisect_left(expected, a), bisect(expected, a)
+            assert(tree.floor(a) == (expected[j - 1] if j else None))
+            assert(tree.lower(a) == (expected[i - 1] if i else None))
+            assert(tree.ceiling(a) == (expected[i] if i < len(expected) else None))
+            assert(tree.higher(a) == (expected[j] if j < len(expected) else None))
+        assert(tree.validate() and tree.get_vals() == expected)
+        while expected:
+            assert(tree.pop_min() == expected.pop(0))
+        for peek in [tree.min, tree.pop_max]:
+            try:
+                peek()
+                assert(False)
+            except ValueError:
+                pass
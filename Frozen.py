@@ -0,0 +1,125 @@
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional, only frozen trees need it
+    np = None
+
+
+class FrozenBTree:
+    """
+    a read-only copy of a BTree in numpy arrays, answering batches of queries in C loops, built by BTree.freeze()
+    the distinct values are laid out in Eytzinger order, the breadth-first order of a complete binary search tree,
+    so the top levels every search goes through share a few cache lines, and a batch descends one level at a time:
+    every step is a vectorized gather and compare over the whole batch instead of a Python loop per key
+    values must be ints or floats that numpy stores natively
+    """
+    def __init__(self, tree):
+        if np is None:
+            raise ImportError('freeze() needs numpy')
+        if tree.multiset:
+            vals = np.array(list(tree))
+            # counts[i] is the number of values before the i-th distinct value, and the last one all of them
+            starts = np.flatnonzero(vals[1:] != vals[:-1]) + 1
+            if len(vals):
+                starts = np.concatenate(([0], starts))
+            self.vals = vals[starts]
+            self.counts = np.append(starts, len(vals))
+        else:
+            vals = []
+            tree._collect_vals(vals, tree.root)
+            self.vals = np.array(vals)
+            self.counts = None
+        if not len(self.vals):
+            self.vals = np.zeros(0, dtype=np.int64)
+        if self.vals.dtype.kind not in 'iuf':
+            raise TypeError('freeze() needs int or float values, not %s' % self.vals.dtype)
+        n = len(self.vals)
+        # a complete tree of 2 ** levels - 1 nodes, padded past the largest value with the greatest value of the type
+        self.levels = n.bit_length()
+        if self.vals.dtype.kind == 'f':
+            pad = np.inf
+        else:
+            pad = np.iinfo(self.vals.dtype).max
+        padded = np.full(2 ** self.levels - 1, pad, dtype=self.vals.dtype)
+        padded[:n] = self.vals
+        # node k at depth d is the in-order (2 (k - 2 ** d) + 1)-th of the 2 ** (levels - d) - 1 values of its level
+        self.layout = np.full(2 ** self.levels, pad, dtype=self.vals.dtype)
+        for depth in range(self.levels):
+            nodes = np.arange(2 ** depth, 2 ** (depth + 1))
+            self.layout[nodes] = padded[(2 * (nodes - 2 ** depth) + 1) * 2 ** (self.levels - 1 - depth) - 1]
+
+    def __len__(self):
+        return len(self.vals) if self.counts is None else int(self.counts[-1])
+
+    def _search(self, keys, inclusive):
+        """
+        for each key, the number of distinct values less than it, or not greater than it if inclusive
+        going right at a node sets the next bit of the node index, so after the last level
+        the bits below the leading one spell out how many values of the complete tree are on the left
+        """
+        keys = np.asarray(keys)
+        k = np.ones(keys.shape, dtype=np.int64)
+        right = np.empty(keys.shape, dtype=bool)
+        less = np.less_equal if inclusive else np.less
+        for _ in range(self.levels):
+            less(self.layout[k], keys, out=right)
+            k <<= 1
+            k += right
+        return np.minimum(k - 2 ** self.levels, len(self.vals))
+
+    def _count_below(self, keys, inclusive):
+        found = self._search(keys, inclusive)
+        return found if self.counts is None else self.counts[found]
+
+    def contains_many(self, keys):
+        """a bool array telling which keys are in the tree"""
+        keys = np.asarray(keys)
+        if not len(self.vals):
+            return np.zeros(keys.shape, dtype=bool)
+        found = self._search(keys, False)
+        return (found < len(self.vals)) & (self.vals[np.minimum(found, len(self.vals) - 1)] == keys)
+
+    def rank_many(self, keys):
+        """an int array of the number of values less than each key, as BTree.rank"""
+        return self._count_below(keys, False)
+
+    def range_count_many(self, lo, hi, inclusive=(True, False)):
+        """an int array of the number of values between each pair of lo and hi, as BTree.count_range"""
+        count = self._count_below(hi, inclusive[1]) - self._count_below(lo, not inclusive[0])
+        return np.maximum(count, 0)
+
+
+if __name__ == '__main__':
+    import random
+    from B import BTree
+    for n in [0, 1, 2, 3, 4, 7, 8, 100, 1000, 20000]:
+        for multiset in [False, True]:
+            if multiset:
+                vals = sorted(random.randrange(3 * n) for _ in range(n))
+                tree = BTree.from_sorted(vals, 3, multiset=True)
+            else:
+                vals = sorted(random.sample(range(-3 * n, 3 * n), n))
+                tree = BTree.from_sorted(vals, 3)
+            frozen = tree.freeze()
+            assert(len(frozen) == len(tree))
+            keys = np.arange(-3 * n - 2, 3 * n + 2)
+            assert(frozen.contains_many(keys).tolist() == [tree.has_val(int(key)) for key in keys])
+            assert(frozen.rank_many(keys).tolist() == [tree.rank(int(key)) for key in keys])
+            lo = np.array([random.randrange(-3 * n - 2, 3 * n + 2) for _ in range(1000)])
+            hi = lo + np.array([random.randrange(-5, n + 5) for _ in range(1000)])
+            for inclusive in [(True, False), (False, True), (True, True), (False, False)]:
+                expected = [tree.count_range(int(a), int(b), inclusive) for a, b in zip(lo, hi)]
+                assert(frozen.range_count_many(lo, hi, inclusive).tolist() == expected)
+    # floats, and keys at the limits of the type
+    frozen = BTree.from_sorted([0.5, 1.5, float('inf')], 2).freeze()
+    assert(frozen.contains_many([0.5, 1.0, np.inf]).tolist() == [True, False, True])
+    assert(frozen.rank_many([np.inf, 2.0]).tolist() == [2, 2])
+    limit = np.iinfo(np.int64).max
+    frozen = BTree.from_sorted([1, limit], 2).freeze()
+    assert(frozen.contains_many([limit, limit - 1]).tolist() == [True, False])
+    assert(frozen.rank_many([limit]).tolist() == [1])
+    try:
+        BTree.from_sorted(['a', 'b'], 2).freeze()
+        assert(False)
+    except TypeError:
+        pass
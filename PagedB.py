@@ -0,0 +1,436 @@
+import os
+import random
+import struct
+from bisect import bisect_left
+from collections import OrderedDict
+
+# file header in page 0: magic, version, d, root page id, page count, head of the free page list
+HEADER = struct.Struct('<4sBIIII')
+MAGIC = b'PBTR'
+VERSION = 1
+# page id 0 is the header, so it also means "no page"
+NO_PAGE = 0
+
+class Page:
+    """in-memory frame of a node page, children are page ids"""
+    def __init__(self, page_id):
+        self.page_id = page_id
+        self.vals = []
+        self.children = []
+        self.pins = 0
+        self.dirty = False
+
+    def degree(self):
+        return len(self.vals) + 1
+
+class BufferPool:
+    """
+    a bounded LRU cache of pages over the tree file
+    pinned pages are never evicted, dirty pages are written back when evicted or flushed
+    """
+    def __init__(self, file, d, capacity):
+        self.file = file
+        self.capacity = capacity
+        # page layout: leaf flag, value count, 2d - 1 int64 values, 2d uint32 child page ids
+        self.layout = struct.Struct('<BH%dq%dI' % (2 * d - 1, 2 * d))
+        self.d = d
+        self.page_size = max(self.layout.size, HEADER.size)
+        # page id -> page, least recently used first
+        self.frames = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.writes = 0
+
+    def _read(self, page_id):
+        self.file.seek(page_id * self.page_size)
+        fields = self.layout.unpack(self.file.read(self.layout.size))
+        leaf, count = fields[0], fields[1]
+        page = Page(page_id)
+        page.vals = list(fields[2:2 + count])
+        if not leaf:
+            children_start = 2 + 2 * self.d - 1
+            page.children = list(fields[children_start:children_start + count + 1])
+        return page
+
+    def _write(self, page):
+        vals = page.vals + [0] * (2 * self.d - 1 - len(page.vals))
+        children = page.children + [NO_PAGE] * (2 * self.d - len(page.children))
+        self.file.seek(page.page_id * self.page_size)
+        self.file.write(self.layout.pack(not page.children, len(page.vals), *vals, *children).ljust(self.page_size, b'\0'))
+        page.dirty = False
+        self.writes += 1
+
+    def _make_room(self):
+        while len(self.frames) >= self.capacity:
+            for page in self.frames.values():
+                if not page.pins:
+                    break
+            else:
+                raise RuntimeError('all %d pages in the buffer pool are pinned' % self.capacity)
+            if page.dirty:
+                self._write(page)
+            del self.frames[page.page_id]
+            self.evictions += 1
+
+    def pin(self, page_id):
+        page = self.frames.get(page_id)
+        if page is None:
+            self.misses += 1
+            self._make_room()
+            page = self._read(page_id)
+            self.frames[page_id] = page
+        else:
+            self.hits += 1
+            self.frames.move_to_end(page_id)
+        page.pins += 1
+        return page
+
+    def pin_new(self, page_id):
+        """pin an empty page which is not read from the file"""
+        self._make_room()
+        page = Page(page_id)
+        page.pins = 1
+        page.dirty = True
+        self.frames[page_id] = page
+        return page
+
+    def unpin(self, page, dirty=False):
+        assert page.pins > 0
+        page.pins -= 1
+        page.dirty = page.dirty or dirty
+
+    def flush(self):
+        for page in self.frames.values():
+            if page.dirty:
+                self._write(page)
+        self.file.flush()
+
+class PagedBTree:
+    """
+    a B tree of int64 values stored in fixed-size pages of a local file
+    nodes are addressed by page id and cached by a buffer pool of pool_size pages
+    insert splits full nodes and delete fixes small nodes on the way down, so at most four pages are pinned at once
+    """
+    def __init__(self, path, d=None, pool_size=64):
+        if pool_size < 4:
+            raise ValueError('the buffer pool needs at least 4 pages')
+        exists = os.path.exists(path) and os.path.getsize(path) > 0
+        self.file = open(path, 'r+b' if exists else 'w+b')
+        if exists:
+            magic, version, file_d, self.root_id, self.page_count, self.free_head = HEADER.unpack(self.file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                self.file.close()
+                raise ValueError('%s is not a paged B tree file' % path)
+            if d is not None and d != file_d:
+                self.file.close()
+                raise ValueError('%s was created with d = %d' % (path, file_d))
+            d = file_d
+        elif d is None:
+            self.file.close()
+            raise ValueError('d is needed to create a new file')
+        self.d = d
+        self.pool = BufferPool(self.file, d, pool_size)
+        if not exists:
+            self.page_count = 1
+            self.free_head = NO_PAGE
+            root = self._new_page()
+            self.root_id = root.page_id
+            self.pool.unpin(root)
+            self._write_header()
+
+    def _write_header(self):
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.d, self.root_id, self.page_count, self.free_head).ljust(self.pool.page_size, b'\0'))
+
+    def _new_page(self):
+        """allocate a pinned empty page, reusing freed pages first"""
+        if self.free_head != NO_PAGE:
+            page = self.pool.pin(self.free_head)
+            # a free page keeps the next free page id as its only child
+            self.free_head = page.children[0]
+            page.vals = []
+            page.children = []
+            page.dirty = True
+            return page
+        page = self.pool.pin_new(self.page_count)
+        self.page_count += 1
+        return page
+
+    def _free_page(self, page):
+        page.vals = []
+        page.children = [self.free_head]
+        self.free_head = page.page_id
+        self.pool.unpin(page, dirty=True)
+
+    @property
+    def stats(self):
+        """buffer pool counters, to size the pool against the working set"""
+        return {
+            'hits': self.pool.hits,
+            'misses': self.pool.misses,
+            'evictions': self.pool.evictions,
+            'writes': self.pool.writes,
+            'cached': len(self.pool.frames),
+            'capacity': self.pool.capacity,
+            'pages': self.page_count,
+        }
+
+    def flush(self):
+        self.pool.flush()
+        self._write_header()
+        self.file.flush()
+
+    def close(self):
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def has_val(self, val):
+        page_id = self.root_id
+        while True:
+            page = self.pool.pin(page_id)
+            i = bisect_left(page.vals, val)
+            found = i < len(page.vals) and page.vals[i] == val
+            page_id = page.children[i] if page.children else NO_PAGE
+            self.pool.unpin(page)
+            if found:
+                return True
+            if page_id == NO_PAGE:
+                return False
+
+    def _split_child(self, node, i, child):
+        """split a full child, node absorbs the middle value, return the new right page pinned"""
+        mid = len(child.vals) // 2
+        right = self._new_page()
+        right.vals = child.vals[mid + 1:]
+        right.children = child.children[mid + 1:]
+        node.vals.insert(i, child.vals[mid])
+        node.children.insert(i + 1, right.page_id)
+        del child.vals[mid:]
+        del child.children[mid + 1:]
+        node.dirty = child.dirty = True
+        return right
+
+    def insert(self, val):
+        """top-down insert splitting full nodes on the way, return whether the tree changed"""
+        node = self.pool.pin(self.root_id)
+        if len(node.vals) == 2 * self.d - 1:
+            # root is full, grow a new root
+            new_root = self._new_page()
+            new_root.children = [node.page_id]
+            self.pool.unpin(self._split_child(new_root, 0, node))
+            self.pool.unpin(node)
+            self.root_id = new_root.page_id
+            node = new_root
+        while True:
+            i = bisect_left(node.vals, val)
+            if i < len(node.vals) and node.vals[i] == val:
+                self.pool.unpin(node)
+                return False
+            if not node.children:
+                node.vals.insert(i, val)
+                self.pool.unpin(node, dirty=True)
+                return True
+            child = self.pool.pin(node.children[i])
+            if len(child.vals) == 2 * self.d - 1:
+                right = self._split_child(node, i, child)
+                if val == node.vals[i]:
+                    self.pool.unpin(right)
+                    self.pool.unpin(child)
+                    self.pool.unpin(node)
+                    return False
+                if val > node.vals[i]:
+                    child, right = right, child
+                self.pool.unpin(right)
+            self.pool.unpin(node)
+            node = child
+
+    def _fix_child(self, node, i):
+        """make sure the i-th child has more than d degree, return it pinned"""
+        child = self.pool.pin(node.children[i])
+        if child.degree() > self.d:
+            return child
+        if i > 0:
+            sibling = self.pool.pin(node.children[i - 1])
+            if sibling.degree() > self.d:
+                # borrow from left sibling
+                child.vals.insert(0, node.vals[i - 1])
+                node.vals[i - 1] = sibling.vals.pop()
+                if child.children:
+                    child.children.insert(0, sibling.children.pop())
+                node.dirty = child.dirty = sibling.dirty = True
+                self.pool.unpin(sibling)
+                return child
+            self.pool.unpin(sibling)
+        if i + 1 < len(node.children):
+            sibling = self.pool.pin(node.children[i + 1])
+            if sibling.degree() > self.d:
+                # borrow from right sibling
+                child.vals.append(node.vals[i])
+                node.vals[i] = sibling.vals.pop(0)
+                if child.children:
+                    child.children.append(sibling.children.pop(0))
+                node.dirty = child.dirty = sibling.dirty = True
+                self.pool.unpin(sibling)
+                return child
+            self.pool.unpin(sibling)
+        # cannot borrow, fuse with a sibling
+        if i > 0:
+            left, right, i = self.pool.pin(node.children[i - 1]), child, i - 1
+        else:
+            left, right = child, self.pool.pin(node.children[i + 1])
+        left.vals.append(node.vals[i])
+        left.vals += right.vals
+        left.children += right.children
+        del node.vals[i]
+        del node.children[i + 1]
+        node.dirty = left.dirty = True
+        self._free_page(right)
+        if right is child:
+            return left
+        return child
+
+    def _release(self, node, is_root, dirty=False):
+        """unpin a node on the delete path"""
+        if is_root and not node.vals and node.children:
+            # the chidren of root node is fused and become new root
+            self.root_id = node.children[0]
+            self._free_page(node)
+        else:
+            self.pool.unpin(node, dirty)
+
+    def delete(self, val):
+        """top-down delete fixing small nodes on the way, return whether the tree changed"""
+        node = self.pool.pin(self.root_id)
+        is_root = True
+        while True:
+            i = bisect_left(node.vals, val)
+            if i < len(node.vals) and node.vals[i] == val:
+                break
+            if not node.children:
+                self._release(node, is_root)
+                return False
+            child = self._fix_child(node, i)
+            self._release(node, is_root)
+            node, is_root = child, False
+        while node.children:
+            left = self.pool.pin(node.children[i])
+            right = self.pool.pin(node.children[i + 1])
+            if left.degree() > self.d or right.degree() > self.d:
+                # replace by predecessor or successor, pulled up from a leaf on the way down
+                from_left = left.degree() > self.d
+                leaf = left if from_left else right
+                self.pool.unpin(right if from_left else left)
+                while leaf.children:
+                    child = self._fix_child(leaf, len(leaf.children) - 1 if from_left else 0)
+                    self.pool.unpin(leaf)
+                    leaf = child
+                node.vals[i] = leaf.vals.pop() if from_left else leaf.vals.pop(0)
+                self.pool.unpin(leaf, dirty=True)
+                self._release(node, is_root, dirty=True)
+                return True
+            # fuse both children, the value goes down into the fused node
+            left.vals.append(node.vals[i])
+            left.vals += right.vals
+            left.children += right.children
+            del node.vals[i]
+            del node.children[i + 1]
+            left.dirty = node.dirty = True
+            self._free_page(right)
+            self._release(node, is_root)
+            node, is_root = left, False
+            i = bisect_left(node.vals, val)
+        del node.vals[i]
+        self._release(node, is_root, dirty=True)
+        return True
+
+    def __iter__(self):
+        # explicit stack of (page id, index), pages are only pinned while read
+        stack = []
+        page_id = self.root_id
+        while page_id != NO_PAGE:
+            page = self.pool.pin(page_id)
+            stack.append([page_id, 0])
+            page_id = page.children[0] if page.children else NO_PAGE
+            self.pool.unpin(page)
+        while stack:
+            page = self.pool.pin(stack[-1][0])
+            i = stack[-1][1]
+            if i == len(page.vals):
+                self.pool.unpin(page)
+                stack.pop()
+                continue
+            val = page.vals[i]
+            page_id = page.children[i + 1] if page.children else NO_PAGE
+            self.pool.unpin(page)
+            stack[-1][1] = i + 1
+            yield val
+            while page_id != NO_PAGE:
+                page = self.pool.pin(page_id)
+                stack.append([page_id, 0])
+                page_id = page.children[0] if page.children else NO_PAGE
+                self.pool.unpin(page)
+
+    def get_vals(self):
+        return list(self)
+
+    def validate(self):
+        vals = self.get_vals()
+        if not all(v1 < v2 for v1, v2 in zip(vals, vals[1:])):
+            print('values not in order:', vals)
+            return False
+        # walk level by level, checking degrees and that all leaves have the same depth
+        level = [self.root_id]
+        while level:
+            next_level = []
+            leaves = 0
+            for page_id in level:
+                page = self.pool.pin(page_id)
+                self.pool.unpin(page)
+                if page.children and len(page.vals) != len(page.children) - 1:
+                    print('value count and children count mismatch!')
+                    return False
+                if page_id != self.root_id and not self.d <= page.degree() <= 2 * self.d:
+                    print('degrees illegal with d =', self.d, ':', page.degree())
+                    return False
+                leaves += not page.children
+                next_level += page.children
+            if leaves and leaves != len(level):
+                print('depths not all the same!')
+                return False
+            level = next_level
+        if any(page.pins for page in self.pool.frames.values()):
+            print('pages left pinned!')
+            return False
+        return True
+
+if __name__ == '__main__':
+    import tempfile
+    for _ in range(10):
+        path = os.path.join(tempfile.mkdtemp(), 'tree.pages')
+        d = random.randint(2, 10)
+        tree = PagedBTree(path, d, pool_size=random.randint(4, 20))
+        expected = set()
+        for _ in range(3000):
+            val = random.randint(-1000, 1000)
+            if random.random() < 0.6:
+                assert(tree.insert(val) == (val not in expected))
+                expected.add(val)
+            else:
+                assert(tree.delete(val) == (val in expected))
+                expected.discard(val)
+        assert(tree.validate())
+        assert(tree.get_vals() == sorted(expected))
+        tree.close()
+        # reopen from disk with a cold pool
+        with PagedBTree(path, pool_size=8) as tree:
+            assert(tree.get_vals() == sorted(expected))
+            assert(tree.validate())
+            print(tree.stats)
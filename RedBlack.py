@@ -1,95 +1,255 @@
+import copy
 import random
-from tqdm import tqdm
+import Snapshot
+
+# child directions, for code written once for both sides
+LEFT = 0
+RIGHT = 1
 
 class Node:
-    def __init__(self, val, tree):
-        self.tree = tree
+    # slots keep nodes small, and leave the cyclic garbage collector one object per node to traverse
+    # agg is only set in augmented trees
+    __slots__ = ('val', 'left', 'right', 'parent', 'black', 'agg')
+
+    def __init__(self, val):
         self.val = val
-        self._left = None
-        self._right = None
+        self.left = None
+        self.right = None
         self.parent = None
         # True for black, False for red
         self.black = False
 
-    def flipped(self):
-        """Check if this node is flipped"""
-        if self.tree is None:
-            return False
-        return self.tree.flipped
-
-    def left(self):
-        return self._left if not self.flipped() else self._right
+    def child(self, direction):
+        return self.right if direction else self.left
 
-    def right(self):
-        return self._right if not self.flipped() else self._left
-
-    def set_left(self, child):
-        if not self.flipped():
-            self._left = child
+    def set_child(self, direction, child):
+        if direction:
+            self.right = child
         else:
-            self._right = child
+            self.left = child
         if child is not None:
             child.parent = self
 
-    def set_right(self, child):
-        if not self.flipped():
-            self._right = child
-        else:
-            self._left = child
-        if child is not None:
-            child.parent = self
-    
     def __str__(self) -> str:
-        return ("%s:%d:%s" % (('b' if self.black else 'r'), self.val, self.parent if self.parent is None else self.parent.val))
+        return ("%s:%s:%s" % (('b' if self.black else 'r'), self.val, self.parent if self.parent is None else self.parent.val))
 
 
 class RedBlackTree:
-    def __init__(self):
+    # whether nodes hold an aggregate of their subtree, see AugmentedRedBlackTree
+    augmented = False
+    # set by enable_stats in Stats.py
+    stats = None
+
+    def __init__(self, persistent=False):
+        """
+        in persistent mode nodes are never changed once built, an update copies the nodes on its path instead
+        so snapshot() can share the whole tree in O(1), and parent pointers are not kept
+        """
         self.root = None
-        self.flipped = False
+        self.persistent = persistent
+        # (min, max), or None until the next peek, see _get_ends
+        self._ends = None
+
+    @classmethod
+    def from_sorted(cls, iterable, *args, **kwargs):
+        """
+        build a tree from strictly increasing values in O(n), the other arguments go to the constructor
+        the tree is perfectly balanced, every level is full but the deepest, whose nodes are painted red
+        """
+        tree = cls(*args, **kwargs)
+        vals = list(iterable)
+        if not all(v1 < v2 for v1, v2 in zip(vals, vals[1:])):
+            raise ValueError('values must be strictly increasing')
+        tree.root = tree._build(vals, 0, len(vals), 0, (len(vals) + 1).bit_length() - 1)
+        return tree
 
-    def flip(self):
-        """flip the tree: left <-> right"""
-        self.flipped = not self.flipped
+    def _build(self, vals, lo, hi, depth, full):
+        """build a perfectly balanced tree of vals[lo:hi] at depth, the nodes below the full levels are red"""
+        if lo == hi:
+            return None
+        mid = (lo + hi) // 2
+        node = Node(vals[mid])
+        node.black = depth < full
+        node.set_child(LEFT, self._build(vals, lo, mid, depth + 1, full))
+        node.set_child(RIGHT, self._build(vals, mid + 1, hi, depth + 1, full))
+        if self.augmented:
+            self._update(node)
+        return node
+
+    def dump(self, path):
+        """write the values to a snapshot file, see Snapshot.py"""
+        Snapshot.dump(path, 'red-black', {'persistent': self.persistent}, self)
+
+    @classmethod
+    def load(cls, path, *args, **kwargs):
+        """
+        rebuild a tree from a snapshot file with from_sorted in O(n), the other arguments go to the constructor
+        an augmented tree needs its measure and combine again, they are functions and not kept in the file
+        """
+        settings, vals = Snapshot.load(path, 'red-black')
+        kwargs.setdefault('persistent', settings['persistent'])
+        return cls.from_sorted(vals, *args, **kwargs)
 
     def black(self, node):
         """check if a node black (null node is black)"""
         return node is None or node.black
 
     def _get_node(self, val, node):
-        # reach leaf node
-        if node is None:
-            return None
-        if node.val == val:
-            return node
-        if node.val < val:
-            return self._get_node(val, node.right())
-        else:
-            return self._get_node(val, node.left())
+        stats = self.stats
+        while node is not None:
+            if stats is not None:
+                stats.op['visits'] += 1
+            node_val = node.val
+            if val < node_val:
+                node = node.left
+            elif node_val < val:
+                node = node.right
+            else:
+                return node
+        return None
 
     def has_val(self, val):
         return self._get_node(val, self.root)
 
-    def _insert_leaf(self, node, new_node):
+    def _spine(self, node, d):
+        """the last node down the spine of direction d from node, the min or the max of its subtree"""
+        stats = self.stats
+        if stats is not None:
+            stats.op['visits'] += 1
+        if d == RIGHT:
+            while node.right is not None:
+                node = node.right
+                if stats is not None:
+                    stats.op['visits'] += 1
+        else:
+            while node.left is not None:
+                node = node.left
+                if stats is not None:
+                    stats.op['visits'] += 1
+        return node
+
+    def _end(self, d):
+        """the last node down the spine of direction d from the root, the min or the max"""
+        return self._spine(self.root, d)
+
+    def _get_ends(self):
         """
-        add a new node to where it should be
-        simply dfs find the location and insert
-        node is None only when root is None, so just set the root
+        the min and max values, None for an empty tree
+        they are cached, inserts widen them and a delete of either end drops them until the next peek,
+        so peeks are O(1) but the first one after such a delete
         """
-        if node == None:
-            # root node is black
-            new_node.black = True
-            self.root = new_node
-        elif new_node.val < node.val:
-            if node.left() is None:
-                node.set_left(new_node)
-            else:
-                self._insert_leaf(node.left(), new_node)
+        if self._ends is None and self.root is not None:
+            self._ends = (self._end(LEFT).val, self._end(RIGHT).val)
+        return self._ends
+
+    def _extend_ends(self, lo, hi):
+        if self._ends is not None:
+            self._ends = (min(lo, self._ends[0]), max(hi, self._ends[1]))
+
+    def _shrink_ends(self, val):
+        if self._ends is not None and val in self._ends:
+            self._ends = None
+
+    def min(self):
+        """the smallest value, in O(1)"""
+        ends = self._get_ends()
+        if ends is None:
+            raise ValueError('min() of an empty tree')
+        return ends[0]
+
+    def max(self):
+        """the largest value, in O(1)"""
+        ends = self._get_ends()
+        if ends is None:
+            raise ValueError('max() of an empty tree')
+        return ends[1]
+
+    def _pop_end(self, d):
+        """
+        remove and return the min, or the max for RIGHT, from the end of the spine of direction d
+        the next one is its only child, or else its parent, and replaces it in the cached ends
+        """
+        parent = None
+        node = self.root
+        if d == RIGHT:
+            while node.right is not None:
+                parent = node
+                node = node.right
+            after = node.left
+        else:
+            while node.left is not None:
+                parent = node
+                node = node.left
+            after = node.right
+        # the only child of a red-black node is a red leaf
+        if after is None:
+            after = parent
+        if self.persistent:
+            # persistent nodes have no parent pointers, the path is copied from the root
+            self.root = self._blacken(self._persistent_delete(self.root, node.val))
         else:
-            if node.right() is None:
-                node.set_right(new_node)
+            self._delete_node(node)
+        if after is None:
+            self._ends = None
+        elif self._ends is not None:
+            self._ends = (self._ends[0], after.val) if d == RIGHT else (after.val, self._ends[1])
+        return node.val
+
+    def pop_min(self):
+        """remove and return the smallest value"""
+        if self.root is None:
+            raise ValueError('pop_min() of an empty tree')
+        return self._pop_end(LEFT)
+
+    def pop_max(self):
+        """remove and return the largest value"""
+        if self.root is None:
+            raise ValueError('pop_max() of an empty tree')
+        return self._pop_end(RIGHT)
+
+    def _closest(self, val, d, inclusive):
+        """
+        the closest value to val in direction d, val itself if inclusive, None if there is none
+        a single descent: every node passed on the side d of val is closer than the ones passed before
+        """
+        closest = None
+        node = self.root
+        while node is not None:
+            node_val = node.val
+            if inclusive and node_val == val:
+                return node_val
+            if (val < node_val) if d == RIGHT else (node_val < val):
+                closest = node_val
+                node = node.child(1 - d)
             else:
-                self._insert_leaf(node.right(), new_node)
+                node = node.child(d)
+        return closest
+
+    def floor(self, val):
+        """the largest value not greater than val, or None"""
+        return self._closest(val, LEFT, True)
+
+    def lower(self, val):
+        """the largest value less than val, or None"""
+        return self._closest(val, LEFT, False)
+
+    def ceiling(self, val):
+        """the smallest value not less than val, or None"""
+        return self._closest(val, RIGHT, True)
+
+    def higher(self, val):
+        """the smallest value greater than val, or None"""
+        return self._closest(val, RIGHT, False)
+
+    def _update(self, node):
+        """recompute the augmentation of node from its children, only called when augmented"""
+        pass
+
+    def _refresh(self, node):
+        """recompute the augmentation from node up to the root"""
+        while node is not None:
+            self._update(node)
+            node = node.parent
 
     def get_black_parent(self, node):
         if node.black:
@@ -103,209 +263,759 @@ class RedBlackTree:
         # node, parent, and grandparent must not be all red
         assert(False)
 
-    def _rotate(self, root, new_root, l, r, lr, rl, root_black=None, l_black=None, r_black=None):
-        """
-        uniform rotate operation, parameters give the current root and the expected structure and color
-        black should be None if no change
-        """
-        parent = root.parent
-        if parent is None:
-            self.root = new_root
-            new_root.parent = None
-        elif parent.left() is root:
-            parent.set_left(new_root)
+    def _lift(self, node):
+        """rotate node above its parent, the inner subtree of node moves to the parent"""
+        if self.stats is not None:
+            self.stats.op['rotations'] += 1
+        parent = node.parent
+        if parent.left is node:
+            inner = node.right
+            parent.left = inner
+            node.right = parent
         else:
-            parent.set_right(new_root)
-        # set color and relationship
-        if root_black is not None:
-            new_root.black = root_black
-        new_root.set_left(l)
-        new_root.set_right(r)
-        if l is not None:
-            l.set_right(lr)
-            if l_black is not None:
-                l.black = l_black
-        if r is not None:
-            r.set_left(rl)
-            if r_black is not None:
-                r.black = r_black
-            
-
-    def _insert_adjust_cluster(self, root):
-        """
-        adjust a 2-3-4 cluster so that there is no red grandson, return the new root node
-        there is at most one red grandson
-        """
-        left = root.left()
-        right = root.right()
-        lred = left and not left.black
-        rred = right and not right.black
-        if lred and rred:
-            # if it is a 4 cluster, push black down
-            for grandson in [left.left(), left.right(), right.left(), right.right()]:
-                if grandson and not grandson.black:
-                    root.black = False
-                    left.black = True
-                    right.black = True
-                    # need to adjust parents
-                    return root
-            return root
-        elif lred:
-            llred = left.left() and not left.left().black
-            lrred = left.right() and not left.right().black
-            # ll and lr could not be both red
-            assert(not (llred and lrred))
-            # let's rotate
-            if llred:
-                self._rotate(root, left, left.left(), root, left.left().right(), left.right(), True, False, False)
-                return left
-            elif lrred:
-                self._rotate(root, left.right(), left, root, left.right().left(), left.right().right(), True, False, False)
-                return left.right()
-        elif rred:
-            rlred = right.left() and not right.left().black
-            rrred = right.right() and not right.right().black
-            # ll and lr could not be both red
-            assert(not (rlred and rrred))
-            # let's _rotate
-            if rlred:
-                self._rotate(root, right.left(), root, right, right.left().left(), right.left().right(), True, False, False)
-                return right.left()
-            elif rrred:
-                self._rotate(root, right, root, right.right(), right.left(), right.right().left(), True, False, False)
-                return right
-        return root
+            inner = node.left
+            parent.right = inner
+            node.left = parent
+        if inner is not None:
+            inner.parent = parent
+        grandparent = parent.parent
+        node.parent = grandparent
+        parent.parent = node
+        if grandparent is None:
+            self.root = node
+        elif grandparent.left is parent:
+            grandparent.left = node
+        else:
+            grandparent.right = node
+        if self.augmented:
+            # the subtrees below are untouched, and node holds what parent held
+            self._update(parent)
+            self._update(node)
 
     def insert(self, val):
-        if self.has_val(val):
-            return
+        """insert a value, return whether the tree changed"""
+        if self.persistent:
+            if self._get_node(val, self.root) is not None:
+                return False
+            self.root = self._blacken(self._persistent_insert(self.root, val))
+        elif not self._insert_from(self.root, val)[0]:
+            return False
+        self._extend_ends(val, val)
+        return True
+
+    def _insert_from(self, node, val):
+        """
+        insert a value into the subtree of node, which must hold its position
+        return whether the tree changed, and the node holding the value
+        """
+        # find the leaf position, or the node already holding the value
+        stats = self.stats
+        parent = None
+        while node is not None:
+            if stats is not None:
+                stats.op['visits'] += 1
+            node_val = node.val
+            if val < node_val:
+                parent = node
+                node = node.left
+            elif node_val < val:
+                parent = node
+                node = node.right
+            else:
+                return False, node
 
         # insert the new value to a leaf node
-        new_node = Node(val, self)
-        self._insert_leaf(self.root, new_node)
+        new_node = Node(val)
+        if self.augmented:
+            self._update(new_node)
+        if parent is None:
+            # root node is black
+            new_node.black = True
+            self.root = new_node
+            return True, new_node
+        new_node.parent = parent
+        if val < parent.val:
+            parent.left = new_node
+        else:
+            parent.right = new_node
+        if not parent.black:
+            self._fix_red(new_node)
+        if self.augmented:
+            # the rotations keep the nodes off the path right, so only the ancestors are stale
+            self._refresh(new_node)
+        return True, new_node
+
+    def _fix_red(self, node):
+        """
+        fix a red node which may have a red parent, while its subtrees are valid
+        return whether the black height of the tree grew
+        """
+        stats = self.stats
+        parent = node.parent
+        while parent is not None and not parent.black:
+            # a red parent is never the root
+            grandparent = parent.parent
+            if grandparent.left is parent:
+                uncle = grandparent.right
+                inner = parent.right is node
+            else:
+                uncle = grandparent.left
+                inner = parent.left is node
+            if uncle is not None and not uncle.black:
+                # a 4 cluster, push black down and continue from the grandparent
+                parent.black = True
+                uncle.black = True
+                grandparent.black = False
+                if stats is not None:
+                    stats.op['recolors'] += 3
+                node = grandparent
+                parent = node.parent
+                continue
+            if inner:
+                # an inner red grandson, make it outer first
+                self._lift(node)
+                node, parent = parent, node
+            parent.black = True
+            grandparent.black = False
+            if stats is not None:
+                stats.op['recolors'] += 2
+            self._lift(parent)
+            return False
+        if parent is None and not node.black:
+            # the root turned red
+            node.black = True
+            if stats is not None:
+                stats.op['recolors'] += 1
+            return True
+        return False
 
-        node = new_node
-        # while current node is red, adjust this cluster
-        while node is not None and not node.black:
-            # find the root of this 2-3-4 cluster
-            black = self.get_black_parent(node)
+    def delete(self, val):
+        """delete a value from the tree, return whether the tree changed"""
+        if self.persistent:
+            if self._get_node(val, self.root) is None:
+                return False
+            self.root = self._blacken(self._persistent_delete(self.root, val))
+        elif not self._delete_from(self.root, val)[0]:
+            return False
+        self._shrink_ends(val)
+        return True
 
-            if black is None:
-                # we are at the root
-                node.black = True
-                node = None
+    def _delete_from(self, node, val):
+        """
+        delete a value from the subtree of node, which must hold its position
+        return whether the tree changed, and the last node on the search path smaller than val
+        that node is an ancestor of the deleted position, so it survives the deletion
+        """
+        stats = self.stats
+        lower = None
+        while node is not None:
+            if stats is not None:
+                stats.op['visits'] += 1
+            node_val = node.val
+            if node_val < val:
+                lower = node
+                node = node.right
+            elif val < node_val:
+                node = node.left
             else:
-                node = self._insert_adjust_cluster(black)
+                break
+        if node is None:
+            return False, lower
+        self._delete_node(node)
+        return True, lower
 
-    def _predecessor_node(self, node):
-        assert node.left() is not None
-        node = node.left()
-        while node.right() is not None:
-            node = node.right()
+    def _finger(self, node, val):
+        """
+        climb from a node smaller than val to the lowest ancestor whose subtree holds val
+        the subtree of a left child is bounded by its parent, a right child shares the bound of its parent
+        """
+        while node.parent is not None:
+            if node is node.parent.left and val < node.parent.val:
+                break
+            node = node.parent
         return node
 
-    def _successor_node(self, node):
-        assert node.right() is not None
-        node = node.right()
-        while node.left() is not None:
-            node = node.left()
-        return node
+    def insert_many(self, iterable):
+        """
+        insert a batch of values, return how many changed the tree
+        the batch is sorted, and each insertion searches up from the previous value instead of the root
+        """
+        if self.persistent:
+            # fingers climb parent pointers, which persistent mode does not keep
+            return sum(self.insert(val) for val in sorted(iterable))
+        changed = 0
+        finger = None
+        vals = sorted(iterable)
+        for val in vals:
+            node = self.root if finger is None else self._finger(finger, val)
+            inserted, finger = self._insert_from(node, val)
+            changed += inserted
+        if vals:
+            # every value of the batch is in the tree now, inserted or not
+            self._extend_ends(vals[0], vals[-1])
+        return changed
 
-    def delete(self, val):
-        """delete a value from the tree"""
-        # check if val is in the tree
-        node = self._get_node(val, self.root)
-        if node is None:
-            return
-        self._delete_node(node)
+    def delete_many(self, iterable):
+        """
+        delete a batch of values, return how many changed the tree
+        the batch is sorted, and each deletion searches up from a node left of the previous value
+        """
+        if self.persistent:
+            return sum(self.delete(val) for val in sorted(iterable))
+        changed = 0
+        finger = None
+        for val in sorted(iterable):
+            node = self.root if finger is None else self._finger(finger, val)
+            deleted, finger = self._delete_from(node, val)
+            if deleted:
+                changed += 1
+                self._shrink_ends(val)
+        return changed
 
     def _delete_node(self, node):
-        # if it is an internal node to be deleted
-        # substitute by predecessor node
-        if node.left() is not None:
-            predecessor = self._predecessor_node(node)
-            node.val = predecessor.val
-            return self._delete_node(predecessor)
-        # substitute by successor node
-        elif node.right() is not None:
-            successor = self._successor_node(node)
-            node.val = successor.val
-            return self._delete_node(successor)
-        # delete leaf node, from bottom to top
+        """splice node out of the tree, a node with two children is replaced by its predecessor node"""
+        l = node.left
+        r = node.right
+        if l is not None and r is not None:
+            predecessor = self._spine(l, RIGHT)
+            # the hole is where the predecessor is taken from, child fills it
+            child = predecessor.left
+            if predecessor is l:
+                parent = predecessor
+                d = LEFT
+            else:
+                parent = predecessor.parent
+                d = RIGHT
+                parent.right = child
+                if child is not None:
+                    child.parent = parent
+                predecessor.left = l
+                l.parent = predecessor
+            predecessor.right = r
+            r.parent = predecessor
+            # the predecessor takes the place and color of node
+            grandparent = node.parent
+            predecessor.parent = grandparent
+            if grandparent is None:
+                self.root = predecessor
+            elif grandparent.left is node:
+                grandparent.left = predecessor
+            else:
+                grandparent.right = predecessor
+            removed_black = predecessor.black
+            if removed_black != node.black and self.stats is not None:
+                self.stats.op['recolors'] += 1
+            predecessor.black = node.black
         else:
-            # if there is only one node, just delete the root
-            if node.parent is None:
-                self.root = None
-                self.flipped = False
+            child = l if l is not None else r
+            parent = node.parent
+            if child is not None:
+                child.parent = parent
+            if parent is None:
+                self.root = child
+                if child is not None and not child.black:
+                    child.black = True
+                    if self.stats is not None:
+                        self.stats.op['recolors'] += 1
                 return
-            # put the node to the left
-            if node is node.parent.right():
-                self.flip()
-            # if current node is not root, delete first
-            node.parent.set_left(None)
-            # if current node is red, just over
-            if not node.black:
-                self.flipped = False
+            if parent.left is node:
+                parent.left = child
+                d = LEFT
+            else:
+                parent.right = child
+                d = RIGHT
+            removed_black = node.black
+        node.parent = node.left = node.right = None
+        if removed_black:
+            if child is not None and not child.black:
+                child.black = True
+                if self.stats is not None:
+                    self.stats.op['recolors'] += 1
+            else:
+                self._fix_black(parent, d)
+        if self.augmented:
+            # the fixup never moves the hole away from parent, whose ancestors are all the stale nodes
+            self._refresh(parent)
+
+    def _fix_black(self, parent, d):
+        """the subtree on side d of parent is one black short, borrow from the sibling or push the shortage up"""
+        stats = self.stats
+        while parent is not None:
+            node = parent.right if d else parent.left
+            if node is not None and not node.black:
+                node.black = True
+                if stats is not None:
+                    stats.op['recolors'] += 1
                 return
-            # if current node is black, bottom-up fix
-            parent = node.parent
-            node = None
-            while node is not self.root:
-                # keep the node in the left branch
-                if node is parent.right():
-                    self.flip()
-                pr = parent.right()
-                prl = pr.left()
-                prr = pr.right()
-                if parent.black:
-                    if pr.black:
-                        if self.black(prl) and self.black(prr):
-                            pr.black = False
-                            # continue to fix up
-                            node = parent
-                            parent = node.parent
-                            continue
-                        elif not self.black(prl):
-                            # prl could not be None because red node must exists
-                            self._rotate(parent, prl, parent, pr, prl.left(), prl.right(), root_black=True)
-                            # fixed
-                            break
-                        elif not self.black(prr):
-                            self._rotate(parent, pr, parent, prr, prl, prr.left(), r_black=True)
-                            # fixed
-                            break
-                    else:
-                        prrl = prr.left() if prr is not None else None
-                        self._rotate(parent, pr, parent, prr, prl, prrl, root_black=True, l_black=False)
-                        # not fixed, continue
-                        continue
-                else:
-                    # pr must be black because parent is red
-                    if self.black(prl) and self.black(prr):
-                        parent.black = True
-                        pr.black = False
-                        # fixed
-                        break
-                    elif not self.black(prr):
-                        self._rotate(parent, pr, parent, prr, prl, prr.left(), root_black=False, l_black=True, r_black=True)
-                        # fixed
-                        break
-                    elif not self.black(prl):
-                        self._rotate(parent, prl, parent, pr, prl.left(), prl.right(), l_black=True)
-                        # fixed
-                        break
-        # the root node must be black
-        if node is self.root:
+            sibling = parent.left if d else parent.right
+            if not sibling.black:
+                # a red sibling, lift it so that the sibling becomes black
+                sibling.black = True
+                parent.black = False
+                if stats is not None:
+                    stats.op['recolors'] += 2
+                self._lift(sibling)
+                sibling = parent.left if d else parent.right
+            if d:
+                near, far = sibling.right, sibling.left
+            else:
+                near, far = sibling.left, sibling.right
+            if (near is None or near.black) and (far is None or far.black):
+                # nothing to borrow, shorten the sibling as well and continue from parent
+                sibling.black = False
+                if stats is not None:
+                    stats.op['recolors'] += 1
+                node = parent
+                parent = node.parent
+                if parent is not None:
+                    d = RIGHT if parent.right is node else LEFT
+                elif not node.black:
+                    node.black = True
+                    if stats is not None:
+                        stats.op['recolors'] += 1
+                continue
+            if far is None or far.black:
+                # make the red nephew outer first
+                near.black = True
+                sibling.black = False
+                if stats is not None:
+                    stats.op['recolors'] += 2
+                self._lift(near)
+                far = sibling
+                sibling = near
+            if stats is not None:
+                # the sibling and far nephew are black and red, a red parent swaps colors with the sibling
+                stats.op['recolors'] += 1 if parent.black else 3
+            sibling.black = parent.black
+            parent.black = True
+            far.black = True
+            self._lift(sibling)
+            return
+
+    def _make(self, black, l, val, r):
+        """build a node of persistent mode, it may be shared by many trees so parent is left None"""
+        node = Node(val)
+        node.black = black
+        node.left = l
+        node.right = r
+        if self.augmented:
+            self._update(node)
+        return node
+
+    def _blacken(self, node):
+        """paint a root black, copying it since it may be shared"""
+        if node is None or node.black:
+            return node
+        return self._make(True, node.left, node.val, node.right)
+
+    def _redden(self, node):
+        """copy a black node as red, it lowers the black height of the subtree by one"""
+        return self._make(False, node.left, node.val, node.right)
+
+    def _balance(self, l, val, r):
+        """
+        build a subtree of black height one more than l and r, either of which may have a red root with a red child
+        the result is a red node with black children when rebalancing is needed, or else a black node
+        """
+        if not self.black(l) and not self.black(r):
+            return self._make(False, self._blacken(l), val, self._blacken(r))
+        if not self.black(l):
+            ll, lr = l.left, l.right
+            if not self.black(ll):
+                return self._make(False, self._blacken(ll), l.val, self._make(True, lr, val, r))
+            if not self.black(lr):
+                return self._make(False, self._make(True, ll, l.val, lr.left), lr.val, self._make(True, lr.right, val, r))
+        if not self.black(r):
+            rl, rr = r.left, r.right
+            if not self.black(rr):
+                return self._make(False, self._make(True, l, val, rl), r.val, self._blacken(rr))
+            if not self.black(rl):
+                return self._make(False, self._make(True, l, val, rl.left), rl.val, self._make(True, rl.right, r.val, rr))
+        return self._make(True, l, val, r)
+
+    def _balance_left(self, l, val, r):
+        """build a node whose left subtree l has lost one black height during deletion"""
+        if not self.black(l):
+            return self._make(False, self._blacken(l), val, r)
+        if r.black:
+            return self._balance(l, val, self._redden(r))
+        # r is red, so its left child is black
+        rl = r.left
+        return self._make(False, self._make(True, l, val, rl.left), rl.val,
+                          self._balance(rl.right, r.val, self._redden(r.right)))
+
+    def _balance_right(self, l, val, r):
+        """build a node whose right subtree r has lost one black height during deletion"""
+        if not self.black(r):
+            return self._make(False, l, val, self._blacken(r))
+        if l.black:
+            return self._balance(self._redden(l), val, r)
+        # l is red, so its right child is black
+        lr = l.right
+        return self._make(False, self._balance(self._redden(l.left), l.val, lr.left), lr.val,
+                          self._make(True, lr.right, val, r))
+
+    def _persistent_insert(self, node, val):
+        """insert a value absent from the subtree of node, return the copied subtree which may have a red root with a red child"""
+        if node is None:
+            return self._make(False, None, val, None)
+        if self.stats is not None:
+            self.stats.op['visits'] += 1
+        l, r = node.left, node.right
+        if val < node.val:
+            l = self._persistent_insert(l, val)
+        else:
+            r = self._persistent_insert(r, val)
+        if node.black:
+            return self._balance(l, node.val, r)
+        return self._make(False, l, node.val, r)
+
+    def _persistent_delete(self, node, val):
+        """
+        delete a value present in the subtree of node, return the copied subtree
+        the result has one black height less when node is black
+        """
+        if self.stats is not None:
+            self.stats.op['visits'] += 1
+        l, r = node.left, node.right
+        if val < node.val:
+            if l.black:
+                return self._balance_left(self._persistent_delete(l, val), node.val, r)
+            return self._make(False, self._persistent_delete(l, val), node.val, r)
+        if node.val < val:
+            if r.black:
+                return self._balance_right(l, node.val, self._persistent_delete(r, val))
+            return self._make(False, l, node.val, self._persistent_delete(r, val))
+        return self._persistent_append(l, r)
+
+    def _persistent_append(self, l, r):
+        """join the two subtrees of a deleted node along their inner spines"""
+        if l is None:
+            return r
+        if r is None:
+            return l
+        # each step down the inner spines of the deleted node
+        if self.stats is not None:
+            self.stats.op['visits'] += 1
+        if not l.black and not r.black:
+            mid = self._persistent_append(l.right, r.left)
+            if not self.black(mid):
+                return self._make(False, self._make(False, l.left, l.val, mid.left), mid.val,
+                                  self._make(False, mid.right, r.val, r.right))
+            return self._make(False, l.left, l.val, self._make(False, mid, r.val, r.right))
+        if l.black and r.black:
+            mid = self._persistent_append(l.right, r.left)
+            if not self.black(mid):
+                return self._make(False, self._make(True, l.left, l.val, mid.left), mid.val,
+                                  self._make(True, mid.right, r.val, r.right))
+            return self._balance_left(l.left, l.val, self._make(True, mid, r.val, r.right))
+        if not r.black:
+            return self._make(False, self._persistent_append(l, r.left), r.val, r.right)
+        return self._make(False, l.left, l.val, self._persistent_append(l.right, r))
+
+    def snapshot(self):
+        """
+        return a tree sharing every node with this one in O(1), only in persistent mode
+        updates of either tree copy the nodes on their path, so the other one does not see them
+        """
+        if not self.persistent:
+            raise ValueError('snapshot() needs a tree in persistent mode')
+        return self._wrap(self.root)
+
+    def _wrap(self, root):
+        """make a tree of the same type and settings around a detached root"""
+        tree = copy.copy(self)
+        tree.root = root
+        tree._ends = None
+        return tree
+
+    def _black_height(self, node):
+        """count the black nodes from node down to a leaf, it is the same along every path"""
+        height = 0
+        while node is not None:
+            height += node.black
+            node = node.left
+        return height
+
+    def _cut(self, node, height):
+        """
+        cut the subtree of node from its parent, height is its black height in place
+        its root is painted black so it is a tree of its own, return it with its new black height
+        """
+        if node is not None:
+            node.parent = None
+            if not node.black:
+                node.black = True
+                height += 1
+                if self.stats is not None:
+                    self.stats.op['recolors'] += 1
+        return node, height
+
+    def _cut_children(self, node, height):
+        """cut both children of node whose black height is height, return them with their black heights"""
+        height -= node.black
+        l, hl = self._cut(node.left, height)
+        r, hr = self._cut(node.right, height)
+        return l, hl, r, hr
+
+    def _join(self, l, hl, node, r, hr):
+        """
+        join the trees l and r of black heights hl and hr with node between them
+        node is hung on the spine of the taller tree where the black heights match, then fixed like an insertion
+        it costs O(|hl - hr| + 1), return the new root and its black height
+        self.root is used as scratch while joining
+        """
+        if hl == hr:
+            node.parent = None
             node.black = True
-        # reset flip
-        self.flipped = False
+            node.set_child(LEFT, l)
+            node.set_child(RIGHT, r)
+            if self.augmented:
+                self._update(node)
+            return node, hl + 1
+        # d is the spine of the taller tree facing the shorter one
+        if hl > hr:
+            d, tall, short, height, target = RIGHT, l, r, hl, hr
+        else:
+            d, tall, short, height, target = LEFT, r, l, hr, hl
+        self.root = tall
+        parent = None
+        child = tall
+        while not (self.black(child) and height == target):
+            height -= child.black
+            parent = child
+            child = child.child(d)
+        node.black = False
+        node.set_child(1 - d, child)
+        node.set_child(d, short)
+        parent.set_child(d, node)
+        if self.augmented:
+            self._update(node)
+        grew = self._fix_red(node)
+        if self.augmented:
+            # node hangs O(|hl - hr|) deep, so the walk up keeps the bound
+            self._refresh(node)
+        return self.root, max(hl, hr) + grew
+
+    def _split(self, node, height, val):
+        """
+        split the tree of node and black height height by val
+        return the tree smaller than val, the node holding val or None, and the tree greater, each tree with its black height
+        the nodes on the search path are joined back bottom-up, and the joins telescope to O(log n) in total
+        """
+        path = []
+        while node is not None and node.val != val:
+            path.append((node, height))
+            height -= node.black
+            node = node.right if node.val < val else node.left
+        if node is None:
+            l = r = None
+            hl = hr = 0
+        else:
+            l, hl, r, hr = self._cut_children(node, height)
+            node.parent = None
+            node.left = node.right = None
+        for ancestor, height in reversed(path):
+            if ancestor.val < val:
+                sub, hsub = self._cut(ancestor.left, height - ancestor.black)
+                l, hl = self._join(sub, hsub, ancestor, l, hl)
+            else:
+                sub, hsub = self._cut(ancestor.right, height - ancestor.black)
+                r, hr = self._join(r, hr, ancestor, sub, hsub)
+        return l, hl, node, r, hr
+
+    def _join2(self, l, hl, r, hr):
+        """join the trees l and r without a node between them, the max of l is split out as the middle"""
+        if l is None:
+            return r, hr
+        node = l
+        while node.right is not None:
+            node = node.right
+        l, hl, node, _, _ = self._split(l, hl, node.val)
+        return self._join(l, hl, node, r, hr)
+
+    def split(self, val):
+        """
+        split into the trees of values smaller than val and not smaller than val, in O(log n)
+        the nodes are moved, so this tree is left empty
+        """
+        if self.persistent:
+            raise ValueError('split() moves nodes, which persistent mode does not allow')
+        l, hl, node, r, hr = self._split(self.root, self._black_height(self.root), val)
+        if node is not None:
+            r, hr = self._join(None, 0, node, r, hr)
+        self.root = None
+        self._ends = None
+        return self._wrap(l), self._wrap(r)
+
+    @classmethod
+    def join(cls, left, val, right):
+        """
+        join two trees with val between them into a new tree, in O(log n)
+        all values of left must be smaller than val and all values of right greater
+        the nodes are moved, so both trees are left empty
+        """
+        if left.persistent or right.persistent:
+            raise ValueError('join() moves nodes, which persistent mode does not allow')
+        tree = left._wrap(None)
+        tree.root, _ = tree._join(left.root, tree._black_height(left.root), Node(val), right.root, tree._black_height(right.root))
+        left.root = right.root = None
+        left._ends = right._ends = None
+        return tree
+
+    def _cluster_vals(self, node):
+        """values of a tree of black height 1, which is a single 2-3-4 cluster"""
+        return [child.val for child in (node.left, node, node.right) if child is not None]
+
+    def _union(self, a, ha, b, hb):
+        if a is None:
+            return b, hb
+        if b is None:
+            return a, ha
+        if hb == 1:
+            # few values left, inserting them beats splitting the whole way down
+            self.root = a
+            for val in self._cluster_vals(b):
+                self._insert_from(self.root, val)
+            return self.root, self._black_height(self.root)
+        la, hla, ra, hra = self._cut_children(a, ha)
+        lb, hlb, _, rb, hrb = self._split(b, hb, a.val)
+        l, hl = self._union(la, hla, lb, hlb)
+        r, hr = self._union(ra, hra, rb, hrb)
+        return self._join(l, hl, a, r, hr)
+
+    def _intersection(self, a, ha, b, hb):
+        if a is None or b is None:
+            return None, 0
+        if hb == 1:
+            self.root = None
+            for val in self._cluster_vals(b):
+                if self._get_node(val, a) is not None:
+                    self._insert_from(self.root, val)
+            return self.root, self._black_height(self.root)
+        la, hla, ra, hra = self._cut_children(a, ha)
+        lb, hlb, node, rb, hrb = self._split(b, hb, a.val)
+        l, hl = self._intersection(la, hla, lb, hlb)
+        r, hr = self._intersection(ra, hra, rb, hrb)
+        if node is None:
+            return self._join2(l, hl, r, hr)
+        return self._join(l, hl, a, r, hr)
+
+    def _difference(self, a, ha, b, hb):
+        if a is None:
+            return None, 0
+        if b is None:
+            return a, ha
+        if hb == 1:
+            self.root = a
+            for val in self._cluster_vals(b):
+                self._delete_from(self.root, val)
+            return self.root, self._black_height(self.root)
+        lb, hlb, rb, hrb = self._cut_children(b, hb)
+        la, hla, _, ra, hra = self._split(a, ha, b.val)
+        l, hl = self._difference(la, hla, lb, hlb)
+        r, hr = self._difference(ra, hra, rb, hrb)
+        return self._join2(l, hl, r, hr)
+
+    def _set_operation(self, operation, other):
+        if self.persistent or other.persistent:
+            raise ValueError('set operations move nodes, which persistent mode does not allow')
+        root, _ = operation(self.root, self._black_height(self.root), other.root, self._black_height(other.root))
+        self.root = other.root = None
+        self._ends = other._ends = None
+        return self._wrap(root)
+
+    def union(self, other):
+        """
+        return a tree of the values in either tree, in O(m log(n/m + 1)) for sizes m <= n
+        the nodes are moved, so both trees are left empty
+        """
+        return self._set_operation(self._union, other)
+
+    def intersection(self, other):
+        """
+        return a tree of the values in both trees, in O(m log(n/m + 1)) for sizes m <= n
+        the nodes are moved, so both trees are left empty
+        """
+        return self._set_operation(self._intersection, other)
+
+    def difference(self, other):
+        """
+        return a tree of the values in this tree but not in other, in O(m log(n/m + 1)) for sizes m <= n
+        the nodes are moved, so both trees are left empty
+        """
+        return self._set_operation(self._difference, other)
+
+    def _iter_up(self, lo, inclusive):
+        """yield values from lo upwards, the stack holds the nodes still to be yielded"""
+        stack = []
+        node = self.root
+        while node is not None:
+            if lo is not None and (node.val < lo or not inclusive and node.val == lo):
+                node = node.right
+            else:
+                stack.append(node)
+                node = node.left
+        while stack:
+            node = stack.pop()
+            yield node.val
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def _iter_down(self, hi, inclusive):
+        """yield values from hi downwards, the stack holds the nodes still to be yielded"""
+        stack = []
+        node = self.root
+        while node is not None:
+            if hi is not None and (node.val > hi or not inclusive and node.val == hi):
+                node = node.left
+            else:
+                stack.append(node)
+                node = node.right
+        while stack:
+            node = stack.pop()
+            yield node.val
+            node = node.left
+            while node is not None:
+                stack.append(node)
+                node = node.right
+
+    def irange(self, lo=None, hi=None, inclusive=(True, False), reverse=False):
+        """
+        lazily yield the values between lo and hi, a None bound is unbounded
+        seeking to the first value costs one descent, each following step is O(1) amortized
+        """
+        if reverse:
+            for val in self._iter_down(hi, inclusive[1]):
+                if lo is not None and (val < lo or not inclusive[0] and val == lo):
+                    return
+                yield val
+        else:
+            for val in self._iter_up(lo, inclusive[0]):
+                if hi is not None and (val > hi or not inclusive[1] and val == hi):
+                    return
+                yield val
+
+    def __iter__(self):
+        return self._iter_up(None, True)
+
+    def __reversed__(self):
+        return self._iter_down(None, True)
 
     def _collect_vals(self, root, arr):
-        if root is None:
-            return
-        self._collect_vals(root.left(), arr)
-        arr.append(root.val)
-        self._collect_vals(root.right(), arr)
+        """append the values under root in order"""
+        stack = []
+        node = root
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                arr.append(node.val)
+                node = node.right
 
     def get_vals(self):
         ans = []
@@ -313,23 +1023,28 @@ class RedBlackTree:
         return ans
 
     def get_black_depths(self, node, depth, depths):
-        if node is None:
-            depths.append(depth)
-            return
-        if node.black:
-            depth += 1
-        self.get_black_depths(node.left(), depth, depths)
-        self.get_black_depths(node.right(), depth, depths)
+        """append the black depth of every null leaf under node, from left to right"""
+        stack = [(node, depth)]
+        while stack:
+            node, depth = stack.pop()
+            if node is None:
+                depths.append(depth)
+                continue
+            if node.black:
+                depth += 1
+            stack.append((node.right, depth))
+            stack.append((node.left, depth))
 
     def _validate_consequent_red(self, node):
-        if node is None:
-            return True
-        if not node.black and node.parent is not None and not node.parent.black:
-            return False
-        if not self._validate_consequent_red(node.left()):
-            return False
-        if not self._validate_consequent_red(node.right()):
-            return False
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            if not node.black and not (self.black(node.left) and self.black(node.right)):
+                return False
+            stack.append(node.right)
+            stack.append(node.left)
         return True
 
     def validate(self):
@@ -350,14 +1065,139 @@ class RedBlackTree:
         return True
 
     def _to_str(self, node):
-        if node is None:
-            return ''
-        return ' ' + str(node) + ' ' + self._to_str(node.left()) + self._to_str(node.right())
+        """the nodes under node in preorder"""
+        parts = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node is not None:
+                parts.append(' ' + str(node) + ' ')
+                stack.append(node.right)
+                stack.append(node.left)
+        return ''.join(parts)
 
     def __str__(self):
         return self._to_str(self.root)
 
+
+class AugmentedRedBlackTree(RedBlackTree):
+    """
+    a red-black tree whose nodes hold the aggregate of their subtree under a user supplied monoid
+    measure maps a value to its aggregate, combine must be associative, identity is the aggregate of no values
+    """
+    augmented = True
+
+    def __init__(self, measure, combine, identity=None, persistent=False):
+        super().__init__(persistent)
+        self.measure = measure
+        self.combine = combine
+        self.identity = identity
+
+    def _update(self, node):
+        agg = self.measure(node.val)
+        l, r = node.left, node.right
+        if l is not None:
+            agg = self.combine(l.agg, agg)
+        if r is not None:
+            agg = self.combine(agg, r.agg)
+        node.agg = agg
+
+    def aggregate(self, lo=None, hi=None, inclusive=(True, False)):
+        """
+        combine the values between lo and hi in order, a None bound is unbounded, in O(log n)
+        the range is covered by the whole subtrees hanging off the two search paths for lo and hi
+        """
+        def below(val):
+            return lo is not None and (val < lo or not inclusive[0] and val == lo)
+
+        def above(val):
+            return hi is not None and (val > hi or not inclusive[1] and val == hi)
+
+        # find the highest node in range, the paths to lo and hi split there
+        node = self.root
+        while node is not None and (below(node.val) or above(node.val)):
+            node = node.right if below(node.val) else node.left
+        if node is None:
+            return self.identity
+        agg = self.measure(node.val)
+        # the part below the split node, bounded by lo only
+        left = node.left
+        while left is not None:
+            if below(left.val):
+                left = left.right
+            else:
+                part = self.measure(left.val)
+                if left.right is not None:
+                    part = self.combine(part, left.right.agg)
+                agg = self.combine(part, agg)
+                left = left.left
+        # the part above the split node, bounded by hi only
+        right = node.right
+        while right is not None:
+            if above(right.val):
+                right = right.left
+            else:
+                if right.left is not None:
+                    agg = self.combine(agg, right.left.agg)
+                agg = self.combine(agg, self.measure(right.val))
+                right = right.right
+        return agg
+
+    def _validate_agg(self, node):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node is None:
+                continue
+            agg = node.agg
+            self._update(node)
+            if node.agg != agg:
+                print('stale aggregate', agg, 'at node', node, 'expected', node.agg)
+                return False
+            stack.append(node.right)
+            stack.append(node.left)
+        return True
+
+    def validate(self):
+        return super().validate() and self._validate_agg(self.root)
+
+
+class IntervalTree(AugmentedRedBlackTree):
+    """
+    closed intervals kept as tuples (start, end, ...) ordered by start, each subtree knows its max end
+    extra items in the tuple can carry a payload, and tell apart intervals with the same endpoints
+    """
+    def __init__(self, persistent=False):
+        super().__init__(lambda interval: interval[1], max, persistent=persistent)
+
+    def overlap(self, start, end):
+        """
+        lazily yield the intervals overlapping [start, end] ordered by start
+        subtrees whose max end is before start are skipped, and the walk stops at the first interval starting after end,
+        so apart from the search path only subtrees holding an answer are entered, O(log n + k) when the answers are clustered
+        """
+        stack = []
+        node = self.root
+        while True:
+            while node is not None and node.agg >= start:
+                stack.append(node)
+                node = node.left
+            if not stack:
+                return
+            node = stack.pop()
+            if node.val[0] > end:
+                return
+            if node.val[1] >= start:
+                yield node.val
+            node = node.right
+
+    def stab(self, point):
+        """lazily yield the intervals holding point ordered by start"""
+        return self.overlap(point, point)
+
+
 if __name__ == '__main__':
+    from tqdm import tqdm
     for _ in range(10):
         arr = [i for i in range(-1000, 1000)]
         random.shuffle(arr)
@@ -377,4 +1217,99 @@ if __name__ == '__main__':
                 assert(tree.validate())
                 # print(tree.get_vals())
                 # print(sorted(list(expected)))
-                assert(tree.get_vals() == sorted(list(expected)))
\ No newline at end of file
+                assert(tree.get_vals() == sorted(list(expected)))
+    # bulk building
+    for n in range(40):
+        tree = RedBlackTree.from_sorted(range(n))
+        assert(tree.validate())
+        assert(tree.get_vals() == list(range(n)))
+        tree.insert(n)
+        tree.delete(0)
+        assert(tree.validate())
+    # range sums under an augmentation
+    tree = AugmentedRedBlackTree(lambda val: val, lambda a, b: a + b, 0)
+    arr = [i for i in range(1000)]
+    random.shuffle(arr)
+    for a in arr:
+        tree.insert(a)
+    for a in arr[:300]:
+        tree.delete(a)
+    assert(tree.validate())
+    expected = sorted(arr[300:])
+    assert(AugmentedRedBlackTree.from_sorted(expected, lambda val: val, lambda a, b: a + b, 0).aggregate() == sum(expected))
+    for _ in range(100):
+        lo, hi = sorted(random.sample(range(1000), 2))
+        assert(tree.aggregate(lo, hi) == sum(a for a in expected if lo <= a < hi))
+
+    # interval queries
+    tree = IntervalTree()
+    intervals = set()
+    for _ in range(1000):
+        start = random.randrange(10000)
+        intervals.add((start, start + random.randrange(100)))
+    for interval in intervals:
+        tree.insert(interval)
+    assert(tree.validate())
+    # the nodes print any value, an interval as well as a number
+    assert(str(tree.root) == 'b:%s:None' % (tree.root.val, ) and str(tree.root.left).endswith(':%s' % (tree.root.val, )))
+    assert(str(tree).count(':') == 2 * len(intervals))
+    for _ in range(100):
+        start = random.randrange(10000)
+        end = start + random.randrange(100)
+        assert(list(tree.overlap(start, end)) == sorted(i for i in intervals if i[0] <= end and i[1] >= start))
+        assert(list(tree.stab(start)) == sorted(i for i in intervals if i[0] <= start <= i[1]))
+
+    # neighbour queries and the cached ends against a sorted list, through every kind of update
+    from bisect import bisect, bisect_left, insort
+    for persistent in [False, True]:
+        tree = RedBlackTree(persistent)
+        expected = []
+        for _ in range(5000):
+            a = random.randint(-500, 500)
+            op = random.random()
+            if op < 0.5:
+                if tree.insert(a):
+                    insort(expected, a)
+            elif op < 0.7:
+                if tree.delete(a):
+                    expected.remove(a)
+            elif op < 0.75:
+                tree.insert_many([a, a + 3, a - 700])
+                expected = sorted(set(expected) | {a, a + 3, a - 700})
+            elif op < 0.8:
+                tree.delete_many([a, a + 1, a + 2])
+                expected = [b for b in expected if b not in (a, a + 1, a + 2)]
+            elif expected:
+                assert(tree.pop_min() == expected.pop(0) if op < 0.9 else tree.pop_max() == expected.pop())
+                # a pop keeps the ends cached, the peeks below filled them
+                assert(tree._ends is not None or not expected)
+            if expected:
+                assert((tree.min(), tree.max()) == (expected[0], expected[-1]))
+            i, j = bisect_left(expected, a), bisect(expected, a)
+            assert(tree.floor(a) == (expected[j - 1] if j else None))
+            assert(tree.lower(a) == (expected[i - 1] if i else None))
+            assert(tree.ceiling(a) == (expected[i] if i < len(expected) else None))
+            assert(tree.higher(a) == (expected[j] if j < len(expected) else None))
+        assert(tree.validate() and tree.get_vals() == expected)
+    tree = RedBlackTree.from_sorted(range(100))
+    assert((tree.min(), tree.max()) == (0, 99))
+    left, right = tree.split(50)
+    assert((left.min(), left.max(), right.min(), right.max()) == (0, 49, 50, 99))
+    other = RedBlackTree.from_sorted(range(200, 300))
+    assert(other.max() == 299)
+    union = right.union(other)
+    assert((union.min(), union.max()) == (50, 299))
+    # pops splice the end node out in place, and keep the aggregates up to date
+    augmented = AugmentedRedBlackTree(lambda a: a, lambda a, b: a + b, 0)
+    vals = random.sample(range(1000), 300)
+    augmented.insert_many(vals)
+    vals.sort()
+    while vals:
+        assert(augmented.pop_max() == vals.pop() if len(vals) % 3 else augmented.pop_min() == vals.pop(0))
+        assert(augmented.validate() and augmented.aggregate() == sum(vals))
+    for peek in [tree.min, tree.max, other.pop_min]:
+        try:
+            peek()
+            assert(False)
+        except ValueError:
+            pass
@@ -0,0 +1,523 @@
+import os
+import random
+import threading
+from bisect import bisect_left, bisect_right
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from Sorted import BACKENDS
+from Splay import SplayTree, TopDownSplayTree
+
+
+class RWLock:
+    """readers-writer lock, waiting writers hold off new readers so a stream of readers cannot starve them"""
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting = 0
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer or self._waiting:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if not self._readers:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            self._waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._waiting -= 1
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquire_read()
+        try:
+            yield
+        finally:
+            self.release_read()
+
+    @contextmanager
+    def write(self):
+        self.acquire_write()
+        try:
+            yield
+        finally:
+            self.release_write()
+
+
+def _lookups_write(tree):
+    """whether has_val restructures the tree, a top-down splay tree always splays, a bottom-up one unless it only searches"""
+    return isinstance(tree, TopDownSplayTree) or isinstance(tree, SplayTree) and tree.lookup != 'search'
+
+
+class Shard:
+    def __init__(self, tree, size, lo, hi):
+        self.tree = tree
+        self.size = size
+        # the shard holds the values from lo up to hi, None is unbounded, the range never changes
+        self.lo = lo
+        self.hi = hi
+        self.lock = RWLock()
+        # a split or merge replaces a shard by new ones, and retires it
+        self.retired = False
+
+    def covers(self, val):
+        return (self.lo is None or not val < self.lo) and (self.hi is None or val < self.hi)
+
+
+class ShardedTree:
+    """
+    a sorted set range-partitioned over independent trees, each with its own readers-writer lock
+    so threads working on different key ranges do not wait for each other
+    a shard growing past 2 * shard_size is split in two, and a shard shrinking below shard_size // 4 is merged with a neighbour
+    the directory of shards is replaced as a whole, so operations look it up without a lock and retry on a retired shard
+    """
+    def __init__(self, iterable=(), backend='btree', shards=1, shard_size=65536):
+        if backend not in BACKENDS:
+            raise ValueError('backend must be one of %s' % (tuple(BACKENDS), ))
+        self.build = BACKENDS[backend]
+        # lookups which splay need the write lock, readers would splay the same tree at once
+        self._write_lookups = _lookups_write(self.build([]))
+        self.shard_size = shard_size
+        # only one split or merge at a time
+        self._resize_lock = threading.Lock()
+        vals = sorted(set(iterable))
+        count = max(shards, -(-len(vals) // shard_size))
+        self._publish(self._make_shards(vals, count, None, None))
+
+    def _make_shards(self, vals, count, lo, hi):
+        """build count shards of about the same size from sorted values, together covering lo up to hi"""
+        count = max(1, min(count, len(vals)))
+        shards = []
+        for i in range(count):
+            part = vals[len(vals) * i // count:len(vals) * (i + 1) // count]
+            shard_hi = vals[len(vals) * (i + 1) // count] if i < count - 1 else hi
+            shards.append(Shard(self.build(part), len(part), lo, shard_hi))
+            lo = shard_hi
+        return shards
+
+    def _publish(self, shards):
+        # bounds[i] is where shards[i + 1] starts, a new tuple is swapped in at once
+        self._directory = ([shard.lo for shard in shards[1:]], shards)
+
+    def _lock(self, val, write):
+        """find and lock the live shard holding val"""
+        while True:
+            bounds, shards = self._directory
+            shard = shards[bisect_right(bounds, val)]
+            if write:
+                shard.lock.acquire_write()
+            else:
+                shard.lock.acquire_read()
+            if not shard.retired:
+                return shard
+            if write:
+                shard.lock.release_write()
+            else:
+                shard.lock.release_read()
+
+    def _replace(self, shard, merge):
+        """rebuild a shard, with a neighbour if merge is set, into shards of about shard_size values"""
+        with self._resize_lock:
+            _, shards = self._directory
+            if shard.retired or merge and len(shards) == 1:
+                return
+            i = shards.index(shard)
+            if merge:
+                i = i - 1 if i + 1 == len(shards) else i
+                group = shards[i:i + 2]
+            else:
+                group = [shard]
+            for member in group:
+                member.lock.acquire_write()
+            try:
+                # check again, the shard may have changed while waiting for the locks
+                if merge and shard.size >= self.shard_size // 4 or not merge and shard.size <= 2 * self.shard_size:
+                    return
+                size = sum(member.size for member in group)
+                vals = [val for member in group for val in member.tree]
+                replacement = self._make_shards(vals, -(-size // self.shard_size), group[0].lo, group[-1].hi)
+                self._publish(shards[:i] + replacement + shards[i + len(group):])
+                for member in group:
+                    member.retired = True
+            finally:
+                for member in group:
+                    member.lock.release_write()
+
+    def _rebalance(self, shard):
+        """split a shard grown too large or merge a shard shrunk too small, after its lock is released"""
+        if shard.size > 2 * self.shard_size:
+            self._replace(shard, False)
+        elif shard.size < self.shard_size // 4:
+            self._replace(shard, True)
+
+    def insert(self, val):
+        """insert a value, return whether the tree changed"""
+        shard = self._lock(val, True)
+        try:
+            changed = shard.tree.insert(val)
+            shard.size += changed
+        finally:
+            shard.lock.release_write()
+        self._rebalance(shard)
+        return changed
+
+    def delete(self, val):
+        """delete a value, return whether the tree changed"""
+        shard = self._lock(val, True)
+        try:
+            changed = shard.tree.delete(val)
+            shard.size -= changed
+        finally:
+            shard.lock.release_write()
+        self._rebalance(shard)
+        return changed
+
+    def has_val(self, val):
+        write = self._write_lookups
+        shard = self._lock(val, write)
+        try:
+            # the red-black has_val returns the node
+            return bool(shard.tree.has_val(val))
+        finally:
+            if write:
+                shard.lock.release_write()
+            else:
+                shard.lock.release_read()
+
+    def _batch(self, iterable, method):
+        """run a sorted batch shard by shard, each piece under one write lock, return the total change"""
+        vals = sorted(iterable)
+        changed = 0
+        i = 0
+        while i < len(vals):
+            shard = self._lock(vals[i], True)
+            try:
+                j = len(vals) if shard.hi is None else bisect_left(vals, shard.hi, i)
+                delta = getattr(shard.tree, method)(vals[i:j])
+                shard.size += delta if method == 'insert_many' else -delta
+                changed += delta
+            finally:
+                shard.lock.release_write()
+            self._rebalance(shard)
+            i = j
+        return changed
+
+    def insert_many(self, iterable):
+        """insert a batch of values, return how many changed the tree"""
+        return self._batch(iterable, 'insert_many')
+
+    def delete_many(self, iterable):
+        """delete a batch of values, return how many changed the tree"""
+        return self._batch(iterable, 'delete_many')
+
+    def __len__(self):
+        return sum(shard.size for shard in self._directory[1])
+
+    @property
+    def shard_count(self):
+        return len(self._directory[1])
+
+    def irange(self, lo=None, hi=None, inclusive=(True, False), reverse=False):
+        """
+        lazily yield the values between lo and hi, shard by shard
+        each shard is read at once under its read lock, so a shard is seen as of one moment, not the whole tree
+        the next shard is looked up in the directory of the moment, from the bound of the shard before,
+        and a shard retired by a split or merge meanwhile is looked up again, like _lock does
+        """
+        # the walk resumes from cur, included or not, going up to hi, or down to lo in reverse
+        cur, incl = (hi, inclusive[1]) if reverse else (lo, inclusive[0])
+        while True:
+            bounds, shards = self._directory
+            if cur is None:
+                shard = shards[-1 if reverse else 0]
+            elif reverse and not incl:
+                # the shard of the values just below cur
+                shard = shards[bisect_left(bounds, cur)]
+            else:
+                shard = shards[bisect_right(bounds, cur)]
+            with shard.lock.read():
+                if shard.retired:
+                    continue
+                if reverse:
+                    vals = list(shard.tree.irange(lo, cur, (inclusive[0], incl), True))
+                else:
+                    vals = list(shard.tree.irange(cur, hi, (incl, inclusive[1])))
+            yield from vals
+            if reverse:
+                if shard.lo is None or lo is not None and not lo < shard.lo:
+                    return
+                cur, incl = shard.lo, False
+            else:
+                if shard.hi is None or hi is not None and (hi < shard.hi or hi == shard.hi and not inclusive[1]):
+                    return
+                cur, incl = shard.hi, True
+
+    def __iter__(self):
+        return self.irange()
+
+    def __reversed__(self):
+        return self.irange(reverse=True)
+
+    def get_vals(self):
+        return list(self)
+
+    def validate(self):
+        """check that the shards tile the key space in order and hold what they count"""
+        bounds, shards = self._directory
+        if shards[0].lo is not None or shards[-1].hi is not None:
+            return False
+        for prev, shard in zip(shards, shards[1:]):
+            if prev.hi != shard.lo:
+                return False
+        for shard in shards:
+            vals = list(shard.tree)
+            if len(vals) != shard.size or not all(shard.covers(val) for val in vals) or shard.retired:
+                return False
+        return bounds == [shard.lo for shard in shards[1:]]
+
+
+# the shard owned by a worker process of ProcessShardedTree
+_shard = None
+
+
+def _init_shard(backend, vals):
+    global _shard
+    _shard = BACKENDS[backend](vals)
+
+
+def _shard_contains(vals):
+    return [bool(_shard.has_val(val)) for val in vals]
+
+
+def _shard_insert_many(vals):
+    return _shard.insert_many(vals)
+
+
+def _shard_delete_many(vals):
+    return _shard.delete_many(vals)
+
+
+def _shard_vals():
+    return list(_shard)
+
+
+class ProcessShardedTree:
+    """
+    a sorted set range-partitioned over worker processes, shared-nothing: each shard lives in a process of its own
+    a shard is a single worker ProcessPoolExecutor, so its tree stays in that process between calls
+    the shards are built in parallel, and batches are cut by range and sent to all of them at once,
+    so CPU-bound work runs on as many cores as shards, the GIL of one process is not shared
+    the partition is fixed when the tree is built
+    """
+    def __init__(self, iterable=(), backend='btree', shards=None):
+        if backend not in BACKENDS:
+            raise ValueError('backend must be one of %s' % (tuple(BACKENDS), ))
+        vals = sorted(set(iterable))
+        count = max(1, min(shards or os.cpu_count(), len(vals)))
+        parts = [vals[len(vals) * i // count:len(vals) * (i + 1) // count] for i in range(count)]
+        self.bounds = [part[0] for part in parts[1:]]
+        self.sizes = [len(part) for part in parts]
+        self.executors = [ProcessPoolExecutor(1, initializer=_init_shard, initargs=(backend, part)) for part in parts]
+
+    def _scatter(self, vals):
+        """cut values by range, return the pieces of each shard and where each value came from"""
+        pieces = [[] for _ in self.executors]
+        positions = [[] for _ in self.executors]
+        for position, val in enumerate(vals):
+            i = bisect_right(self.bounds, val)
+            pieces[i].append(val)
+            positions[i].append(position)
+        return pieces, positions
+
+    def _gather(self, func, pieces):
+        futures = [executor.submit(func, piece) for executor, piece in zip(self.executors, pieces)]
+        return [future.result() for future in futures]
+
+    def contains_many(self, vals):
+        """check a batch of values, return a list of whether each is in the tree"""
+        vals = list(vals)
+        pieces, positions = self._scatter(vals)
+        ans = [False] * len(vals)
+        for found, position in zip(self._gather(_shard_contains, pieces), positions):
+            for i, hit in zip(position, found):
+                ans[i] = hit
+        return ans
+
+    def insert_many(self, iterable):
+        """insert a batch of values, return how many changed the tree"""
+        return self._update(_shard_insert_many, iterable, 1)
+
+    def delete_many(self, iterable):
+        """delete a batch of values, return how many changed the tree"""
+        return self._update(_shard_delete_many, iterable, -1)
+
+    def _update(self, func, iterable, sign):
+        pieces, _ = self._scatter(iterable)
+        changes = self._gather(func, pieces)
+        for i, changed in enumerate(changes):
+            self.sizes[i] += sign * changed
+        return sum(changes)
+
+    def __len__(self):
+        return sum(self.sizes)
+
+    def get_vals(self):
+        futures = [executor.submit(_shard_vals) for executor in self.executors]
+        return [val for future in futures for val in future.result()]
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == '__main__':
+    # threads inserting and deleting in parallel, with small shards to split and merge often
+    for backend in BACKENDS:
+        tree = ShardedTree(random.sample(range(100000), 1000), backend, shards=4, shard_size=64)
+        expected = set(tree.get_vals())
+        assert(tree.validate() and len(tree) == len(expected))
+        results = []
+
+        def work(seed):
+            rng = random.Random(seed)
+            mine = set()
+            # each thread owns the values equal to seed modulo 8, so the expected set is known
+            vals = [val for val in range(seed, 100000, 8) if val not in expected]
+            for _ in range(3000):
+                val = rng.choice(vals)
+                if rng.random() < 0.6:
+                    assert(tree.insert(val) == (val not in mine))
+                    mine.add(val)
+                else:
+                    assert(tree.delete(val) == (val in mine))
+                    mine.discard(val)
+                assert(tree.has_val(val) == (val in mine))
+            batch = rng.sample(vals, 200)
+            assert(tree.insert_many(batch) == len(set(batch) - mine))
+            mine.update(batch)
+            assert(tree.delete_many(batch[:100]) == 100)
+            mine.difference_update(batch[:100])
+            results.append(mine)
+
+        threads = [threading.Thread(target=work, args=(seed, )) for seed in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for mine in results:
+            expected |= mine
+        assert(tree.validate())
+        assert(tree.get_vals() == sorted(expected))
+        assert(list(reversed(tree)) == sorted(expected, reverse=True))
+        assert(list(tree.irange(20000, 30000)) == sorted(val for val in expected if 20000 <= val < 30000))
+        for lo, hi in [(None, 50000), (20000, None), (30000, 30000)]:
+            for inclusive in [(True, False), (False, True), (True, True)]:
+                within = [val for val in sorted(expected) if (lo is None or lo < val or inclusive[0] and lo == val) and (hi is None or val < hi or inclusive[1] and val == hi)]
+                assert(list(tree.irange(lo, hi, inclusive)) == within)
+                assert(list(tree.irange(lo, hi, inclusive, True)) == within[::-1])
+        assert(len(tree) == len(expected))
+        print('The sharded', backend, 'tree ended with', tree.shard_count, 'shards')
+        tree.delete_many(list(expected))
+        assert(tree.validate() and len(tree) == 0 and tree.shard_count == 1)
+
+    # concurrent readers of the splay backend, whose lookups splay, each take the write lock of their shard
+    keys = range(0, 20000, 2)
+    tree = ShardedTree(keys, 'splay', shards=2, shard_size=1 << 20)
+    assert(tree._write_lookups)
+    read = []
+
+    def lookups(seed):
+        rng = random.Random(seed)
+        for _ in range(20000):
+            val = rng.randrange(20000)
+            assert(tree.has_val(val) == (val % 2 == 0))
+        read.append(seed)
+
+    threads = [threading.Thread(target=lookups, args=(seed, )) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert(len(read) == 8)
+    assert(tree.validate() and tree.get_vals() == list(keys))
+
+    # an iteration goes on in the shards that replaced the ones split or merged since it started
+    for reverse in [False, True]:
+        tree = ShardedTree(range(0, 1000, 4), shards=4, shard_size=32)
+        walk = tree.irange(reverse=reverse)
+        # the first shard is read whole by the first step
+        shard = tree._directory[1][-1 if reverse else 0]
+        seen = list(shard.tree)
+        retired = tree._directory[1]
+        assert(next(walk) == (seen[-1] if reverse else seen[0]))
+        tree.insert_many(range(1000))
+        tree.delete_many(range(100, 900, 3))
+        assert(all(shard.retired for shard in retired))
+        if reverse:
+            expected = seen[::-1] + [val for val in reversed(tree) if val < shard.lo]
+        else:
+            expected = seen + [val for val in tree if not val < shard.hi]
+        assert([expected[0]] + list(walk) == expected)
+
+    # iterations alongside writers splitting and merging the shards, the values never written must all be seen
+    stable = range(0, 30000, 3)
+    tree = ShardedTree(stable, shards=4, shard_size=64)
+    walks = []
+
+    def write(seed):
+        rng = random.Random(seed)
+        for _ in range(20):
+            batch = [val for val in rng.sample(range(30000), 500) if val % 3]
+            tree.insert_many(batch)
+            tree.delete_many(batch)
+
+    def walk(reverse):
+        for _ in range(20):
+            vals = list(tree.irange(5000, 25000, reverse=reverse))
+            if reverse:
+                vals.reverse()
+            assert(all(v1 < v2 for v1, v2 in zip(vals, vals[1:])))
+            assert([val for val in vals if val % 3 == 0] == list(range(5001, 25000, 3)))
+        walks.append(reverse)
+
+    threads = [threading.Thread(target=write, args=(seed, )) for seed in range(4)]
+    threads += [threading.Thread(target=walk, args=(reverse, )) for reverse in [False, True]]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert(len(walks) == 2)
+    assert(tree.validate() and tree.get_vals() == list(stable))
+
+    # shared-nothing shards in worker processes
+    vals = random.sample(range(100000), 10000)
+    with ProcessShardedTree(vals, shards=3) as tree:
+        expected = set(vals)
+        assert(len(tree) == len(expected))
+        queries = random.sample(range(100000), 5000)
+        assert(tree.contains_many(queries) == [query in expected for query in queries])
+        assert(tree.insert_many(queries) == len(set(queries) - expected))
+        expected.update(queries)
+        assert(tree.delete_many(vals[:5000]) == 5000)
+        expected.difference_update(vals[:5000])
+        assert(tree.get_vals() == sorted(expected) and len(tree) == len(expected))
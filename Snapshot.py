@@ -0,0 +1,186 @@
+"""
+snapshot files of the values of a tree, written by dump and read back by load of each tree
+a file is a header, a settings block, blocks of values in the order of the tree, and an end block
+each block is a header of its type, its value count, the length and the crc32 of its payload, then the payload
+runs of int64 and float64 values are stored as little-endian arrays, any other run as a pickled list
+the settings block is pickled as well, so only load files you trust, as with pickle
+"""
+
+import os
+import pickle
+import random
+import struct
+import sys
+import zlib
+from array import array
+from itertools import islice
+
+# file header: magic, format version
+HEADER = struct.Struct('<4sB')
+MAGIC = b'PBTS'
+VERSION = 1
+# block header: type, value count, payload length, payload crc32
+BLOCK = struct.Struct('<cIII')
+SETTINGS = b's'
+INT64 = b'q'
+FLOAT64 = b'd'
+PICKLED = b'p'
+END = b'e'
+# values per block
+BLOCK_VALS = 65536
+
+
+def _encode(chunk):
+    """the type, value count and payload of a block of values"""
+    if all(type(val) is int for val in chunk):
+        try:
+            arr = array('q', chunk)
+        except OverflowError:
+            pass
+        else:
+            if sys.byteorder == 'big':
+                arr.byteswap()
+            return INT64, len(chunk), arr.tobytes()
+    if all(type(val) is float for val in chunk):
+        arr = array('d', chunk)
+        if sys.byteorder == 'big':
+            arr.byteswap()
+        return FLOAT64, len(chunk), arr.tobytes()
+    return PICKLED, len(chunk), pickle.dumps(chunk, pickle.HIGHEST_PROTOCOL)
+
+
+def _decode(block_type, count, payload):
+    if block_type == PICKLED:
+        vals = pickle.loads(payload)
+    elif block_type in (INT64, FLOAT64):
+        arr = array(block_type.decode())
+        arr.frombytes(payload)
+        if sys.byteorder == 'big':
+            arr.byteswap()
+        vals = arr.tolist()
+    else:
+        raise ValueError('unknown block type %r' % block_type)
+    if len(vals) != count:
+        raise ValueError('block holds %d values instead of %d' % (len(vals), count))
+    return vals
+
+
+def _write_block(f, block_type, count, payload):
+    f.write(BLOCK.pack(block_type, count, len(payload), zlib.crc32(payload)))
+    f.write(payload)
+
+
+def _read_block(f):
+    header = f.read(BLOCK.size)
+    if len(header) < BLOCK.size:
+        raise ValueError('truncated snapshot')
+    block_type, count, length, crc = BLOCK.unpack(header)
+    payload = f.read(length)
+    if len(payload) < length:
+        raise ValueError('truncated snapshot')
+    if zlib.crc32(payload) != crc:
+        raise ValueError('checksum mismatch in a %r block' % block_type)
+    return block_type, count, payload
+
+
+def dump(path, kind, settings, vals):
+    """
+    write the values of a tree of a kind, along with its settings
+    the file is written aside and moved over path when complete, so a crash leaves the old snapshot
+    """
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, VERSION))
+        _write_block(f, SETTINGS, 0, pickle.dumps((kind, settings), pickle.HIGHEST_PROTOCOL))
+        count = 0
+        it = iter(vals)
+        while True:
+            chunk = list(islice(it, BLOCK_VALS))
+            if not chunk:
+                break
+            count += len(chunk)
+            _write_block(f, *_encode(chunk))
+        _write_block(f, END, count, b'')
+    os.replace(tmp, path)
+
+
+def load(path, kind):
+    """read a snapshot of a tree of a kind, return its settings and its values"""
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size or header[:4] != MAGIC:
+            raise ValueError('%s is not a tree snapshot' % path)
+        _, version = HEADER.unpack(header)
+        if version != VERSION:
+            raise ValueError('snapshot format version %d is not supported' % version)
+        block_type, _, payload = _read_block(f)
+        if block_type != SETTINGS:
+            raise ValueError('snapshot has no settings')
+        file_kind, settings = pickle.loads(payload)
+        if file_kind != kind:
+            raise ValueError('snapshot of a %s, not of a %s' % (file_kind, kind))
+        vals = []
+        while True:
+            block_type, count, payload = _read_block(f)
+            if block_type == END:
+                break
+            vals += _decode(block_type, count, payload)
+        if count != len(vals):
+            raise ValueError('snapshot holds %d values instead of %d' % (len(vals), count))
+    return settings, vals
+
+
+if __name__ == '__main__':
+    import tempfile
+    from B import BTree
+    from RedBlack import RedBlackTree, AugmentedRedBlackTree
+    from Splay import SplayTree, TopDownSplayTree, SplaySequence
+    path = os.path.join(tempfile.mkdtemp(), 'tree.snapshot')
+    keysets = [
+        [],
+        sorted(random.sample(range(-10 ** 6, 10 ** 6), 200000)),
+        sorted(random.random() for _ in range(1000)),
+        sorted(str(a) for a in range(1000)),
+        # ints past int64 and mixed runs fall back to pickled blocks
+        [-2 ** 70] + list(range(100000)) + [2 ** 70],
+        sorted((a, str(a)) for a in range(1000)),
+    ]
+    for keys in keysets:
+        for tree in [BTree.from_sorted(keys, 4), RedBlackTree.from_sorted(keys, persistent=True), SplayTree.from_sorted(keys, 'semi', 3), TopDownSplayTree.from_sorted(keys)]:
+            tree.dump(path)
+            loaded = type(tree).load(path)
+            assert(loaded.get_vals() == keys)
+            if isinstance(tree, SplayTree):
+                assert((loaded.lookup, loaded.period) == (tree.lookup, tree.period))
+            else:
+                assert(loaded.validate())
+    # the settings come back
+    tree = BTree.from_sorted([1, 1, 2, 3, 3, 3], 3, multiset=True)
+    tree.dump(path)
+    loaded = BTree.load(path)
+    assert(loaded.d == 3 and loaded.multiset and loaded.count(3) == 3 and loaded.get_vals() == [1, 1, 2, 3, 3, 3])
+    RedBlackTree.from_sorted(range(100)).dump(path)
+    loaded = AugmentedRedBlackTree.load(path, lambda a: a, lambda a, b: a + b, 0)
+    assert(loaded.validate() and loaded.aggregate(10, 20) == sum(range(10, 20)))
+    seq = SplaySequence([5, 3, 9, 1])
+    seq.dump(path)
+    assert(SplaySequence.load(path).get_vals() == [5, 3, 9, 1])
+    # wrong kinds, corruption and truncation are refused
+    BTree.from_sorted(range(1000), 4).dump(path)
+    for load in [RedBlackTree.load, SplayTree.load, SplaySequence.load]:
+        try:
+            load(path)
+            assert(False)
+        except ValueError:
+            pass
+    with open(path, 'rb') as f:
+        data = f.read()
+    for broken in [data[:-1], data[:len(data) // 2], data[:100] + bytes([data[100] ^ 1]) + data[101:], b'junk' + data[4:]]:
+        with open(path, 'wb') as f:
+            f.write(broken)
+        try:
+            BTree.load(path)
+            assert(False)
+        except ValueError:
+            pass
+    os.remove(path)
@@ -0,0 +1,317 @@
+import random
+from collections import deque
+from B import BTree
+from RedBlack import RedBlackTree
+from Splay import TopDownSplayTree
+
+# the backends, each built in O(n) from strictly increasing values
+BACKENDS = {
+    'btree': lambda vals: BTree.from_sorted(vals, 8),
+    'red-black': RedBlackTree.from_sorted,
+    'splay': TopDownSplayTree.from_sorted,
+}
+
+# microseconds per operation on 100k values by kind and access pattern, measured by benchmark-sorted-set
+# a write is the mean of an insert and a delete
+COSTS = {
+    'btree': {
+        ('read', 'random'): 1.77,
+        ('read', 'skewed'): 0.89,
+        ('read', 'sequential'): 0.63,
+        ('write', 'random'): 2.12,
+        ('write', 'sequential'): 1.65,
+    },
+    'red-black': {
+        ('read', 'random'): 1.15,
+        ('read', 'skewed'): 0.78,
+        ('read', 'sequential'): 0.54,
+        ('write', 'random'): 2.46,
+        ('write', 'sequential'): 2.02,
+    },
+    'splay': {
+        ('read', 'random'): 3.37,
+        ('read', 'skewed'): 1.19,
+        ('read', 'sequential'): 0.39,
+        ('write', 'random'): 4.98,
+        ('write', 'sequential'): 1.36,
+    },
+}
+
+# microseconds per value to migrate to a backend, listing the values and building the new tree
+REBUILD_COSTS = {'btree': 0.39, 'red-black': 1.61, 'splay': 1.59}
+
+
+class SortedSet:
+    """
+    a sorted set over a BTree, a RedBlackTree or a TopDownSplayTree with an O(1) len
+    in adaptive mode it samples the operation mix of each window of operations: the read ratio,
+    the skew of the reads and how sequential the keys are, and prices the mix on every backend with COSTS
+    when another backend is cheaper by margin long enough for the savings to pay for a bulk rebuild,
+    the set migrates to it, values must be hashable to measure the skew
+    """
+    def __init__(self, iterable=(), backend='btree', adaptive=True, window=4096, margin=0.2):
+        if backend not in BACKENDS:
+            raise ValueError('backend must be one of %s' % (tuple(BACKENDS), ))
+        vals = sorted(set(iterable))
+        self.backend = backend
+        self._tree = BACKENDS[backend](vals)
+        self._len = len(vals)
+        self.adaptive = adaptive
+        self.window = window
+        self.margin = margin
+        # the evaluations which found a cheaper backend, the last 1000 of them
+        self.decisions = deque(maxlen=1000)
+        # the mix of the last full window
+        self.mix = None
+        self._ops = 0
+        self._last = None
+        self._candidate = None
+        self._credit = 0.0
+        self._reset_window()
+
+    def _reset_window(self):
+        self._window_ops = 0
+        self._reads = 0
+        self._ascending = 0
+        self._repeats = 0
+        self._seen = set()
+
+    def _sample(self, val, read):
+        self._ops += 1
+        self._window_ops += 1
+        if self._last is not None and self._last < val:
+            self._ascending += 1
+        self._last = val
+        if read:
+            self._reads += 1
+            if val in self._seen:
+                self._repeats += 1
+            else:
+                self._seen.add(val)
+        if self._window_ops == self.window:
+            self._evaluate()
+
+    def _cost(self, backend, mix):
+        """estimated microseconds per operation of a mix on a backend"""
+        costs = COSTS[backend]
+        seq = mix['sequential']
+        skew = mix['skew']
+        read = (1 - seq) * ((1 - skew) * costs['read', 'random'] + skew * costs['read', 'skewed']) + seq * costs['read', 'sequential']
+        write = (1 - seq) * costs['write', 'random'] + seq * costs['write', 'sequential']
+        return mix['reads'] * read + (1 - mix['reads']) * write
+
+    def _evaluate(self):
+        ops = self._window_ops
+        # random keys go up half of the time, a sorted or reverse sorted run always goes the same way
+        self.mix = mix = {
+            'reads': self._reads / ops,
+            'skew': self._repeats / self._reads if self._reads else 0.0,
+            'sequential': abs(2 * self._ascending / ops - 1),
+        }
+        self._reset_window()
+        costs = {backend: self._cost(backend, mix) for backend in BACKENDS}
+        best = min(costs, key=costs.get)
+        if best == self.backend or costs[best] > costs[self.backend] * (1 - self.margin):
+            self._candidate = None
+            self._credit = 0.0
+            return
+        if best != self._candidate:
+            self._candidate = best
+            self._credit = 0.0
+        # what the cheaper backend would have saved, the rebuild is paid for once the savings add up to it
+        self._credit += (costs[self.backend] - costs[best]) * ops
+        rebuild = REBUILD_COSTS[best] * self._len
+        migrated = self._credit >= rebuild
+        self.decisions.append({
+            'op': self._ops, 'from': self.backend, 'to': best, 'mix': mix, 'costs': costs,
+            'credit': self._credit, 'rebuild': rebuild, 'migrated': migrated,
+        })
+        if migrated:
+            self.migrate(best)
+
+    def migrate(self, backend):
+        """move the values to another backend by a bulk rebuild in O(n)"""
+        if backend not in BACKENDS:
+            raise ValueError('backend must be one of %s' % (tuple(BACKENDS), ))
+        self._tree = BACKENDS[backend](list(self._tree))
+        self.backend = backend
+        self._candidate = None
+        self._credit = 0.0
+
+    def add(self, val):
+        """add a value, return whether the set changed"""
+        if self.adaptive:
+            self._sample(val, False)
+        if self._tree.insert(val):
+            self._len += 1
+            return True
+        return False
+
+    def discard(self, val):
+        """remove a value if present, return whether the set changed"""
+        if self.adaptive:
+            self._sample(val, False)
+        if self._tree.delete(val):
+            self._len -= 1
+            return True
+        return False
+
+    def remove(self, val):
+        if not self.discard(val):
+            raise KeyError(val)
+
+    def update(self, iterable):
+        """add a batch of values, the batch goes to insert_many and is not sampled"""
+        self._len += self._tree.insert_many(iterable)
+
+    def difference_update(self, iterable):
+        """remove a batch of values, the batch goes to delete_many and is not sampled"""
+        self._len -= self._tree.delete_many(iterable)
+
+    def clear(self):
+        self._tree = BACKENDS[self.backend]([])
+        self._len = 0
+
+    def __contains__(self, val):
+        if self.adaptive:
+            self._sample(val, True)
+        return self._tree.has_val(val)
+
+    def __len__(self):
+        return self._len
+
+    def irange(self, lo=None, hi=None, inclusive=(True, False), reverse=False):
+        """lazily yield the values between lo and hi, the seek is sampled as a read"""
+        if self.adaptive:
+            bound = hi if reverse else lo
+            if bound is not None:
+                self._sample(bound, True)
+        return self._tree.irange(lo, hi, inclusive, reverse)
+
+    def __iter__(self):
+        return iter(self._tree)
+
+    def __reversed__(self):
+        return reversed(self._tree)
+
+    def __repr__(self):
+        return 'SortedSet(%r)' % (list(self), )
+
+
+class SortedDict:
+    """
+    a sorted mapping, the keys are kept in a SortedSet and the values in a dict
+    lookups by key only touch the dict, so the keys see the writes and the ordered reads
+    keyword arguments go to the SortedSet of the keys
+    """
+    def __init__(self, items=(), **kwargs):
+        self._values = dict(items)
+        self._keys = SortedSet(self._values, **kwargs)
+
+    @property
+    def backend(self):
+        return self._keys.backend
+
+    @property
+    def decisions(self):
+        return self._keys.decisions
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def __setitem__(self, key, value):
+        if key not in self._values:
+            self._keys.add(key)
+        self._values[key] = value
+
+    def __delitem__(self, key):
+        del self._values[key]
+        self._keys.discard(key)
+
+    def pop(self, key, *default):
+        if key in self._values:
+            self._keys.discard(key)
+        return self._values.pop(key, *default)
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __len__(self):
+        return len(self._values)
+
+    def irange(self, lo=None, hi=None, inclusive=(True, False), reverse=False):
+        """lazily yield the keys between lo and hi"""
+        return self._keys.irange(lo, hi, inclusive, reverse)
+
+    def irange_items(self, lo=None, hi=None, inclusive=(True, False), reverse=False):
+        """lazily yield the (key, value) pairs between lo and hi"""
+        return ((key, self._values[key]) for key in self._keys.irange(lo, hi, inclusive, reverse))
+
+    def keys(self):
+        return iter(self._keys)
+
+    def values(self):
+        return (self._values[key] for key in self._keys)
+
+    def items(self):
+        return ((key, self._values[key]) for key in self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __reversed__(self):
+        return reversed(self._keys)
+
+    def __repr__(self):
+        return 'SortedDict(%r)' % (list(self.items()), )
+
+
+if __name__ == '__main__':
+    # every backend behaves like a set, adaptive or not
+    for backend in BACKENDS:
+        for adaptive in [False, True]:
+            arr = random.sample(range(10000), 2000)
+            s = SortedSet(arr[:500], backend, adaptive, window=256)
+            expected = set(arr[:500])
+            for _ in range(20000):
+                val = random.choice(arr)
+                op = random.randrange(3)
+                if op == 0:
+                    assert(s.add(val) == (val not in expected))
+                    expected.add(val)
+                elif op == 1:
+                    assert(s.discard(val) == (val in expected))
+                    expected.discard(val)
+                else:
+                    assert((val in s) == (val in expected))
+                assert(len(s) == len(expected))
+            assert(list(s) == sorted(expected))
+            assert(list(reversed(s)) == sorted(expected, reverse=True))
+            assert(list(s.irange(1000, 5000)) == sorted(a for a in expected if 1000 <= a < 5000))
+
+    # phases of a workload move the set between backends
+    s = SortedSet(backend='splay', window=1024)
+    for a in range(100000):
+        s.add(a)
+    keys = list(range(100000))
+    assert(s.backend == 'splay')
+    # random reads pay for the rebuild into a red-black tree after about 70 windows
+    for _ in range(150000):
+        assert(random.choice(keys) in s)
+    migrations = [decision for decision in s.decisions if decision['migrated']]
+    for decision in migrations:
+        print('Migrated from', decision['from'], 'to', decision['to'], 'after', decision['op'], 'operations on', decision['mix'])
+    assert([(decision['from'], decision['to']) for decision in migrations] == [('splay', 'red-black')])
+    assert(s.backend == 'red-black' and type(s._tree) is RedBlackTree)
+    assert(list(s) == keys)
+
+    d = SortedDict((a, str(a)) for a in range(100))
+    d[-1] = 'x'
+    del d[50]
+    assert(d.pop(51) == '51' and d.pop(51, None) is None)
+    assert(list(d.keys()) == [-1] + [a for a in range(100) if a not in (50, 51)])
+    assert(list(d.irange_items(48, 53)) == [(48, '48'), (49, '49'), (52, '52')])
+    assert(len(d) == 99 and d[-1] == 'x' and d.get(50) is None)
@@ -1,4 +1,6 @@
+import copy
 import random
+import Snapshot
 from tkinter import W
 
 class Node:
@@ -22,21 +24,41 @@ class Node:
         return "%d:%s" % (self.val, self.parent if self.parent is None else self.parent.val)
 
 class SplayTree:
-    def __init__(self):
+    lookups = ('search', 'splay', 'semi')
+    # set by enable_stats in Stats.py
+    stats = None
+
+    def __init__(self, lookup='search', period=1, min_depth=0):
+        """
+        lookup picks what has_val does with the node it reaches, or the last node on the search path:
+        'search' leaves the tree as is, 'splay' splays the node to the root, 'semi' splays it halfway up
+        with a period of k only every k-th lookup restructures, and only when the node is at least min_depth deep
+        """
+        if lookup not in self.lookups:
+            raise ValueError('lookup must be one of %s' % (self.lookups, ))
+        if period < 1:
+            raise ValueError('period must be at least 1')
         self.root = None
         self.rotate_cnt = 0
+        self.lookup = lookup
+        self.period = period
+        self.min_depth = min_depth
+        self.lookup_cnt = 0
 
     def _splay_query(self, val, node, path):
-        if node.val == val:
-            return node
-        elif node.val < val:
-            # True for right
-            path.append(True)
-            return self._splay_query(val, node.right, path)
-        else:
-            # False for left
-            path.append(False)
-            return self._splay_query(val, node.left, path)
+        start = len(path)
+        while node.val != val:
+            if node.val < val:
+                # True for right
+                path.append(True)
+                node = node.right
+            else:
+                # False for left
+                path.append(False)
+                node = node.left
+        if self.stats is not None:
+            self.stats.op['visits'] += len(path) - start + 1
+        return node
 
     def _set_root(self, node):
         self.root = node
@@ -67,6 +89,8 @@ class SplayTree:
             assert False
 
     def _splay_path(self, node, path):
+        if self.stats is not None:
+            self.stats.op['splay_depth'] += len(path)
         while path:
             if len(path) == 1:
                 # zig
@@ -91,58 +115,182 @@ class SplayTree:
         node = self._splay_query(val, self.root, path)
         self._splay_path(node, path)
 
+    @classmethod
+    def from_sorted(cls, iterable, *args, **kwargs):
+        """build a perfectly balanced tree from strictly increasing values in O(n), the other arguments go to the constructor"""
+        tree = cls(*args, **kwargs)
+        vals = list(iterable)
+        if not all(v1 < v2 for v1, v2 in zip(vals, vals[1:])):
+            raise ValueError('values must be strictly increasing')
+        tree._set_root(tree._build(vals, 0, len(vals)))
+        return tree
+
+    def _build(self, vals, lo, hi):
+        """build a perfectly balanced tree of vals[lo:hi] in O(n)"""
+        if lo == hi:
+            return None
+        mid = (lo + hi) // 2
+        node = Node(vals[mid])
+        node.set_left(self._build(vals, lo, mid))
+        node.set_right(self._build(vals, mid + 1, hi))
+        return node
+
+    def dump(self, path):
+        """write the values to a snapshot file, see Snapshot.py"""
+        Snapshot.dump(path, 'splay', {'lookup': self.lookup, 'period': self.period, 'min_depth': self.min_depth}, self)
+
+    @classmethod
+    def load(cls, path):
+        """
+        rebuild a tree from a snapshot file with from_sorted in O(n), balanced whatever shape the dumped tree had
+        the lookup mode is restored too, a TopDownSplayTree keeps it but always splays
+        """
+        settings, vals = Snapshot.load(path, 'splay')
+        tree = cls.from_sorted(vals)
+        tree.lookup = settings['lookup']
+        tree.period = settings['period']
+        tree.min_depth = settings['min_depth']
+        return tree
+
+    def _search_path(self, val):
+        """find the node holding val, or the last node on its search path, with the path to it"""
+        path = []
+        node = self.root
+        while node.val != val:
+            child = node.right if node.val < val else node.left
+            if child is None:
+                break
+            path.append(node.val < val)
+            node = child
+        if self.stats is not None:
+            self.stats.op['visits'] += len(path) + 1
+        return node, path
+
+    def _splay_near(self, val):
+        """splay the node holding val, or the last node on its search path, to the root"""
+        self._splay_path(*self._search_path(val))
+
+    def _splay_max(self):
+        """splay the max node to the root, which leaves the root without a right child"""
+        self._splay_path(*self._get_max_node(self.root))
+
     def _insert_leaf(self, node, new_node):
         # add a new node to where it should be
-        # simply dfs find the location and insert
+        # simply walk down to the location and insert
         # node is None only when root is None, so just set the root
-        if node == None:
+        if node is None:
             self._set_root(new_node)
-        elif new_node.val < node.val:
-            if node.left is None:
-                node.set_left(new_node)
-            else:
-                self._insert_leaf(node.left, new_node)
-        else:
-            if node.right is None:
-                node.set_right(new_node)
+            return
+        stats = self.stats
+        while True:
+            if stats is not None:
+                stats.op['visits'] += 1
+            if new_node.val < node.val:
+                if node.left is None:
+                    node.set_left(new_node)
+                    return
+                node = node.left
             else:
-                self._insert_leaf(node.right, new_node)
+                if node.right is None:
+                    node.set_right(new_node)
+                    return
+                node = node.right
 
     def has_val(self, val):
-        ans = self._has_val(val, self.root)
-        return ans
+        """check for a value, restructuring the tree around it as the lookup mode says"""
+        if self.lookup == 'search' or self.root is None:
+            return self._has_val(val, self.root)
+        node, path = self._search_path(val)
+        self.lookup_cnt += 1
+        if len(path) >= self.min_depth and self.lookup_cnt % self.period == 0:
+            if self.lookup == 'semi':
+                # splay steps over the lower half of the path only, the node stops halfway up
+                del path[:len(path) // 2]
+            self._splay_path(node, path)
+        return node.val == val
 
     def _has_val(self, val, node):
-        if node is None:
-            return False
-        if val == node.val:
-            return True
-        elif val < node.val:
-            return self._has_val(val, node.left)
-        else:
-            return self._has_val(val, node.right)
+        stats = self.stats
+        while node is not None:
+            if stats is not None:
+                stats.op['visits'] += 1
+            if val == node.val:
+                return True
+            node = node.left if val < node.val else node.right
+        return False
 
     def insert(self, val):
+        """insert a value, return whether the tree changed"""
         if self._has_val(val, self.root):
-            return
+            return False
         new_node = Node(val)
         self._insert_leaf(self.root, new_node)
         self._splay(val)
+        return True
+
+    def insert_many(self, iterable):
+        """
+        insert a batch of values, return how many changed the tree
+        each value takes one descent, which splays its neighbour to the root, and goes in above it as the new root
+        in sorted order each value is next to the previous one at the root,
+        so the splaying itself acts as the finger and a sorted sweep costs O(1) amortized per value
+        """
+        changed = 0
+        for val in sorted(iterable):
+            new_node = Node(val)
+            if self.root is not None:
+                self._splay_near(val)
+                root = self.root
+                if root.val == val:
+                    continue
+                # split the tree around the root, the neighbour of val
+                if val < root.val:
+                    new_node.set_left(root.left)
+                    root.left = None
+                    new_node.set_right(root)
+                else:
+                    new_node.set_right(root.right)
+                    root.right = None
+                    new_node.set_left(root)
+            self._set_root(new_node)
+            changed += 1
+        return changed
+
+    def delete_many(self, iterable):
+        """delete a batch of values in sorted order, each with one descent splaying it or its neighbour to the root"""
+        changed = 0
+        for val in sorted(iterable):
+            if self.root is None:
+                break
+            self._splay_near(val)
+            if self.root.val == val:
+                self._delete_root()
+                changed += 1
+        return changed
 
     def _get_max_node(self, node):
         """get the max node, with the searching path"""
         path = []
         assert node is not None
         while node.right is not None:
-            path.append(node)
+            # True for right, as in _splay_query, so the path splays zig-zig
+            path.append(True)
             node = node.right
+        if self.stats is not None:
+            self.stats.op['visits'] += len(path) + 1
         return node, path
 
     def delete(self, val):
+        """delete a value, return whether the tree changed"""
         if not self._has_val(val, self.root):
-            return
+            return False
         # first, splay it to root
         self._splay(val)
+        self._delete_root()
+        return True
+
+    def _delete_root(self):
+        """remove the root node, joining its subtrees under the max of the left one"""
         deleted_node = self.root
         if deleted_node.left is None:
             self._set_root(deleted_node.right)
@@ -155,12 +303,115 @@ class SplayTree:
             # combine left and right subtree
             self.root.set_right(deleted_node.right)
 
+    def _wrap(self, root):
+        """make a tree of the same type and settings around a detached root"""
+        tree = copy.copy(self)
+        tree._set_root(root)
+        return tree
+
+    def split(self, val):
+        """
+        split into the trees of values smaller than val and not smaller than val, in O(log n) amortized
+        the nodes are moved, so this tree is left empty
+        """
+        l = r = root = self.root
+        if root is not None:
+            # the neighbour of val comes up, so the cut is right below the root
+            self._splay_near(val)
+            root = self.root
+            if root.val < val:
+                r = root.right
+                root.right = None
+                l = root
+            else:
+                l = root.left
+                root.left = None
+                r = root
+        self.root = None
+        return self._wrap(l), self._wrap(r)
+
+    def join(self, other):
+        """
+        move the values of other behind the values of this tree, in O(log n) amortized
+        all values of other must be greater than the values of this tree, and other is left empty
+        """
+        if self.root is None:
+            self._set_root(other.root)
+        elif other.root is not None:
+            self._splay_max()
+            self.root.set_right(other.root)
+        other.root = None
+
+    def _iter_up(self, lo, inclusive):
+        """yield values from lo upwards, the stack holds the nodes still to be yielded"""
+        stack = []
+        node = self.root
+        while node is not None:
+            if lo is not None and (node.val < lo or not inclusive and node.val == lo):
+                node = node.right
+            else:
+                stack.append(node)
+                node = node.left
+        while stack:
+            node = stack.pop()
+            yield node.val
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def _iter_down(self, hi, inclusive):
+        """yield values from hi downwards, the stack holds the nodes still to be yielded"""
+        stack = []
+        node = self.root
+        while node is not None:
+            if hi is not None and (node.val > hi or not inclusive and node.val == hi):
+                node = node.left
+            else:
+                stack.append(node)
+                node = node.right
+        while stack:
+            node = stack.pop()
+            yield node.val
+            node = node.left
+            while node is not None:
+                stack.append(node)
+                node = node.right
+
+    def irange(self, lo=None, hi=None, inclusive=(True, False), reverse=False):
+        """
+        lazily yield the values between lo and hi, a None bound is unbounded
+        the tree is not splayed, each step after the seek is O(1) amortized
+        """
+        if reverse:
+            for val in self._iter_down(hi, inclusive[1]):
+                if lo is not None and (val < lo or not inclusive[0] and val == lo):
+                    return
+                yield val
+        else:
+            for val in self._iter_up(lo, inclusive[0]):
+                if hi is not None and (val > hi or not inclusive[1] and val == hi):
+                    return
+                yield val
+
+    def __iter__(self):
+        return self._iter_up(None, True)
+
+    def __reversed__(self):
+        return self._iter_down(None, True)
+
     def _collect_vals(self, root, arr):
-        if root is None:
-            return
-        self._collect_vals(root.left, arr)
-        arr.append(root.val)
-        self._collect_vals(root.right, arr)
+        """append the values under root in order, with a stack of its own since the tree can be a path of any length"""
+        stack = []
+        node = root
+        while stack or node is not None:
+            if node is not None:
+                stack.append(node)
+                node = node.left
+            else:
+                node = stack.pop()
+                arr.append(node.val)
+                node = node.right
 
     def get_vals(self):
         ans = []
@@ -168,14 +419,406 @@ class SplayTree:
         return ans
 
     def _to_str(self, node):
-        if node is None:
-            return ''
-        return ' ' + str(node) + ' ' + self._to_str(node.left) + self._to_str(node.right)
+        """the nodes under node in preorder"""
+        parts = []
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            if node is not None:
+                parts.append(' ' + str(node) + ' ')
+                stack.append(node.right)
+                stack.append(node.left)
+        return ''.join(parts)
 
     def __str__(self):
         return self._to_str(self.root)
 
 
+class TopDownSplayTree(SplayTree):
+    """
+    splay tree of Sleator and Tarjan's top-down splaying
+    the search path is split into a left and a right tree on the way down and reassembled at the end,
+    so every operation is a single pass without recursion, path lists or parent pointers
+    lookups splay too, which the bottom-up engine does not do
+    """
+    def __init__(self):
+        super().__init__()
+        # holds the roots of the left and right trees while splaying
+        self.header = Node(None)
+
+    def _splay(self, val):
+        """splay the node holding val, or the last node on its search path, to the root"""
+        node = self.root
+        header = self.header
+        header.left = header.right = None
+        # the max node of the left tree, and the min node of the right tree
+        left = right = header
+        # the nodes on the search path, the next one is counted once its value is compared
+        visits = 1
+        while True:
+            if val < node.val:
+                child = node.left
+                if child is None:
+                    break
+                visits += 1
+                if val < child.val:
+                    # zig-zig, rotate child up before linking
+                    node.left = child.right
+                    child.right = node
+                    node = child
+                    self.rotate_cnt += 1
+                    if node.left is None:
+                        break
+                    visits += 1
+                # link node into the right tree
+                right.left = node
+                right = node
+                node = node.left
+            elif node.val < val:
+                child = node.right
+                if child is None:
+                    break
+                visits += 1
+                if child.val < val:
+                    node.right = child.left
+                    child.left = node
+                    node = child
+                    self.rotate_cnt += 1
+                    if node.right is None:
+                        break
+                    visits += 1
+                left.right = node
+                left = node
+                node = node.right
+            else:
+                break
+        # reassemble
+        left.right = node.left
+        right.left = node.right
+        node.left = header.right
+        node.right = header.left
+        self.root = node
+        if self.stats is not None:
+            self.stats.op['visits'] += visits
+            self.stats.op['splay_depth'] += visits - 1
+
+    # _splay already stops at the last node on the search path
+    _splay_near = _splay
+
+    def _wrap(self, root):
+        tree = super()._wrap(root)
+        tree.header = Node(None)
+        return tree
+
+    def _splay_max(self):
+        node = self.root
+        while node.right is not None:
+            node = node.right
+        self._splay(node.val)
+
+    def has_val(self, val):
+        if self.root is None:
+            return False
+        self._splay(val)
+        return self.root.val == val
+
+    def insert(self, val):
+        """insert a value, return whether the tree changed"""
+        new_node = Node(val)
+        if self.root is None:
+            self.root = new_node
+            return True
+        self._splay(val)
+        root = self.root
+        if root.val == val:
+            return False
+        # the root is the neighbour of val, split the tree around it
+        if val < root.val:
+            new_node.left = root.left
+            new_node.right = root
+            root.left = None
+        else:
+            new_node.right = root.right
+            new_node.left = root
+            root.right = None
+        self.root = new_node
+        return True
+
+    def delete(self, val):
+        """delete a value, return whether the tree changed"""
+        if self.root is None:
+            return False
+        self._splay(val)
+        root = self.root
+        if root.val != val:
+            return False
+        if root.left is None:
+            self.root = root.right
+        else:
+            # val is above every value on the left, so splaying it brings the max up with no right child
+            self.root = root.left
+            self._splay(val)
+            self.root.right = root.right
+        return True
+
+    # insert and delete splay once per value already
+    def insert_many(self, iterable):
+        return sum(self.insert(val) for val in sorted(iterable))
+
+    def delete_many(self, iterable):
+        return sum(self.delete(val) for val in sorted(iterable))
+
+
+class SeqNode(Node):
+    def __init__(self, val):
+        super().__init__(val)
+        # the number of values in the subtree
+        self.size = 1
+        # a lazy reverse tag, the children are yet to be swapped and their subtrees reversed in turn
+        self.rev = False
+
+    def __str__(self):
+        return "%s:%d%s" % (self.val, self.size, ':r' if self.rev else '')
+
+
+class SplaySequence(SplayTree):
+    """
+    splay tree keyed implicitly by position, a sequence with O(log n) amortized edits anywhere
+    a value's index is the size of everything to its left, so it is found by subtree sizes instead of comparisons
+    ranges are reversed lazily by a tag pushed down on the way to the nodes below it
+    """
+    def __init__(self, iterable=()):
+        super().__init__()
+        vals = list(iterable)
+        self._set_root(self._build(vals, 0, len(vals)))
+
+    def _build(self, vals, lo, hi):
+        if lo == hi:
+            return None
+        mid = (lo + hi) // 2
+        node = SeqNode(vals[mid])
+        node.set_left(self._build(vals, lo, mid))
+        node.set_right(self._build(vals, mid + 1, hi))
+        node.size = hi - lo
+        return node
+
+    def dump(self, path):
+        """write the values to a snapshot file in sequence order, see Snapshot.py"""
+        Snapshot.dump(path, 'sequence', {}, self)
+
+    @classmethod
+    def load(cls, path):
+        """rebuild a sequence from a snapshot file in O(n)"""
+        _, vals = Snapshot.load(path, 'sequence')
+        return cls(vals)
+
+    def _size(self, node):
+        """size of a subtree (null node is empty)"""
+        return 0 if node is None else node.size
+
+    def _resize(self, node):
+        node.size = 1 + self._size(node.left) + self._size(node.right)
+
+    def _push(self, node):
+        """apply the reverse tag of a node to its children"""
+        if node.rev:
+            node.rev = False
+            node.left, node.right = node.right, node.left
+            if node.left is not None:
+                node.left.rev = not node.left.rev
+            if node.right is not None:
+                node.right.rev = not node.right.rev
+
+    def _rotate(self, node):
+        # the nodes on a splayed path are pushed already, so only the sizes of the two rotated nodes change
+        parent = node.parent
+        super()._rotate(node)
+        self._resize(parent)
+        self._resize(node)
+
+    def _splay_at(self, k):
+        """splay the node at index k to the root, pushing the tags on the way down"""
+        node = self.root
+        path = []
+        while True:
+            self._push(node)
+            left = self._size(node.left)
+            if k < left:
+                path.append(False)
+                node = node.left
+            elif k > left:
+                k -= left + 1
+                path.append(True)
+                node = node.right
+            else:
+                break
+        self._splay_path(node, path)
+
+    def _split(self, k):
+        """split the first k values off, return the roots of both parts, this tree is left empty"""
+        root = self.root
+        if root is None or k == 0:
+            l, r = None, root
+        elif k == root.size:
+            l, r = root, None
+        else:
+            self._splay_at(k)
+            r = self.root
+            l = r.left
+            r.left = None
+            l.parent = None
+            r.size -= l.size
+        self.root = None
+        return l, r
+
+    def _join(self, l, r):
+        """join the roots l and r into this tree, which must be empty"""
+        self._set_root(l)
+        if l is None:
+            self._set_root(r)
+        elif r is not None:
+            # the last value comes up with no right child
+            self._splay_at(l.size - 1)
+            self.root.set_right(r)
+            self.root.size += r.size
+
+    def _cut3(self, i, j):
+        """split into the roots of the values before index i, from i to j and from j on, this tree is left empty"""
+        i, j, _ = slice(i, j).indices(len(self))
+        j = max(i, j)
+        l, r = self._split(i)
+        self._set_root(r)
+        m, r = self._split(j - i)
+        return l, m, r
+
+    def _join3(self, l, m, r):
+        self._join(m, r)
+        m = self.root
+        self.root = None
+        self._join(l, m)
+
+    def _index(self, index):
+        n = len(self)
+        if index < 0:
+            index += n
+        if not 0 <= index < n:
+            raise IndexError('SplaySequence index out of range')
+        return index
+
+    def __len__(self):
+        return self._size(self.root)
+
+    def __getitem__(self, index):
+        """a value by index in O(log n) amortized, or a slice as a list in O(log n + k) amortized"""
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                return self.get_vals()[index]
+            l, m, r = self._cut3(index.start, index.stop)
+            vals = list(self._iter_nodes(m, False))
+            self._join3(l, m, r)
+            return vals
+        self._splay_at(self._index(index))
+        return self.root.val
+
+    def __setitem__(self, index, val):
+        self._splay_at(self._index(index))
+        self.root.val = val
+
+    def __delitem__(self, index):
+        if isinstance(index, slice):
+            if index.step not in (None, 1):
+                raise ValueError('SplaySequence only deletes contiguous slices')
+            self.cut(index.start, index.stop)
+        else:
+            self.pop(index)
+
+    def insert(self, index, val):
+        """insert val before index, like list.insert, in O(log n) amortized"""
+        index, _, _ = slice(index, None).indices(len(self))
+        l, r = self._split(index)
+        node = SeqNode(val)
+        node.set_left(l)
+        node.set_right(r)
+        self._resize(node)
+        self._set_root(node)
+
+    def append(self, val):
+        self.insert(len(self), val)
+
+    def extend(self, iterable):
+        self.join(SplaySequence(iterable))
+
+    def pop(self, index=-1):
+        """remove and return the value at index, in O(log n) amortized"""
+        self._splay_at(self._index(index))
+        root = self.root
+        l, r = root.left, root.right
+        for child in (l, r):
+            if child is not None:
+                child.parent = None
+        self.root = None
+        self._join(l, r)
+        return root.val
+
+    def cut(self, i=None, j=None):
+        """remove the values from index i to j, like a slice, and return them as a sequence, in O(log n) amortized"""
+        l, m, r = self._cut3(i, j)
+        self._join(l, r)
+        return self._wrap(m)
+
+    def reverse(self, i=None, j=None):
+        """reverse the values from index i to j, like a slice, in O(log n) amortized"""
+        l, m, r = self._cut3(i, j)
+        if m is not None:
+            m.rev = not m.rev
+        self._join3(l, m, r)
+
+    def split(self, k):
+        """
+        split into the sequences of the first k values and the rest, in O(log n) amortized
+        the nodes are moved, so this sequence is left empty
+        """
+        l, r = self._split(max(0, min(k, len(self))))
+        return self._wrap(l), self._wrap(r)
+
+    def join(self, other):
+        """move the values of other to the end of this sequence, in O(log n) amortized, other is left empty"""
+        l = self.root
+        self.root = None
+        self._join(l, other.root)
+        other.root = None
+
+    def _by_value(self, *args, **kwargs):
+        raise TypeError('SplaySequence is addressed by index, not by value')
+
+    has_val = delete = insert_many = delete_many = irange = _by_value
+
+    def _iter_nodes(self, node, reverse):
+        """yield the values of the subtree of node in order, pushing the tags on the way"""
+        stack = []
+        while stack or node is not None:
+            if node is not None:
+                self._push(node)
+                stack.append(node)
+                node = node.right if reverse else node.left
+            else:
+                node = stack.pop()
+                yield node.val
+                node = node.left if reverse else node.right
+
+    def __iter__(self):
+        return self._iter_nodes(self.root, False)
+
+    def __reversed__(self):
+        return self._iter_nodes(self.root, True)
+
+    def get_vals(self):
+        return list(self)
+
+    def __str__(self):
+        return str(self.get_vals())
+
+
 if __name__ == '__main__':
     for n in [100, 1000, 2000, 5000]:
         arr = [i for i in range(-n, n)]
@@ -193,4 +836,127 @@ if __name__ == '__main__':
                 tree.delete(deleted)
                 expected.remove(deleted)
                 assert(tree.get_vals() == sorted(list(expected)))
-        print('When there are', n, 'elements, the Splay tree rotated for', tree.rotate_cnt, 'times')
\ No newline at end of file
+        print('When there are', n, 'elements, the Splay tree rotated for', tree.rotate_cnt, 'times')
+
+    # sorted inserts leave a path far deeper than the recursion limit, every walk must survive it
+    for factory in [SplayTree, TopDownSplayTree]:
+        n = 100000
+        tree = factory()
+        for a in range(n):
+            tree.insert(a)
+        assert(tree.get_vals() == list(range(n)))
+        assert(len(str(tree).split()) == n)
+        assert(tree.has_val(0) and tree.delete(0) and tree.delete(n - 1))
+        assert(tree.get_vals() == list(range(1, n - 1)))
+
+    for n in [100, 1000, 2000, 5000]:
+        arr = [i for i in range(-n, n)]
+        random.shuffle(arr)
+        tree = TopDownSplayTree()
+        expected = set()
+        for i, a in enumerate(arr):
+            assert(tree.insert(a))
+            assert(not tree.insert(a))
+            expected.add(a)
+            if i % 3 == 0:
+                deleted = random.choice(arr[:i + 1])
+                assert(tree.delete(deleted) == (deleted in expected))
+                expected.discard(deleted)
+                assert(not tree.has_val(deleted))
+        assert(tree.get_vals() == sorted(expected))
+        assert(all(tree.has_val(a) for a in expected))
+        print('When there are', n, 'elements, the top-down Splay tree rotated for', tree.rotate_cnt, 'times')
+
+    # lookups that restructure the tree
+    arr = random.sample(range(10000), 2000)
+    for lookup, period, min_depth in [('splay', 1, 0), ('semi', 1, 0), ('splay', 4, 0), ('splay', 1, 12), ('semi', 3, 5)]:
+        tree = SplayTree(lookup, period, min_depth)
+        for a in arr:
+            tree.insert(a)
+        for _ in range(5000):
+            val = random.randrange(10000)
+            assert(tree.has_val(val) == (val in arr))
+            if lookup == 'splay' and period == 1 and min_depth == 0:
+                assert(tree.root.val == val or val not in arr)
+        assert(tree.get_vals() == sorted(arr))
+        tree._splay_near(-1)
+        assert(tree.root.val == min(arr) and tree.root.left is None)
+
+    # bulk building
+    for factory in [SplayTree, TopDownSplayTree]:
+        tree = factory.from_sorted(range(0, 2000, 2))
+        assert(tree.get_vals() == list(range(0, 2000, 2)))
+        assert(tree.insert(1) and tree.delete(4) and not tree.has_val(4))
+
+    # batches against a set, then single operations on the tree they left
+    for factory in [SplayTree, TopDownSplayTree]:
+        tree = factory()
+        expected = set()
+        for _ in range(50):
+            batch = [random.randrange(3000) for _ in range(200)]
+            assert(tree.insert_many(batch) == len(set(batch) - expected))
+            expected.update(batch)
+            batch = [random.randrange(3000) for _ in range(150)]
+            assert(tree.delete_many(batch) == len(set(batch) & expected))
+            expected.difference_update(batch)
+            assert(tree.get_vals() == sorted(expected))
+        for a in range(3000):
+            assert(tree.has_val(a) == (a in expected) and tree.delete(a) == (a in expected))
+        assert(tree.root is None)
+
+    # keyed split and join
+    for factory in [SplayTree, TopDownSplayTree]:
+        arr = random.sample(range(10000), 2000)
+        tree = factory()
+        for a in arr:
+            tree.insert(a)
+        for _ in range(100):
+            val = random.randrange(-10, 10010)
+            left, right = tree.split(val)
+            assert(tree.root is None)
+            assert(left.get_vals() == sorted(a for a in arr if a < val))
+            assert(right.get_vals() == sorted(a for a in arr if a >= val))
+            left.join(right)
+            assert(right.root is None)
+            assert(left.get_vals() == sorted(arr))
+            tree = left
+        assert(all(tree.has_val(a) for a in arr))
+
+    # implicit-key sequence against a list
+    seq = SplaySequence(range(100))
+    expected = list(range(100))
+    for step in range(5000):
+        i, j = sorted(random.randrange(-10, len(expected) + 10) for _ in range(2))
+        op = random.randrange(7)
+        if op == 0:
+            seq.insert(i, step)
+            expected.insert(i, step)
+        elif op == 1 and expected:
+            i = random.randrange(-len(expected), len(expected))
+            assert(seq.pop(i) == expected.pop(i))
+        elif op == 2:
+            assert(seq.cut(i, j).get_vals() == expected[i:j])
+            del expected[i:j]
+        elif op == 3:
+            seq.reverse(i, j)
+            expected[i:j] = expected[i:j][::-1]
+        elif op == 4:
+            assert(seq[i:j] == expected[i:j])
+            if expected:
+                i = random.randrange(len(expected))
+                assert(seq[i] == expected[i])
+                seq[i] = expected[i] = -step
+        elif op == 5:
+            left, right = seq.split(i)
+            assert(left.get_vals() == expected[:max(i, 0)])
+            right.reverse()
+            left.join(right)
+            expected[max(i, 0):] = expected[max(i, 0):][::-1]
+            seq = left
+        else:
+            seq.extend(range(step % 7))
+            expected.extend(range(step % 7))
+        assert(len(seq) == len(expected))
+    assert(seq.get_vals() == expected)
+    assert(list(reversed(seq)) == expected[::-1])
+    print('The Splay sequence matched a list after 5000 edits')
@@ -0,0 +1,310 @@
+import random
+from bisect import bisect_left
+from collections import Counter
+from B import BTree
+from RedBlack import RedBlackTree
+from Splay import SplayTree, TopDownSplayTree, SplaySequence
+
+COUNTERS = ('visits', 'rotations', 'splits', 'fuses', 'borrows', 'recolors', 'splay_depth')
+ZEROS = (0, ) * len(COUNTERS)
+
+
+class TreeStats:
+    """
+    counters of the structural work of a tree, kept while stats are enabled
+    visits counts the nodes an operation goes through: its descents, the walks down to a predecessor or along a spine,
+    and the siblings a B-tree node borrows from or fuses with, splay_depth counts the length of the splayed paths
+    op holds the counters of the running operation, which are folded into the totals and the per operation histograms
+    only every sample_every-th operation is counted, the others run uncounted at full speed,
+    so ops, totals and histograms are those of the sample, and per_op the means over it
+    hook, if given, is called with the operation name, its argument and its counters on every counted operation
+    the stats stay readable after disable_stats, engine is the mixin which measures the height of the tree
+    """
+    def __init__(self, tree, engine, hook=None, sample_every=1):
+        if sample_every < 1:
+            raise ValueError('sample_every must be at least 1')
+        self.tree = tree
+        self.engine = engine
+        self.hook = hook
+        self.sample_every = sample_every
+        self.reset()
+
+    def reset(self):
+        self.op_cnt = 0
+        self.op = dict.fromkeys(COUNTERS, 0)
+        # the work done outside of an operation, by a batch or a split for example
+        self.outside = Counter()
+        # how many operations of each name did each combination of counts, the totals and histograms are folded from it
+        self.seen = Counter()
+
+    def _begin(self):
+        counts = tuple(self.op.values())
+        if counts != ZEROS:
+            self.outside.update(dict(zip(COUNTERS, counts)))
+            self.op.update(zip(COUNTERS, ZEROS))
+
+    def _end(self, name, arg):
+        op = self.op
+        self.seen[name, tuple(op.values())] += 1
+        if self.hook is not None:
+            self.hook(name, arg, dict(op))
+        op.update(zip(COUNTERS, ZEROS))
+
+    def snapshot(self):
+        """the counters so far, their means per counted operation, the per operation histograms and the current height"""
+        self._begin()
+        ops = Counter()
+        totals = Counter(self.outside)
+        histograms = {counter: Counter() for counter in COUNTERS}
+        for (name, counts), times in self.seen.items():
+            ops[name] += times
+            for counter, count in zip(COUNTERS, counts):
+                totals[counter] += count * times
+                histograms[counter][count] += times
+        counted = sum(ops.values())
+        return {
+            'ops': dict(ops),
+            'totals': {counter: totals[counter] for counter in COUNTERS},
+            'per_op': {counter: totals[counter] / counted if counted else 0.0 for counter in COUNTERS},
+            'histograms': {counter: dict(sorted(histogram.items())) for counter, histogram in histograms.items()},
+            'height': self.engine._stats_height(self.tree),
+        }
+
+
+def _bst_height(tree):
+    height = 0
+    stack = [(tree.root, 1)] if tree.root is not None else []
+    while stack:
+        node, depth = stack.pop()
+        height = max(height, depth)
+        for child in (node.left, node.right):
+            if child is not None:
+                stack.append((child, depth + 1))
+    return height
+
+
+def _op(name):
+    """wrap an operation of the engine to count it, or to run it uncounted when it is not in the sample"""
+    def op(self, val, *args):
+        stats = self.stats
+        stats.op_cnt += 1
+        if stats.op_cnt % stats.sample_every:
+            # the engines count only while the tree has stats
+            self.stats = None
+            try:
+                return getattr(super(Instrumented, self), name)(val, *args)
+            finally:
+                self.stats = stats
+        stats._begin()
+        token = self._stats_start()
+        ans = getattr(super(Instrumented, self), name)(val, *args)
+        self._stats_stop(token)
+        stats._end(name, val)
+        return ans
+    op.__name__ = name
+    return op
+
+
+class Instrumented:
+    """
+    the operations of an instrumented tree, enable_stats moves a tree to a subclass of this and its engine mixin
+    the engines count their own work whenever the tree has stats, the class attribute stats of a tree without them is None,
+    so the mixins only wrap the operations and measure the height
+    """
+    insert = _op('insert')
+    delete = _op('delete')
+    has_val = _op('has_val')
+
+    def _stats_start(self):
+        return None
+
+    def _stats_stop(self, token):
+        pass
+
+
+class BTreeStats(Instrumented):
+    """
+    the nodes count their splits, fuses and borrows, and keep their class:
+    assigning __class__ to a node slows down the attribute reads on it for good, even once it is assigned back
+    """
+    def _stats_height(self):
+        height = 1
+        node = self.root
+        while node.children:
+            height += 1
+            node = node.children[0]
+        return height
+
+
+class RedBlackTreeStats(Instrumented):
+    """
+    rotations are counted by _lift, and recolorings where the fixups paint the nodes
+    persistent mode builds new nodes instead of rotating and recoloring, so only its visits are counted,
+    those of the search and of the copied path
+    """
+    def _stats_height(self):
+        return _bst_height(self)
+
+
+class SplayTreeStats(Instrumented):
+    """rotations are taken from rotate_cnt, which top-down splaying only bumps on its zig-zig steps"""
+    def _stats_start(self):
+        return self.rotate_cnt
+
+    def _stats_stop(self, token):
+        self.stats.op['rotations'] += self.rotate_cnt - token
+
+    def _stats_height(self):
+        return _bst_height(self)
+
+
+# the engine mixins, subclasses first
+mixins = [
+    (SplayTree, SplayTreeStats),
+    (RedBlackTree, RedBlackTreeStats),
+    (BTree, BTreeStats),
+]
+instrumented_classes = {}
+
+
+def enable_stats(tree, hook=None, sample_every=1):
+    """
+    start counting the work of a BTree, RedBlackTree or SplayTree, or of their subclasses, return its TreeStats
+    the tree moves to an instrumented subclass of its class until disable_stats, the stats are also at tree.stats
+    """
+    if tree.stats is not None:
+        raise ValueError('stats are enabled already')
+    if isinstance(tree, SplaySequence):
+        raise TypeError('SplaySequence is addressed by index, its operations cannot be counted by value')
+    for engine, mixin in mixins:
+        if isinstance(tree, engine):
+            break
+    else:
+        raise TypeError('no stats for %s' % type(tree).__name__)
+    cls = type(tree)
+    if cls not in instrumented_classes:
+        instrumented_classes[cls] = type('Instrumented' + cls.__name__, (mixin, cls), {})
+    tree.stats = TreeStats(tree, mixin, hook, sample_every)
+    tree.__class__ = instrumented_classes[cls]
+    return tree.stats
+
+
+def disable_stats(tree):
+    """stop counting, and move the tree back to its own class"""
+    if tree.stats is None:
+        return
+    tree.__class__ = type(tree).__bases__[-1]
+    del tree.stats
+
+
+if __name__ == '__main__':
+    def depth(tree, val):
+        """the number of nodes on the search path of val, measured apart from the engines"""
+        count = 0
+        if isinstance(tree, BTree):
+            node = tree.root
+            while True:
+                count += 1
+                i = bisect_left(node.vals, val)
+                if i < len(node.vals) and node.vals[i] == val or not node.children:
+                    return count
+                node = node.children[i]
+        node = tree.root
+        while node is not None and node.val != val:
+            count += 1
+            node = node.left if val < node.val else node.right
+        return count + (node is not None)
+
+    def b_nodes(tree):
+        count = 0
+        stack = [tree.root]
+        while stack:
+            node = stack.pop()
+            count += 1
+            stack.extend(node.children)
+        return count
+
+    factories = [lambda: BTree(2), lambda: BTree(8), RedBlackTree, lambda: RedBlackTree(persistent=True), SplayTree, lambda: SplayTree('splay'), TopDownSplayTree]
+    for factory in factories:
+        tree = factory()
+        cls = type(tree)
+        arr = random.sample(range(10000), 3000)
+        counted = []
+        stats = enable_stats(tree, lambda name, val, counts: counted.append((name, val, counts)))
+        for a in arr:
+            assert(tree.insert(a))
+        if isinstance(tree, BTree):
+            # every split adds a node, and a split of the root adds the new root too
+            inserted = stats.snapshot()
+            assert(b_nodes(tree) == 1 + inserted['totals']['splits'] + inserted['height'] - 1)
+        for a in arr[:1000] + random.sample(range(10000, 20000), 100):
+            # a lookup visits its search path, splayed or not, as it was before the lookup
+            expected = depth(tree, a)
+            assert(bool(tree.has_val(a)) == (a < 10000))
+            assert(counted[-1][2]['visits'] == expected)
+        nodes = b_nodes(tree) if isinstance(tree, BTree) else None
+        for a in arr[:1500]:
+            expected = depth(tree, a)
+            assert(tree.delete(a))
+            assert(counted[-1][2]['visits'] >= expected)
+        snapshot = stats.snapshot()
+        if isinstance(tree, BTree):
+            # every fuse takes a node away, and so does the root it empties
+            fuses = snapshot['totals']['fuses'] - inserted['totals']['fuses']
+            assert(nodes - b_nodes(tree) == fuses + inserted['height'] - snapshot['height'])
+        assert(snapshot['ops'] == {'insert': 3000, 'has_val': 1100, 'delete': 1500})
+        assert(len(counted) == 5600)
+        assert(all(sum(histogram.values()) == 5600 for histogram in snapshot['histograms'].values()))
+        assert(sum(value * count for value, count in snapshot['histograms']['visits'].items()) == snapshot['totals']['visits'])
+        assert(tree.get_vals() == sorted(arr[1500:]))
+        totals = snapshot['totals']
+        if isinstance(tree, BTree):
+            assert(tree.validate() and totals['splits'] > 0 and totals['fuses'] + totals['borrows'] > 0)
+        elif isinstance(tree, RedBlackTree):
+            assert(tree.validate() and (tree.persistent or totals['rotations'] > 0 and totals['recolors'] > 0))
+        else:
+            assert(totals['rotations'] == tree.rotate_cnt and totals['splay_depth'] > 0)
+        print(cls.__name__, 'height', snapshot['height'], 'per operation', {counter: round(mean, 2) for counter, mean in snapshot['per_op'].items()})
+        disable_stats(tree)
+        assert(type(tree) is cls and tree.stats is None)
+        for a in arr[:1500]:
+            tree.insert(a)
+        assert(tree.get_vals() == sorted(arr))
+        assert(stats.snapshot()['ops']['insert'] == 3000)
+
+        # only every 10th operation is counted, the others run uncounted
+        tree = factory()
+        sampled = []
+        stats = enable_stats(tree, lambda name, val, counts: sampled.append((name, val, counts)), sample_every=10)
+        for a in arr:
+            tree.insert(a)
+        for a in arr[:1000]:
+            assert(tree.has_val(a))
+        for a in arr[:1500]:
+            assert(tree.delete(a))
+        snapshot = stats.snapshot()
+        assert(snapshot['ops'] == {'insert': 300, 'has_val': 100, 'delete': 150} and len(sampled) == 550)
+        assert(all(sum(histogram.values()) == 550 for histogram in snapshot['histograms'].values()))
+        assert(all(counts['visits'] > 0 for _, _, counts in sampled))
+        assert(tree.get_vals() == sorted(arr[1500:]))
+        disable_stats(tree)
+
+    # a splay tree batch descends once per value, where insert and delete look the value up before splaying it
+    arr = random.sample(range(10000), 3000)
+    visits = []
+    for batch in [False, True]:
+        tree = SplayTree()
+        stats = enable_stats(tree)
+        if batch:
+            tree.insert_many(arr)
+            tree.delete_many(arr[:1500])
+        else:
+            for a in sorted(arr):
+                tree.insert(a)
+            for a in sorted(arr[:1500]):
+                tree.delete(a)
+        assert(tree.get_vals() == sorted(arr[1500:]))
+        visits.append(stats.snapshot()['totals']['visits'])
+        disable_stats(tree)
+    assert(visits[1] < visits[0])
+    print('SplayTree batch visits', visits[1], 'one by one', visits[0])
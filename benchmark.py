@@ -1,9 +1,31 @@
+import argparse
+import bisect
+import json
+import os
+import pickle
+import platform
 import random
+import sys
+import threading
 import time
-from matplotlib import pyplot as plt
-from B import BTree
-from RedBlack import RedBlackTree
-from Splay import SplayTree
+import tracemalloc
+from itertools import islice
+try:
+    from matplotlib import pyplot as plt
+except ImportError:
+    # plotting is optional, only the plotting experiments and suite --plot need it
+    plt = None
+try:
+    import numpy as np
+except ImportError:
+    # numpy is optional as well, only benchmark-frozen needs it
+    np = None
+from B import BTree, BPlusTree, Node as BNode
+from RedBlack import RedBlackTree, AugmentedRedBlackTree, IntervalTree
+from Splay import SplayTree, TopDownSplayTree, SplaySequence
+from Sorted import BACKENDS, SortedSet
+from Sharded import ShardedTree, ProcessShardedTree
+from Stats import enable_stats
 
 
 def timing(func, *args, **kwargs):
@@ -27,7 +49,13 @@ def experiment_insert(arr, tree):
         tree.insert(a)
 
 
+def need_plt():
+    if plt is None:
+        raise SystemExit('matplotlib is needed to plot')
+
+
 def experiment_one_round(expriment_func, experiment_name):
+    need_plt()
     arrs = []
     lens = [100, 1000, 2000, 5000, 10000, 20000, 30000, 40000, 50000]
     for n in lens:
@@ -41,6 +69,7 @@ def experiment_one_round(expriment_func, experiment_name):
         '2-3-4': lambda: BTree(2),
         'B-tree (degree 8)': lambda: BTree(4),
         'B-tree (degree 16)': lambda: BTree(8),
+        'B+ tree (degree 16)': lambda: BPlusTree(8),
     }
     for tree_name in tree_factories:
         durations = []
@@ -57,5 +86,916 @@ def experiment_one_round(expriment_func, experiment_name):
     plt.savefig(experiment_name)
     plt.clf()
 
-experiment_one_round(experiment_insert, 'benchmark-insert')
-experiment_one_round(experiment_insert_delete_insert, 'benchmark-insert-delete-insert')
\ No newline at end of file
+def experiment_bulk_load(experiment_name):
+    need_plt()
+    lens = [1000, 10000, 50000, 100000, 200000]
+    builders = {
+        'insert loop (sorted)': lambda arr: experiment_insert(sorted(arr), BTree(8)),
+        'insert loop (shuffled)': lambda arr: experiment_insert(arr, BTree(8)),
+        'from_sorted': lambda arr: BTree.from_sorted(sorted(arr), 8),
+        'bulk_load (shuffled)': lambda arr: BTree.bulk_load(arr, 8),
+    }
+    arrs = []
+    for n in lens:
+        arr = [i for i in range(-n, n)]
+        random.shuffle(arr)
+        arrs.append(arr)
+    for builder_name, builder in builders.items():
+        durations = []
+        for arr in arrs:
+            print(experiment_name, builder_name, 'with', len(arr), 'elements...')
+            duration = timing(builder, arr)
+            durations.append(duration)
+            print('Finished with', duration)
+        plt.plot([l * 2 for l in lens], durations, label=builder_name)
+    plt.xlabel('number of loaded elements')
+    plt.ylabel('time (seconds)')
+    plt.legend()
+    plt.savefig(experiment_name)
+    plt.clf()
+
+
+class CopyingNode(BNode):
+    """
+    the node engine as it was before nodes were mutated in place, every restructuring copies the lists it changes
+    and split and fuse build new nodes, only kept for benchmark-node-engine to compare against, set mode only
+    """
+    def split(self):
+        mid = len(self.vals) // 2
+        left = type(self)(self.tree)
+        left.vals = self.vals[:mid]
+        left.set_children(self.children[:mid + 1])
+        right = type(self)(self.tree)
+        right.vals = self.vals[mid + 1:]
+        right.set_children(self.children[mid + 1:])
+        for node in (left, right):
+            node.size = len(node.vals) + sum(child.size for child in node.children)
+        return self.vals[mid], 1, left, right
+
+    def absorb(self, mid, mid_count, left, right):
+        for i, val in enumerate(self.vals):
+            if mid < val:
+                self.vals = self.vals[:i] + [mid] + self.vals[i:]
+                self.set_children(self.children[:i] + [left, right] + self.children[i + 1:])
+                break
+        else:
+            self.vals = self.vals + [mid]
+            self.set_children(self.children[:-1] + [left, right])
+
+    def borrow(self, to, fr):
+        to_node = self.children[to]
+        fr_node = self.children[fr]
+        moved = 1
+        if to < fr:
+            to_node.vals.append(self.vals[to])
+            self.vals[to] = fr_node.vals[0]
+            fr_node.vals = fr_node.vals[1:]
+            if to_node.children:
+                to_node.children.append(fr_node.children[0])
+                fr_node.children = fr_node.children[1:]
+                to_node.children[-1].parent = to_node
+                moved += to_node.children[-1].size
+        else:
+            to_node.vals = [self.vals[fr]] + to_node.vals
+            self.vals[fr] = fr_node.vals[-1]
+            fr_node.vals = fr_node.vals[:-1]
+            if to_node.children:
+                to_node.children = [fr_node.children[-1]] + to_node.children
+                fr_node.children = fr_node.children[:-1]
+                to_node.children[0].parent = to_node
+                moved += to_node.children[0].size
+        to_node.size += moved
+        fr_node.size -= moved
+
+    def fuse(self, a, b):
+        a, b = min(a, b), max(a, b)
+        node_a, node_b = self.children[a], self.children[b]
+        new_node = type(self)(self.tree)
+        new_node.vals = node_a.vals + [self.vals[a]] + node_b.vals
+        new_node.set_children(node_a.children + node_b.children)
+        new_node.size = node_a.size + node_b.size + 1
+        new_node.parent = self
+        del self.vals[a]
+        self.children[a:b + 1] = [new_node]
+        if not self.vals and self is self.tree.root:
+            self.tree.root = new_node
+            new_node.parent = None
+        return new_node
+
+
+def experiment_node_engine(experiment_name, n=20000):
+    """
+    B-tree node engine micro-benchmark across degrees, the in-place engine against the copying one it replaced
+    transient bytes is the memory allocated during an operation on top of what it leaves behind
+    """
+    arr = [i for i in range(n)]
+    random.shuffle(arr)
+    delete = arr[:n // 2]
+
+    def make_tree(d, node_type):
+        # nodes are made with the type of an existing node, so the root decides the engine of the whole tree
+        tree = BTree(d)
+        tree.root.__class__ = node_type
+        return tree
+
+    print(experiment_name, 'with', n, 'elements')
+    print('%8s %10s %14s %14s %18s' % ('degree', 'engine', 'insert (s)', 'delete (s)', 'transient B/op'))
+    for d in [2, 4, 8, 16, 32]:
+        for engine, node_type in [('in place', BNode), ('copying', CopyingNode)]:
+            tree = make_tree(d, node_type)
+            insert_time = timing(experiment_insert, arr, tree)
+            delete_time = timing(lambda: [tree.delete(a) for a in delete])
+            assert(tree.validate() and tree.get_vals() == sorted(arr[n // 2:]))
+            # measure transient allocations op by op on a fresh tree
+            tree = make_tree(d, node_type)
+            transient = 0
+            tracemalloc.start()
+            for op, vals in [(tree.insert, arr), (tree.delete, delete)]:
+                for a in vals:
+                    tracemalloc.reset_peak()
+                    before = tracemalloc.get_traced_memory()[0]
+                    op(a)
+                    after, peak = tracemalloc.get_traced_memory()
+                    transient += peak - max(before, after)
+            tracemalloc.stop()
+            print('%8d %10s %14.4f %14.4f %18.1f' % (2 * d, engine, insert_time, delete_time, transient / (len(arr) + len(delete))))
+
+
+def experiment_batch(experiment_name, n=100000):
+    """batched insert_many/delete_many against per-key insert/delete on a tree already holding n values"""
+    tree_factories = {
+        'splay': lambda: SplayTree(),
+        'red-black': lambda: RedBlackTree(),
+        'B-tree (degree 16)': lambda: BTree(8),
+    }
+    base = random.sample(range(100 * n), n)
+    print(experiment_name, 'on trees with', n, 'elements, keys per second')
+    print('%20s %10s %14s %14s %14s %14s' % ('tree', 'batch', 'insert', 'insert_many', 'delete', 'delete_many'))
+    for tree_name, factory in tree_factories.items():
+        for batch_size in [100, 1000, 10000, 100000]:
+            batch = random.sample(range(100 * n), batch_size)
+            rates = []
+            for batched in [False, True]:
+                tree = factory()
+                # shuffled inserts, a sorted sweep would leave the splay tree as a path
+                experiment_insert(base, tree)
+                if batched:
+                    insert_time = timing(tree.insert_many, batch)
+                    delete_time = timing(tree.delete_many, batch)
+                else:
+                    insert_time = timing(lambda: [tree.insert(a) for a in batch])
+                    delete_time = timing(lambda: [tree.delete(a) for a in batch])
+                rates.append((batch_size / insert_time, batch_size / delete_time))
+            print('%20s %10d %14.0f %14.0f %14.0f %14.0f' % (tree_name, batch_size, rates[0][0], rates[1][0], rates[0][1], rates[1][1]))
+
+
+def rebuild(vals):
+    tree = RedBlackTree()
+    for val in vals:
+        tree.insert(val)
+    return tree
+
+
+def rebuild_union(a, b):
+    return rebuild(sorted(set(a.get_vals()) | set(b.get_vals())))
+
+
+def rebuild_intersection(a, b):
+    return rebuild(sorted(set(a.get_vals()) & set(b.get_vals())))
+
+
+def rebuild_difference(a, b):
+    return rebuild(sorted(set(a.get_vals()) - set(b.get_vals())))
+
+
+def per_key_union(a, b):
+    for val in b.get_vals():
+        a.insert(val)
+    return a
+
+
+def per_key_intersection(a, b):
+    return rebuild(val for val in b.get_vals() if a.has_val(val))
+
+
+def per_key_difference(a, b):
+    for val in b.get_vals():
+        a.delete(val)
+    return a
+
+
+def experiment_set_algebra(experiment_name, n=100000):
+    """
+    join based red-black set algebra on a tree of n and a tree of m values, against
+    rebuilding from get_vals() by per-key inserts, and per-key updates of the larger tree in place
+    """
+    ops = {
+        'union': (rebuild_union, per_key_union, RedBlackTree.union),
+        'intersection': (rebuild_intersection, per_key_intersection, RedBlackTree.intersection),
+        'difference': (rebuild_difference, per_key_difference, RedBlackTree.difference),
+    }
+    keys = random.sample(range(10 * n), n)
+    print(experiment_name, 'with', n, 'values in the larger tree, seconds')
+    print('%14s %10s %12s %12s %12s' % ('operation', 'm', 'rebuild', 'per key', 'join based'))
+    for op_name, funcs in ops.items():
+        for m in [100, 1000, 10000, 100000]:
+            other = random.sample(range(10 * n), m)
+            durations = []
+            for func in funcs:
+                a = RedBlackTree()
+                b = RedBlackTree()
+                experiment_insert(keys, a)
+                experiment_insert(other, b)
+                durations.append(timing(func, a, b))
+            print('%14s %10d %12.4f %12.4f %12.4f' % (op_name, m, *durations))
+
+
+def experiment_persistent(experiment_name, n=100000, snapshots=20):
+    """
+    red-black persistent mode, the memory each retained snapshot keeps alive while updates go on,
+    against copying get_vals() for each frozen view, and the cost of path copying per update
+    """
+    keys = random.sample(range(10 * n), n)
+    print(experiment_name, 'with', n, 'values')
+    for persistent in [False, True]:
+        tree = RedBlackTree(persistent)
+        insert_time = timing(experiment_insert, keys, tree)
+        delete_time = timing(lambda: [tree.delete(a) for a in keys])
+        print('%20s insert %.4fs delete %.4fs' % ('persistent' if persistent else 'mutable', insert_time, delete_time))
+    tree = RedBlackTree(persistent=True)
+    experiment_insert(keys, tree)
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    copy = tree.get_vals()
+    print('a get_vals() copy holds %.0f bytes' % (tracemalloc.get_traced_memory()[0] - before))
+    del copy
+    print('%20s %24s %20s' % ('updates between', 'retained B / snapshot', 'B / update'))
+    for updates in [10, 100, 1000, 10000]:
+        kept = []
+        before = tracemalloc.get_traced_memory()[0]
+        for _ in range(snapshots):
+            kept.append(tree.snapshot())
+            for _ in range(updates // 2):
+                val = random.randrange(10 * n)
+                tree.insert(val)
+                tree.delete(val)
+        # the garbage of the live tree is gone, so the growth is what the snapshots keep alive
+        retained = (tracemalloc.get_traced_memory()[0] - before) / snapshots
+        print('%20d %24.0f %20.1f' % (updates, retained, retained / updates))
+        del kept
+    tracemalloc.stop()
+
+
+def experiment_augmented(experiment_name, n=100000, queries=100):
+    """interval overlap queries and range sums on augmented red-black trees, against scanning get_vals()"""
+    starts = random.sample(range(100 * n), n)
+    intervals = [(start, start + random.randrange(1000)) for start in starts]
+    tree = IntervalTree()
+    experiment_insert(intervals, tree)
+    windows = [(start, start + 1000) for start in random.sample(range(100 * n), queries)]
+    scan_time = timing(lambda: [[i for i in tree.get_vals() if i[0] <= end and i[1] >= start] for start, end in windows])
+    tree_time = timing(lambda: [list(tree.overlap(start, end)) for start, end in windows])
+    print(experiment_name, 'with', n, 'values and', queries, 'queries, seconds')
+    print('%20s %12s %12s' % ('query', 'scan', 'tree'))
+    print('%20s %12.4f %12.4f' % ('interval overlap', scan_time, tree_time))
+    tree = AugmentedRedBlackTree(lambda val: val, lambda a, b: a + b, 0)
+    experiment_insert(starts, tree)
+    scan_time = timing(lambda: [sum(val for val in tree.get_vals() if start <= val < end) for start, end in windows])
+    tree_time = timing(lambda: [tree.aggregate(start, end) for start, end in windows])
+    print('%20s %12.4f %12.4f' % ('range sum', scan_time, tree_time))
+
+
+def experiment_splay_engine(experiment_name, n=100000):
+    """bottom-up splaying against top-down splaying, in seconds and rotations"""
+    orders = {
+        'shuffled': random.sample(range(n), n),
+        # sorted inserts always land next to the root
+        'sorted': list(range(n)),
+    }
+    print(experiment_name, 'with', n, 'values')
+    print('%12s %10s %12s %12s %12s' % ('engine', 'order', 'insert (s)', 'delete (s)', 'rotations'))
+    for tree_name, factory in [('bottom-up', SplayTree), ('top-down', TopDownSplayTree)]:
+        for order_name, arr in orders.items():
+            tree = factory()
+            insert_time = timing(experiment_insert, arr, tree)
+            delete = random.sample(arr, len(arr))
+            delete_time = timing(lambda: [tree.delete(a) for a in delete])
+            print('%12s %10s %12.4f %12.4f %12d' % (tree_name, order_name, insert_time, delete_time, tree.rotate_cnt))
+
+
+def experiment_splay_lookup(experiment_name, n=100000, lookups=200000):
+    """splay tree lookup modes on Zipf distributed reads, in seconds and rotations"""
+    keys = random.sample(range(10 * n), n)
+    modes = {
+        'search': {},
+        'splay': {'lookup': 'splay'},
+        'semi': {'lookup': 'semi'},
+        'splay every 4th': {'lookup': 'splay', 'period': 4},
+        'splay depth >= 20': {'lookup': 'splay', 'min_depth': 20},
+    }
+    print(experiment_name, 'with', n, 'values and', lookups, 'lookups')
+    # depth is the mean depth of the read keys in the tree left behind, what a search of the same mix would walk
+    print('%20s %8s %12s %12s %8s' % ('lookup', 'skew', 'seconds', 'rotations', 'depth'))
+    for skew in [0.8, 1.0, 1.2]:
+        # the i-th most popular key is read with a weight of 1 / i ** skew, the popular keys are spread over the tree
+        cum_weights = []
+        total = 0
+        for i in range(n):
+            total += 1 / (i + 1) ** skew
+            cum_weights.append(total)
+        reads = random.choices(keys, cum_weights=cum_weights, k=lookups)
+        for mode_name, kwargs in modes.items():
+            tree = SplayTree(**kwargs)
+            experiment_insert(keys, tree)
+            rotations = tree.rotate_cnt
+            duration = timing(lambda: [tree.has_val(a) for a in reads])
+            depth = sum(len(tree._search_path(a)[1]) for a in reads) / lookups
+            print('%20s %8.1f %12.4f %12d %8.1f' % (mode_name, skew, duration, tree.rotate_cnt - rotations, depth))
+
+
+def experiment_sequence(experiment_name, edits=10000):
+    """random edits of a list-based buffer against a SplaySequence, an insert at an index and a cut of up to 100 values"""
+    print(experiment_name, 'with', edits, 'edits, seconds')
+    print('%10s %12s %12s' % ('n', 'list', 'sequence'))
+    for n in [10000, 100000, 1000000]:
+        ops = [(random.randrange(n), random.randrange(100)) for _ in range(edits)]
+
+        def edit_list(buf):
+            for i, k in ops:
+                buf.insert(i, i)
+                del buf[i:i + k]
+                buf.extend(range(k))
+
+        def edit_sequence(seq):
+            for i, k in ops:
+                seq.insert(i, i)
+                seq.cut(i, i + k)
+                seq.extend(range(k))
+
+        list_time = timing(edit_list, list(range(n)))
+        sequence_time = timing(edit_sequence, SplaySequence(range(n)))
+        print('%10d %12.4f %12.4f' % (n, list_time, sequence_time))
+
+
+def zipf(keys, k, skew=1.2, rng=random):
+    """k keys drawn so that the i-th key of keys is read with a weight of 1 / i ** skew"""
+    cum_weights = []
+    total = 0
+    for i in range(len(keys)):
+        total += 1 / (i + 1) ** skew
+        cum_weights.append(total)
+    return rng.choices(keys, cum_weights=cum_weights, k=k)
+
+
+def experiment_sorted_set(experiment_name, n=100000, ops=100000):
+    """
+    the cost table of the SortedSet backends in microseconds per operation, which Sorted.COSTS copies,
+    then a workload in phases on each fixed backend against an adaptive set
+    """
+    keys = random.sample(range(10 * n), n)
+    loaded = sorted(keys)
+    fresh = random.sample(range(10 * n, 20 * n), ops)
+    patterns = {
+        ('read', 'random'): random.choices(keys, k=ops),
+        ('read', 'skewed'): zipf(keys, ops),
+        ('read', 'sequential'): loaded[:ops],
+        ('write', 'random'): fresh,
+        ('write', 'sequential'): sorted(fresh),
+    }
+    print(experiment_name, 'with', n, 'values, microseconds per operation')
+    print('%12s %14s %14s %18s %14s %18s %10s' % ('backend', *('%s %s' % pattern for pattern in patterns), 'rebuild'))
+    for backend, build in BACKENDS.items():
+        costs = []
+        for (kind, _), arr in patterns.items():
+            # the best of 3 rounds, each on a fresh tree
+            durations = []
+            for _ in range(3):
+                tree = build(loaded)
+                if kind == 'read':
+                    durations.append(timing(lambda: [tree.has_val(a) for a in arr]) / len(arr))
+                else:
+                    insert_time = timing(lambda: [tree.insert(a) for a in arr])
+                    durations.append((insert_time + timing(lambda: [tree.delete(a) for a in arr])) / (2 * len(arr)))
+            costs.append(min(durations))
+        rebuild = min(timing(lambda: build(list(tree))) for _ in range(3)) / n
+        print('%12s %14.2f %14.2f %18.2f %14.2f %18.2f %10.2f' % (backend, *(cost * 1e6 for cost in costs), rebuild * 1e6))
+
+    phases = [
+        ('sequential load', [('add', a) for a in loaded]),
+        ('skewed reads', [('contains', a) for a in zipf(keys, 2 * ops)]),
+        ('random writes', [(random.choice(['add', 'discard']), a) for a in random.choices(keys, k=2 * ops)]),
+        ('random reads', [('contains', a) for a in random.choices(keys, k=2 * ops)]),
+    ]
+    print('%20s %s' % ('set', ' '.join('%16s' % phase for phase, _ in phases)))
+    sets = [(backend, lambda backend=backend: SortedSet(backend=backend, adaptive=False)) for backend in BACKENDS]
+    sets.append(('adaptive', lambda: SortedSet()))
+    for set_name, factory in sets:
+        s = factory()
+        durations = []
+        for _, phase in phases:
+            durations.append(timing(lambda: [getattr(s, op)(a) if op != 'contains' else a in s for op, a in phase]))
+        print('%20s %s' % (set_name, ' '.join('%16.4f' % duration for duration in durations)))
+    for decision in s.decisions:
+        if decision['migrated']:
+            print('migrated from', decision['from'], 'to', decision['to'], 'after', decision['op'], 'operations')
+
+
+class LockedTree:
+    """a BTree behind one global lock, what a sharded tree is measured against"""
+    def __init__(self, vals):
+        self.tree = BTree.from_sorted(vals, 8)
+        self.lock = threading.Lock()
+
+    def insert(self, val):
+        with self.lock:
+            return self.tree.insert(val)
+
+    def delete(self, val):
+        with self.lock:
+            return self.tree.delete(val)
+
+    def has_val(self, val):
+        with self.lock:
+            return self.tree.has_val(val)
+
+
+def experiment_sharded(experiment_name, n=100000, ops=200000):
+    """
+    threads sharing a tree, 80% lookups and 20% updates, against one global lock around a BTree,
+    then batch lookups and the build of shared-nothing shards in worker processes against one process
+    """
+    keys = sorted(random.sample(range(10 * n), n))
+    print(experiment_name, 'with', n, 'values and', ops, 'operations on', os.cpu_count(), 'cores, operations per second')
+    print('%10s %16s %16s' % ('threads', 'global lock', 'sharded'))
+    for thread_count in [1, 2, 4, 8]:
+        rates = []
+        for factory in [LockedTree, lambda vals: ShardedTree(vals, shards=16, shard_size=n // 8)]:
+            tree = factory(keys)
+
+            def work(seed):
+                rng = random.Random(seed)
+                for _ in range(ops // thread_count):
+                    val = rng.randrange(10 * n)
+                    op = rng.random()
+                    if op < 0.8:
+                        tree.has_val(val)
+                    elif op < 0.9:
+                        tree.insert(val)
+                    else:
+                        tree.delete(val)
+
+            threads = [threading.Thread(target=work, args=(seed, )) for seed in range(thread_count)]
+
+            def run():
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+
+            rates.append(ops / timing(run))
+        print('%10d %16.0f %16.0f' % (thread_count, *rates))
+
+    queries = [random.randrange(10 * n) for _ in range(10 * n)]
+    tree = BTree.from_sorted(keys, 8)
+    print('%24s %12s %20s' % ('processes', 'build (s)', 'contains_many (s)'))
+    build_time = timing(BTree.from_sorted, keys, 8)
+    lookup_time = timing(lambda: [tree.has_val(a) for a in queries])
+    print('%24s %12.4f %20.4f' % ('one process', build_time, lookup_time))
+    for shards in sorted({2, os.cpu_count() or 1}):
+        tic = time.perf_counter()
+        sharded = ProcessShardedTree(keys, shards=shards)
+        # the workers build their shards when first called
+        sharded.contains_many([])
+        build_time = time.perf_counter() - tic
+        lookup_time = timing(sharded.contains_many, queries)
+        sharded.close()
+        print('%24s %12.4f %20.4f' % ('%d shard processes' % shards, build_time, lookup_time))
+
+
+def experiment_stats(experiment_name, n=100000):
+    """random inserts, lookups and deletes with stats disabled, enabled, and enabled counting one operation in 16, and what the stats counted"""
+    arr = random.sample(range(n), n)
+    print(experiment_name, 'with', n, 'values, seconds for the inserts, lookups and deletes')
+    print('%20s %12s %12s %10s %12s %10s' % ('tree', 'disabled', 'enabled', 'overhead', '1 in 16', 'overhead'))
+    counted = {}
+    for tree_name, factory in [('btree', lambda: BTree(8)), ('red-black', RedBlackTree), ('splay', SplayTree), ('splay-top-down', TopDownSplayTree)]:
+        times = []
+        for sample_every in [None, 1, 16]:
+            tree = factory()
+            if sample_every is not None:
+                stats = enable_stats(tree, sample_every=sample_every)
+
+            def run():
+                for a in arr:
+                    tree.insert(a)
+                for a in arr:
+                    tree.has_val(a)
+                for a in arr:
+                    tree.delete(a)
+
+            times.append(timing(run))
+            if sample_every == 1:
+                counted[tree_name] = stats.snapshot()['per_op']
+        print('%20s %12.4f %12.4f %9.0f%% %12.4f %9.0f%%' % (tree_name, times[0], times[1], 100 * (times[1] / times[0] - 1), times[2], 100 * (times[2] / times[0] - 1)))
+    print('%20s' % 'per operation', *('%11s' % counter[:11] for counter in next(iter(counted.values()))))
+    for tree_name, per_op in counted.items():
+        print('%20s' % tree_name, *('%11.2f' % mean for mean in per_op.values()))
+
+
+def sawtooth(n, teeth=10):
+    """n distinct keys in teeth ascending runs, each run sweeping the whole range between the keys of the others"""
+    return [i * teeth + tooth for tooth in range(teeth) for i in range(n // teeth)]
+
+
+def experiment_stress(experiment_name, n=10000000):
+    """
+    sequential, reverse and sawtooth inserts, which leave a splay tree as deep as a path,
+    then a full walk of the values, at the default recursion limit
+    """
+    orders = {
+        'sequential': lambda: range(n),
+        'reverse': lambda: range(n - 1, -1, -1),
+        'sawtooth': lambda: sawtooth(n),
+    }
+    print(experiment_name, 'with', n, 'values at recursion limit', sys.getrecursionlimit())
+    print('%16s %12s %12s %12s' % ('tree', 'order', 'insert (s)', 'get_vals (s)'))
+    for tree_name, factory in [('btree', lambda: BTree(8)), ('red-black', RedBlackTree), ('splay', SplayTree), ('splay-top-down', TopDownSplayTree)]:
+        for order_name, order in orders.items():
+            tree = factory()
+            keys = order()
+            insert_time = timing(experiment_insert, keys, tree)
+            tic = time.perf_counter()
+            vals = tree.get_vals()
+            walk_time = time.perf_counter() - tic
+            assert(len(vals) == len(keys) and all(v1 < v2 for v1, v2 in zip(vals, islice(vals, 1, None))))
+            print('%16s %12s %12.2f %12.2f' % (tree_name, order_name, insert_time, walk_time))
+            del tree, keys, vals
+
+
+def experiment_snapshot(experiment_name, n=10000000):
+    """dump and load of a snapshot file against pickle and against inserting every value again"""
+    keys = sorted(random.sample(range(10 * n), n))
+    path = experiment_name + '.snapshot'
+    print(experiment_name, 'with', n, 'int values')
+    print('%12s %10s %10s %10s %12s %12s %12s' % ('tree', 'dump (s)', 'load (s)', 'size (MB)', 'pickle (s)', 'unpickle (s)', 'insert (s)'))
+    for tree_name, tree_type, build in [
+        ('btree', BTree, lambda vals: BTree.from_sorted(vals, 8)),
+        ('red-black', RedBlackTree, RedBlackTree.from_sorted),
+        ('splay', SplayTree, SplayTree.from_sorted),
+    ]:
+        # at most one tree is alive at a time, to fit 10M values in memory
+        tree = build(keys)
+        dump_time = timing(tree.dump, path)
+        size = os.path.getsize(path) / 2 ** 20
+        try:
+            tic = time.perf_counter()
+            data = pickle.dumps(tree, pickle.HIGHEST_PROTOCOL)
+            pickle_time = time.perf_counter() - tic
+            del tree
+            unpickle_time = timing(pickle.loads, data)
+            del data
+            pickled = '%12.2f %12.2f' % (pickle_time, unpickle_time)
+        except RecursionError:
+            pickled = '%25s' % 'RecursionError'
+        tree = None
+        tic = time.perf_counter()
+        tree = tree_type.load(path)
+        load_time = time.perf_counter() - tic
+        assert(tree.get_vals() == keys)
+        tree = None
+        insert_time = timing(experiment_insert, keys, build([]))
+        print('%12s %10.2f %10.2f %10.1f %s %12.2f' % (tree_name, dump_time, load_time, size, pickled, insert_time))
+    os.remove(path)
+
+
+def experiment_frozen(experiment_name, n=10000000, queries=1000000):
+    """batch lookups, ranks and range counts on a frozen BTree against a Python loop over the BTree"""
+    if np is None:
+        raise ImportError('benchmark-frozen needs numpy')
+    tree = BTree.from_sorted(range(0, 2 * n, 2), 8)
+    freeze_time = timing(tree.freeze)
+    frozen = tree.freeze()
+    keys = np.random.randint(0, 2 * n, queries)
+    lo = np.random.randint(0, 2 * n, queries)
+    hi = lo + np.random.randint(0, 1000, queries)
+    key_list, lo_list, hi_list = keys.tolist(), lo.tolist(), hi.tolist()
+    print(experiment_name, 'with', n, 'values and', queries, 'queries, freeze took %.2f s' % freeze_time)
+    print('%16s %12s %12s %12s' % ('query', 'BTree (s)', 'frozen (s)', 'searchsorted (s)'))
+    rows = [
+        ('contains', lambda: [tree.has_val(a) for a in key_list], lambda: frozen.contains_many(keys),
+         lambda: frozen.vals[np.minimum(np.searchsorted(frozen.vals, keys), n - 1)] == keys),
+        ('rank', lambda: [tree.rank(a) for a in key_list], lambda: frozen.rank_many(keys),
+         lambda: np.searchsorted(frozen.vals, keys)),
+        ('range count', lambda: [tree.count_range(a, b) for a, b in zip(lo_list, hi_list)], lambda: frozen.range_count_many(lo, hi),
+         lambda: np.searchsorted(frozen.vals, hi) - np.searchsorted(frozen.vals, lo)),
+    ]
+    for query, loop, batch, baseline in rows:
+        assert(np.array_equal(np.asarray(loop()), batch()) and np.array_equal(batch(), baseline()))
+        print('%16s %12.3f %12.3f %12.3f' % (query, timing(loop), timing(batch), timing(baseline)))
+
+
+def experiment_neighbours(experiment_name, n=1000000, queries=100000):
+    """ceiling and peeks at the min against bisect over get_vals, which is what callers did before"""
+    keys = random.sample(range(10 * n), n)
+    targets = [random.randrange(10 * n) for _ in range(queries)]
+    print(experiment_name, 'with', n, 'values, microseconds per query')
+    print('%12s %12s %12s %20s' % ('tree', 'ceiling', 'min', 'bisect on get_vals'))
+    for tree_name, factory in [('btree', lambda: BTree(8)), ('red-black', RedBlackTree)]:
+        tree = factory()
+        tree.insert_many(keys)
+        ceiling_time = timing(lambda: [tree.ceiling(a) for a in targets])
+        min_time = timing(lambda: [tree.min() for _ in targets])
+
+        def listed_ceiling(a):
+            vals = tree.get_vals()
+            i = bisect.bisect_left(vals, a)
+            return vals[i] if i < len(vals) else None
+
+        # a full listing per query, so only a few of them
+        few = targets[:20]
+        assert([listed_ceiling(a) for a in few] == [tree.ceiling(a) for a in few])
+        bisect_time = timing(lambda: [listed_ceiling(a) for a in few])
+        print('%12s %12.2f %12.2f %20.0f' % (tree_name, ceiling_time / queries * 1e6, min_time / queries * 1e6, bisect_time / len(few) * 1e6))
+
+
+experiments = {
+    'benchmark-insert': lambda: experiment_one_round(experiment_insert, 'benchmark-insert'),
+    'benchmark-insert-delete-insert': lambda: experiment_one_round(experiment_insert_delete_insert, 'benchmark-insert-delete-insert'),
+    'benchmark-bulk-load': lambda: experiment_bulk_load('benchmark-bulk-load'),
+    'benchmark-node-engine': lambda: experiment_node_engine('benchmark-node-engine'),
+    'benchmark-batch': lambda: experiment_batch('benchmark-batch'),
+    'benchmark-set-algebra': lambda: experiment_set_algebra('benchmark-set-algebra'),
+    'benchmark-persistent': lambda: experiment_persistent('benchmark-persistent'),
+    'benchmark-augmented': lambda: experiment_augmented('benchmark-augmented'),
+    'benchmark-splay-engine': lambda: experiment_splay_engine('benchmark-splay-engine'),
+    'benchmark-sequence': lambda: experiment_sequence('benchmark-sequence'),
+    'benchmark-splay-lookup': lambda: experiment_splay_lookup('benchmark-splay-lookup'),
+    'benchmark-sorted-set': lambda: experiment_sorted_set('benchmark-sorted-set'),
+    'benchmark-sharded': lambda: experiment_sharded('benchmark-sharded'),
+    'benchmark-stats': lambda: experiment_stats('benchmark-stats'),
+    'benchmark-stress': lambda: experiment_stress('benchmark-stress'),
+    'benchmark-snapshot': lambda: experiment_snapshot('benchmark-snapshot'),
+    'benchmark-frozen': lambda: experiment_frozen('benchmark-frozen'),
+    'benchmark-neighbours': lambda: experiment_neighbours('benchmark-neighbours'),
+}
+
+
+# the suite: workloads of single operations on each tree, with per-operation latencies and memory
+
+suite_trees = {
+    'btree': lambda: BTree(8),
+    'bplus': lambda: BPlusTree(8),
+    'red-black': lambda: RedBlackTree(),
+    'splay': lambda: SplayTree(),
+    'splay-top-down': lambda: TopDownSplayTree(),
+}
+
+workloads = {}
+
+
+def workload(name):
+    """
+    register a workload, a function of n and a random.Random returning the values loaded beforehand,
+    unmeasured, and the measured operations as (operation, argument) pairs
+    an operation is insert, delete, has_val or scan, which reads 100 values from the argument on
+    """
+    def register(func):
+        workloads[name] = func
+        return func
+    return register
+
+
+@workload('random-insert')
+def workload_random_insert(n, rng):
+    return [], [('insert', a) for a in rng.sample(range(n), n)]
+
+
+@workload('sequential-insert')
+def workload_sequential_insert(n, rng):
+    return [], [('insert', a) for a in range(n)]
+
+
+@workload('reverse-insert')
+def workload_reverse_insert(n, rng):
+    return [], [('insert', a) for a in range(n, 0, -1)]
+
+
+@workload('zipf-read')
+def workload_zipf_read(n, rng):
+    keys = rng.sample(range(n), n)
+    return keys, [('has_val', a) for a in zipf(keys, n, rng=rng)]
+
+
+@workload('read-heavy')
+def workload_read_heavy(n, rng):
+    """90% lookups, 5% inserts and 5% deletes of uniform keys, half of them present"""
+    keys = rng.sample(range(2 * n), n)
+    ops = []
+    for _ in range(n):
+        op = rng.random()
+        ops.append(('has_val' if op < 0.9 else 'insert' if op < 0.95 else 'delete', rng.randrange(2 * n)))
+    return keys, ops
+
+
+@workload('range-scan')
+def workload_range_scan(n, rng):
+    keys = rng.sample(range(n), n)
+    return keys, [('scan', rng.randrange(n)) for _ in range(n // 10)]
+
+
+@workload('delete-heavy')
+def workload_delete_heavy(n, rng):
+    """80% deletes and 20% inserts, of keys present and new"""
+    keys = rng.sample(range(2 * n), n)
+    ops = []
+    for _ in range(n):
+        ops.append(('delete' if rng.random() < 0.8 else 'insert', rng.randrange(2 * n)))
+    return keys, ops
+
+
+def dispatch(tree):
+    return {
+        'insert': tree.insert,
+        'delete': tree.delete,
+        'has_val': tree.has_val,
+        'scan': lambda lo: sum(1 for _ in islice(tree.irange(lo), 100)),
+    }
+
+
+def run_ops(factory, loaded, ops):
+    """run the operations on a freshly loaded tree, return the latency of each in nanoseconds"""
+    tree = factory()
+    for val in loaded:
+        tree.insert(val)
+    funcs = dispatch(tree)
+    latencies = []
+    clock = time.perf_counter_ns
+    for op, arg in ops:
+        func = funcs[op]
+        tic = clock()
+        func(arg)
+        latencies.append(clock() - tic)
+    return latencies
+
+
+def measure_memory(factory, loaded, ops):
+    """bytes per loaded value, and the peak bytes above the start while loading and running, by tracemalloc"""
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    tree = factory()
+    for val in loaded:
+        tree.insert(val)
+    bytes_per_key = (tracemalloc.get_traced_memory()[0] - before) / len(loaded) if loaded else None
+    funcs = dispatch(tree)
+    for op, arg in ops:
+        funcs[op](arg)
+    peak = tracemalloc.get_traced_memory()[1] - before
+    if not loaded:
+        # the values are all inserted by the operations
+        bytes_per_key = (tracemalloc.get_traced_memory()[0] - before) / max(1, sum(1 for _ in tree))
+    tracemalloc.stop()
+    return peak, bytes_per_key
+
+
+def percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+def run_suite(tree_names, workload_names, n, repeat, warmup, seed):
+    """run each workload on each tree, warmup unmeasured rounds first, return the results as a JSON ready dict"""
+    results = []
+    for workload_name in workload_names:
+        loaded, ops = workloads[workload_name](n, random.Random(seed))
+        for tree_name in tree_names:
+            factory = suite_trees[tree_name]
+            for _ in range(warmup):
+                run_ops(factory, loaded, ops)
+            rounds = [run_ops(factory, loaded, ops) for _ in range(repeat)]
+            throughputs = [len(ops) / (sum(latencies) / 1e9) for latencies in rounds]
+            ordered = sorted(latency for latencies in rounds for latency in latencies)
+            peak, bytes_per_key = measure_memory(factory, loaded, ops)
+            result = {
+                'tree': tree_name,
+                'workload': workload_name,
+                'ops': len(ops),
+                'throughput': throughputs,
+                'median_throughput': sorted(throughputs)[len(throughputs) // 2],
+                'latency_ns': {
+                    'mean': sum(ordered) / len(ordered),
+                    'p50': percentile(ordered, 50),
+                    'p90': percentile(ordered, 90),
+                    'p99': percentile(ordered, 99),
+                    'p99.9': percentile(ordered, 99.9),
+                    'max': ordered[-1],
+                },
+                'peak_bytes': peak,
+                'bytes_per_key': bytes_per_key,
+            }
+            results.append(result)
+            latency = result['latency_ns']
+            print('%16s %18s %12.0f %10d %10d %10d %12d %10s' % (
+                tree_name, workload_name, result['median_throughput'], latency['p50'], latency['p99'], latency['p99.9'],
+                peak, '-' if bytes_per_key is None else '%.1f' % bytes_per_key))
+    return {
+        'meta': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'n': n,
+            'repeat': repeat,
+            'warmup': warmup,
+            'seed': seed,
+        },
+        'results': results,
+    }
+
+
+def plot_suite(report, path):
+    need_plt()
+    tree_names = sorted({result['tree'] for result in report['results']})
+    workload_names = sorted({result['workload'] for result in report['results']})
+    width = 0.8 / len(tree_names)
+    for i, tree_name in enumerate(tree_names):
+        throughputs = {result['workload']: result['median_throughput'] for result in report['results'] if result['tree'] == tree_name}
+        plt.bar([j + i * width for j in range(len(workload_names))], [throughputs.get(name, 0) for name in workload_names], width, label=tree_name)
+    plt.xticks([j + 0.4 - width / 2 for j in range(len(workload_names))], workload_names, rotation=30, ha='right')
+    plt.ylabel('operations per second')
+    plt.legend()
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.clf()
+
+
+def compare_reports(base, new, threshold):
+    """
+    print the change of each tree and workload in both reports, return the regressions
+    a regression is a median throughput lower, or a p99 latency or peak memory higher, by more than threshold
+    """
+    base_results = {(result['tree'], result['workload']): result for result in base['results']}
+    regressions = []
+    print('%16s %18s %12s %12s %12s  %s' % ('tree', 'workload', 'throughput', 'p99', 'peak', ''))
+    for result in new['results']:
+        key = (result['tree'], result['workload'])
+        if key not in base_results:
+            continue
+        old = base_results[key]
+        changes = {
+            'throughput': result['median_throughput'] / old['median_throughput'] - 1,
+            'p99': result['latency_ns']['p99'] / max(1, old['latency_ns']['p99']) - 1,
+            'peak': result['peak_bytes'] / max(1, old['peak_bytes']) - 1,
+        }
+        flags = [name for name, change in changes.items() if (-change if name == 'throughput' else change) > threshold]
+        if flags:
+            regressions.append((key, flags))
+        print('%16s %18s %+11.1f%% %+11.1f%% %+11.1f%%  %s' % (
+            *key, 100 * changes['throughput'], 100 * changes['p99'], 100 * changes['peak'], 'REGRESSION ' + ', '.join(flags) if flags else ''))
+    return regressions
+
+
+def suite_main(argv):
+    parser = argparse.ArgumentParser(prog='benchmark.py suite', description='run the benchmark suite')
+    parser.add_argument('--trees', nargs='+', default=list(suite_trees), choices=list(suite_trees))
+    parser.add_argument('--workloads', nargs='+', default=list(workloads), choices=list(workloads))
+    parser.add_argument('-n', type=int, default=20000, help='values per workload')
+    parser.add_argument('--repeat', type=int, default=5, help='measured rounds')
+    parser.add_argument('--warmup', type=int, default=1, help='unmeasured rounds before them')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--json', help='write the report to this file')
+    parser.add_argument('--plot', help='plot the median throughputs to this image, needs matplotlib')
+    args = parser.parse_args(argv)
+    print('%16s %18s %12s %10s %10s %10s %12s %10s' % ('tree', 'workload', 'ops/s', 'p50 ns', 'p99 ns', 'p99.9 ns', 'peak B', 'B/key'))
+    report = run_suite(args.trees, args.workloads, args.n, args.repeat, args.warmup, args.seed)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=1)
+    if args.plot:
+        plot_suite(report, args.plot)
+
+
+def compare_main(argv):
+    parser = argparse.ArgumentParser(prog='benchmark.py compare', description='flag regressions between two suite reports')
+    parser.add_argument('base')
+    parser.add_argument('new')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change that counts as a regression')
+    args = parser.parse_args(argv)
+    with open(args.base) as f:
+        base = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    regressions = compare_reports(base, new, args.threshold)
+    print(len(regressions), 'regressions')
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    # benchmark.py suite [options], benchmark.py compare base.json new.json
+    # or the given experiments, or the original two when none is given
+    if sys.argv[1:2] == ['suite']:
+        suite_main(sys.argv[2:])
+    elif sys.argv[1:2] == ['compare']:
+        compare_main(sys.argv[2:])
+    else:
+        names = sys.argv[1:] or ['benchmark-insert', 'benchmark-insert-delete-insert']
+        for name in names:
+            experiments[name]()